@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+豆包结果返回格式基准测试
+功能：对比 response_format=url（生成后再下载）与 response_format=b64_json（内联返回）
+      两种模式的端到端耗时和Python内存峰值，用于为每个部署选择更快的模式
+
+用法：
+    python benchmark_response_format.py --mask data/masks/xxx_composite_mask.png --furniture data/furniture/sofa_1.jpg
+    python benchmark_response_format.py --mask ... --furniture ... --runs 5 --formats url,b64_json
+
+注意：每次运行都会真实调用豆包API（会产生费用）；离线测试可设置 ARK_BASE_URL 指向 mock_provider_server.py
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import tracemalloc
+import statistics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, 'src'))
+
+import app as ai_app  # noqa: E402
+
+PROMPT_TEXT = "在图一客厅中我涂成蓝色的部分放置图二中选择的沙发，要求自然的融入到图一中"
+
+def run_once(mask_path, furniture_path, response_format, output_dir):
+    """
+    执行一次 生成 + 写盘，返回耗时和内存峰值
+
+    返回:
+        dict: {'total': 秒, 'provider': 秒, 'save': 秒, 'peak_mb': MB, 'bytes': 写入字节数}
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = ai_app.call_doubao_image_fusion(mask_path, furniture_path, PROMPT_TEXT,
+                                             response_format=response_format)
+    provider_done = time.perf_counter()
+
+    if not result['success']:
+        tracemalloc.stop()
+        raise RuntimeError(result['error'])
+
+    written = 0
+    for i, image in enumerate(result['images']):
+        output_path = os.path.join(output_dir, f"bench_{response_format}_{i}.jpg")
+        written += ai_app.save_generated_image(image, output_path, timeout=60)
+    end = time.perf_counter()
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'total': end - start,
+        'provider': provider_done - start,
+        'save': end - provider_done,
+        'peak_mb': peak / 1024 / 1024,
+        'bytes': written
+    }
+
+def summarize(samples, key):
+    values = [s[key] for s in samples]
+    return statistics.median(values), max(values)
+
+def main():
+    parser = argparse.ArgumentParser(description='对比豆包 url / b64_json 返回格式的耗时和内存峰值')
+    parser.add_argument('--mask', required=True, help='叠加mask图片路径（场景+蓝色涂抹）')
+    parser.add_argument('--furniture', required=True, help='家具图片路径')
+    parser.add_argument('--runs', type=int, default=3, help='每种模式运行次数')
+    parser.add_argument('--formats', default='url,b64_json', help='要测试的返回格式，逗号分隔')
+    parser.add_argument('--json', dest='json_path', help='将原始结果写入JSON文件')
+    args = parser.parse_args()
+
+    formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    results = {}
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        # 交替运行两种模式，减少服务商负载波动对结果的影响
+        for run in range(args.runs):
+            for response_format in formats:
+                sample = run_once(args.mask, args.furniture, response_format, output_dir)
+                results.setdefault(response_format, []).append(sample)
+                print(f"[{run + 1}/{args.runs}] {response_format:9s} 总耗时={sample['total']:.2f}s "
+                      f"生成={sample['provider']:.2f}s 写盘={sample['save']:.2f}s 内存峰值={sample['peak_mb']:.1f}MB")
+
+    print("\n" + "=" * 72)
+    print(f"{'格式':10s}{'总耗时中位数':>14s}{'写盘中位数':>12s}{'内存峰值中位数':>16s}{'内存峰值最大':>14s}")
+    for response_format, samples in results.items():
+        total_median, _ = summarize(samples, 'total')
+        save_median, _ = summarize(samples, 'save')
+        peak_median, peak_max = summarize(samples, 'peak_mb')
+        print(f"{response_format:10s}{total_median:>13.2f}s{save_median:>11.2f}s{peak_median:>15.1f}MB{peak_max:>13.1f}MB")
+    print("=" * 72)
+
+    if len(results) > 1:
+        fastest = min(results, key=lambda f: summarize(results[f], 'total')[0])
+        print(f"建议: 设置 DOUBAO_RESPONSE_FORMAT={fastest}")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"原始结果已写入: {args.json_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+家具目录清单编译工具
+功能：把 data/furniture 下的元数据和图片头信息（像素尺寸、宽高比、是否带透明通道）编译成
+      定长记录+字符串表的二进制清单 data/catalog/furniture_manifest.bin，并预先建好查询索引
+      （排序后的长宽、风格/类型倒排表），各worker通过mmap只读加载，不再逐个解析 furniture_metadata.json、
+      扫描目录和建索引
+
+用法：
+    python build_catalog_manifest.py
+    python build_catalog_manifest.py --workers 16
+
+注意：清单中记录了编译时家具目录和元数据文件的mtime，之后修改家具目录或元数据文件会使清单过期，
+      服务会自动回退到读取JSON，需要重新运行本工具；新清单通过原子rename替换，运行中的服务会自动切换；
+      服务只读取固定路径 data/catalog/furniture_manifest.bin，因此不提供输出路径参数
+"""
+
+import os
+import sys
+import time
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, 'src'))
+
+import app as ai_app  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description='编译家具目录二进制清单')
+    parser.add_argument('--workers', type=int, default=8, help='读取图片头信息的线程数')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = ai_app.build_catalog_manifest(workers=args.workers)
+    elapsed = time.perf_counter() - start
+
+    print(f"已生成: {ai_app.CATALOG_MANIFEST_PATH}")
+    print(f"家具数量: {result['items']}  清单大小: {result['bytes']} 字节  耗时: {elapsed:.2f}s")
+    if result['unreadable']:
+        print(f"以下 {len(result['unreadable'])} 个文件无法读取图片头信息（清单中尺寸为空）:")
+        for name in result['unreadable']:
+            print(f"  - {name}")
+
+if __name__ == '__main__':
+    main()
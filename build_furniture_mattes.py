@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+家具抠图生成工具
+功能：为 data/furniture 下的每张家具图片估计背景色、生成alpha抠图并裁掉空白边距，
+      保存为透明背景的RGBA PNG（data/catalog/mattes/<文件名>.matte.png）和API用JPEG，
+      裁剪框等信息写入 data/catalog/mattes/mattes.json；
+      遮罩图生成和服务商请求优先使用抠图，遮罩更贴合家具、上传的图片更小
+
+用法：
+    python build_furniture_mattes.py              # 增量更新：只处理新增或修改过的图片
+    python build_furniture_mattes.py --full       # 全部重新生成
+    python build_furniture_mattes.py --workers 8
+
+注意：背景不是纯色（四周像素颜色不一致）的图片会被跳过，继续使用原图；
+      设置 MATTE_ENABLED=false 可让服务商请求不使用抠图
+"""
+
+import os
+import sys
+import time
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, 'src'))
+
+import app as ai_app  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description='生成家具抠图（增量更新）')
+    parser.add_argument('--full', action='store_true', help='忽略已有抠图，全部重新生成')
+    parser.add_argument('--workers', type=int, default=None, help='生成进程数（默认CPU核数）')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = ai_app.build_furniture_mattes(workers=args.workers, full=args.full)
+    elapsed = time.perf_counter() - start
+
+    print(f"已更新: {ai_app.MATTE_FOLDER}")
+    print(f"抠图数量: {result['items']}  新生成: {result['computed']}  复用: {result['reused']}  "
+          f"移除: {result['removed']}  耗时: {elapsed:.2f}s")
+    if result['area_ratio'] is not None:
+        print(f"裁掉空白边距后的面积为原图的 {result['area_ratio'] * 100:.1f}%")
+    if result['skipped']:
+        print(f"以下 {len(result['skipped'])} 个文件背景不是纯色或找不到前景（继续使用原图）:")
+        for name in result['skipped']:
+            print(f"  - {name}")
+    if result['failed']:
+        print(f"以下 {len(result['failed'])} 个文件无法读取:")
+        for name in result['failed']:
+            print(f"  - {name}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+家具视觉描述子生成工具
+功能：为 data/furniture 下的每张家具图片计算视觉描述子（前景HSV颜色直方图 + 64位dHash），
+      存成连续的NumPy矩阵（data/catalog/visual_hist.*.npy、visual_hash.*.npy）和索引 visual_index.json，
+      供 /furniture/<filename>/similar 做向量化的相似家具查询
+
+用法：
+    python build_visual_descriptors.py              # 增量更新：只计算新增或修改过的图片
+    python build_visual_descriptors.py --full       # 全部重新计算
+    python build_visual_descriptors.py --workers 8
+
+注意：需要安装 numpy；索引原子替换，运行中的服务会在下一次查询时自动加载新索引
+"""
+
+import os
+import sys
+import time
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, 'src'))
+
+import app as ai_app  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description='计算家具图片的视觉描述子（增量更新）')
+    parser.add_argument('--full', action='store_true', help='忽略已有索引，全部重新计算')
+    parser.add_argument('--workers', type=int, default=None, help='计算进程数（默认CPU核数）')
+    args = parser.parse_args()
+
+    if not ai_app.NUMPY_AVAILABLE:
+        print("错误: 需要安装 numpy（pip install -r requirements.txt）")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    result = ai_app.build_visual_index(workers=args.workers, full=args.full)
+    elapsed = time.perf_counter() - start
+
+    print(f"已更新: {ai_app.VISUAL_INDEX_PATH}")
+    print(f"家具数量: {result['items']}  新计算: {result['computed']}  复用: {result['reused']}  "
+          f"移除: {result['removed']}  耗时: {elapsed:.2f}s")
+    if result['failed']:
+        print(f"以下 {len(result['failed'])} 个文件无法计算描述子（未加入索引）:")
+        for name in result['failed']:
+            print(f"  - {name}")
+
+if __name__ == '__main__':
+    main()
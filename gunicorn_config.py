@@ -5,7 +5,10 @@ bind = f"0.0.0.0:{os.getenv('PORT', 5423)}"
 workers = 2
 timeout = 120  # 2 minutes timeout for image generation
 keepalive = 5
-worker_class = "sync"
+# gthread: each worker serves requests on a thread pool, so clients waiting on
+# SSE progress streams (/generate_v1/jobs/<id>/events) hold a thread, not a whole worker
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 16))
 worker_connections = 1000
 max_requests = 1000
 max_requests_jitter = 50
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+家具批量导入工具
+功能：导入图片压缩包（zip / tar / tar.gz）和CSV或JSON元数据：并行校验、规范化图片（EXIF旋正、限制最长边），
+      生成缩略图、API用JPEG和抠图，全部处理完后在文件锁内先按新的家具库重建已存在的预编译索引
+      （二进制清单、SQLite、视觉索引），再原子替换 furniture_metadata.json，整批家具同时生效
+
+用法：
+    python ingest_furniture.py sofas.zip --metadata sofas.csv
+    python ingest_furniture.py sofas.tar.gz                  # 使用压缩包中的 .csv / .json 元数据
+    python ingest_furniture.py sofas.zip --metadata sofas.json --replace --workers 8
+
+注意：元数据字段同 furniture_metadata.json（filename, display_name, type, style, length, width, height, description），
+      尺寸无效的条目和家具库中已存在的同名图片（未指定 --replace 时）会被跳过；
+      运行中的服务可通过 POST /admin/ingest（需设置 ADMIN_TOKEN）导入
+"""
+
+import os
+import sys
+import time
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, 'src'))
+
+import app as ai_app  # noqa: E402
+
+def print_progress(stage, **info):
+    if stage == 'extracted':
+        print(f"已解压: 图片 {info['images']} 张, 元数据 {info['metadata']} 条")
+    elif stage == 'processed':
+        print(f"已处理: {info['done']}/{info['total']}")
+    elif stage == 'indexed' and info['indexes']:
+        print(f"已重建索引: {info['indexes']}")
+    elif stage == 'committed':
+        print(f"已写入家具库: {info['items']} 个")
+
+def main():
+    parser = argparse.ArgumentParser(description='批量导入家具图片和元数据')
+    parser.add_argument('archive', help='图片压缩包（zip / tar / tar.gz）')
+    parser.add_argument('--metadata', help='CSV或JSON元数据文件（默认使用压缩包中的 .csv / .json）')
+    parser.add_argument('--replace', action='store_true', help='覆盖家具库中的同名家具')
+    parser.add_argument('--workers', type=int, default=None, help='处理图片的进程数（默认 INGEST_WORKERS）')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    report = ai_app.ingest_furniture_archive(args.archive, args.metadata, replace=args.replace,
+                                             workers=args.workers, progress=print_progress)
+    elapsed = time.perf_counter() - start
+
+    print(f"导入: {len(report['ingested'])} 个  生成抠图: {report['mattes']} 个  跳过: {len(report['rejected'])} 个  "
+          f"耗时: {elapsed:.2f}s")
+    for entry in report['rejected']:
+        print(f"  - {entry['file']}: {entry['error']}")
+
+if __name__ == '__main__':
+    main()
@@ -10,9 +10,12 @@ import os
 import uuid
 from datetime import datetime
 from werkzeug.utils import secure_filename
+from concurrent.futures import Future
 from PIL import Image, ImageDraw
 import json
 
+from src import image_tasks
+
 # 获取项目根目录
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -26,6 +29,8 @@ app.config['SECRET_KEY'] = 'mask-generator-secret-key'
 app.config['UPLOAD_FOLDER'] = os.path.join(BASE_DIR, 'data', 'user')
 app.config['FURNITURE_FOLDER'] = os.path.join(BASE_DIR, 'data', 'furniture')
 app.config['MASK_OUTPUT_FOLDER'] = os.path.join(BASE_DIR, 'data', 'mask_img')
+# 预计算的家具抠图（build_furniture_mattes.py 生成），有抠图时渲染透明背景的家具，遮罩图只覆盖家具本身
+app.config['MATTE_FOLDER'] = os.path.join(BASE_DIR, 'data', 'catalog', 'mattes')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # 允许的文件扩展名
@@ -83,55 +88,8 @@ def create_composite_image(living_room_path, furniture_items, output_path):
     Returns:
         bool: 是否成功
     """
-    try:
-        # 打开客厅图片
-        living_room = Image.open(living_room_path).convert('RGBA')
-        
-        # 如果高度不足512，等比放大到700
-        living_room = resize_image_if_needed(living_room)
-        width, height = living_room.size
-        
-        # 创建组合图，客厅作为底层
-        composite = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-        composite.paste(living_room, (0, 0))
-        
-        # 叠加家具图层
-        for item in furniture_items:
-            if not os.path.exists(item['path']):
-                log_message(f"警告：家具文件不存在 - {item['path']}")
-                continue
-            
-            # 打开家具图片
-            furniture = Image.open(item['path']).convert('RGBA')
-            
-            # 调整家具大小
-            furniture_width = int(item.get('width', furniture.width))
-            furniture_height = int(item.get('height', furniture.height))
-            furniture = furniture.resize((furniture_width, furniture_height), Image.Resampling.LANCZOS)
-            
-            # 旋转家具（如果需要）
-            rotation = item.get('rotation', 0)
-            if rotation != 0:
-                furniture = furniture.rotate(-rotation, expand=True, resample=Image.Resampling.BICUBIC)
-            
-            # 计算粘贴位置（居中对齐）
-            x = int(item.get('x', 0))
-            y = int(item.get('y', 0))
-            
-            # 粘贴家具到组合图
-            composite.paste(furniture, (x, y), furniture)
-        
-        # 转换为RGB模式并保存为JPG
-        composite_rgb = Image.new('RGB', composite.size, (255, 255, 255))
-        composite_rgb.paste(composite, mask=composite.split()[3] if composite.mode == 'RGBA' else None)
-        composite_rgb.save(output_path, 'JPEG', quality=95)
-        
-        log_message(f"组合图生成成功: {output_path}")
-        return True
-        
-    except Exception as e:
-        log_message(f"生成组合图失败: {str(e)}")
-        return False
+    return _wait_render(submit_image_task(image_tasks.render_furniture_composite, living_room_path, furniture_items, output_path),
+                        '组合图', output_path)
 
 def create_mask_image(living_room_path, furniture_items, output_path):
     """
@@ -145,60 +103,30 @@ def create_mask_image(living_room_path, furniture_items, output_path):
     Returns:
         bool: 是否成功
     """
+    return _wait_render(submit_image_task(image_tasks.render_furniture_mask, living_room_path, furniture_items, output_path),
+                        '遮罩图', output_path)
+
+def submit_image_task(fn, *args):
+    """提交渲染任务到图片处理进程池；提交失败（如队列已满）时返回已失败的Future"""
     try:
-        # 打开客厅图片获取尺寸
-        living_room = Image.open(living_room_path)
-        
-        # 如果高度不足512，等比放大到700
-        living_room = resize_image_if_needed(living_room)
-        width, height = living_room.size
-        
-        # 创建黑色背景（全黑）
-        mask = Image.new('L', (width, height), 0)  # 'L' mode for grayscale, 0 = black
-        
-        # 在遮罩上绘制白色家具区域
-        for item in furniture_items:
-            if not os.path.exists(item['path']):
-                log_message(f"警告：家具文件不存在 - {item['path']}")
-                continue
-            
-            # 打开家具图片
-            furniture = Image.open(item['path']).convert('RGBA')
-            
-            # 调整家具大小
-            furniture_width = int(item.get('width', furniture.width))
-            furniture_height = int(item.get('height', furniture.height))
-            furniture = furniture.resize((furniture_width, furniture_height), Image.Resampling.LANCZOS)
-            
-            # 旋转家具（如果需要）
-            rotation = item.get('rotation', 0)
-            if rotation != 0:
-                furniture = furniture.rotate(-rotation, expand=True, resample=Image.Resampling.BICUBIC)
-            
-            # 创建家具的遮罩（基于alpha通道）
-            furniture_mask = furniture.split()[3] if furniture.mode == 'RGBA' else Image.new('L', furniture.size, 255)
-            
-            # 创建临时白色图层
-            white_layer = Image.new('L', furniture.size, 255)
-            
-            # 计算粘贴位置
-            x = int(item.get('x', 0))
-            y = int(item.get('y', 0))
-            
-            # 将白色家具区域粘贴到遮罩图
-            mask.paste(white_layer, (x, y), furniture_mask)
-        
-        # 保存遮罩图为JPG格式（转换为RGB）
-        mask_rgb = Image.new('RGB', mask.size)
-        mask_rgb.paste(mask)
-        mask_rgb.save(output_path, 'JPEG', quality=95)
-        
-        log_message(f"遮罩图生成成功: {output_path}")
-        return True
-        
+        return image_tasks.submit_image_task(fn, *args)
+    except Exception as e:
+        future = Future()
+        future.set_exception(e)
+        return future
+
+def _wait_render(future, label, output_path):
+    """等待渲染任务完成并记录日志"""
+    try:
+        result, timing = future.result()
     except Exception as e:
-        log_message(f"生成遮罩图失败: {str(e)}")
+        log_message(f"生成{label}失败: {str(e)}")
         return False
+    
+    for missing_path in result['skipped']:
+        log_message(f"警告：家具文件不存在 - {missing_path}")
+    log_message(f"{label}生成成功: {output_path} (排队={timing['queue_seconds']}s, 渲染={timing['run_seconds']}s)")
+    return True
 
 @app.route('/')
 def index():
@@ -301,9 +229,9 @@ def generate_masks():
         canvas_bg_width = data.get('canvas_bg_width', 0)
         canvas_bg_height = data.get('canvas_bg_height', 0)
         
-        # 读取原始图片并计算放大后的尺寸
-        original_image = Image.open(living_room_path)
-        original_width, original_height = original_image.size
+        # 读取原始图片尺寸并计算放大后的尺寸（只读取文件头，不解码像素）
+        with Image.open(living_room_path) as original_image:
+            original_width, original_height = original_image.size
         
         # 计算放大后的尺寸（与resize_image_if_needed逻辑一致）
         if original_height < 512:
@@ -350,6 +278,7 @@ def generate_masks():
                 
                 furniture_items.append({
                     'path': furniture_path,
+                    'matte': image_tasks.find_furniture_matte(furniture_path, app.config['MATTE_FOLDER']),
                     'x': adjusted_x,
                     'y': adjusted_y,
                     'width': adjusted_width,
@@ -368,13 +297,14 @@ def generate_masks():
         # 确保输出目录存在
         os.makedirs(app.config['MASK_OUTPUT_FOLDER'], exist_ok=True)
         
-        # 生成组合图
-        composite_success = create_composite_image(living_room_path, furniture_items, composite_path)
+        # 组合图和遮罩图互不依赖，同时提交到图片处理进程池渲染
+        composite_future = submit_image_task(image_tasks.render_furniture_composite, living_room_path, furniture_items, composite_path)
+        mask_future = submit_image_task(image_tasks.render_furniture_mask, living_room_path, furniture_items, mask_path)
+        
+        composite_success = _wait_render(composite_future, '组合图', composite_path)
+        mask_success = _wait_render(mask_future, '遮罩图', mask_path)
         if not composite_success:
             return jsonify({'error': '生成组合图失败'}), 500
-        
-        # 生成遮罩图
-        mask_success = create_mask_image(living_room_path, furniture_items, mask_path)
         if not mask_success:
             return jsonify({'error': '生成遮罩图失败'}), 500
         
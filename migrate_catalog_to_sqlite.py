@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+家具目录迁移工具（JSON -> SQLite）
+功能：把 data/furniture 下的家具图片和 furniture_metadata.json 迁移到SQLite数据库
+      （默认 data/catalog/furniture.db），按风格、类型、长度、宽度建索引，名称和描述建FTS5全文索引
+
+用法：
+    python migrate_catalog_to_sqlite.py
+    python migrate_catalog_to_sqlite.py --output data/catalog/furniture.db --workers 16
+
+启用：设置环境变量 CATALOG_BACKEND=sqlite（可用 CATALOG_SQLITE_PATH 指定数据库路径）后重启服务；
+      之后修改家具目录或元数据文件需要重新运行本工具，新数据库通过原子rename替换，运行中的服务会自动切换
+"""
+
+import os
+import sys
+import time
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, 'src'))
+
+import app as ai_app  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description='把家具目录从JSON元数据迁移到SQLite')
+    parser.add_argument('--output', default=ai_app.CATALOG_SQLITE_PATH, help='SQLite数据库输出路径')
+    parser.add_argument('--workers', type=int, default=8, help='读取图片头信息的线程数')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = ai_app.build_catalog_sqlite(args.output, workers=args.workers)
+    elapsed = time.perf_counter() - start
+
+    print(f"已生成: {args.output}")
+    print(f"家具数量: {result['items']}  数据库大小: {result['bytes']} 字节  耗时: {elapsed:.2f}s")
+    if result['unreadable']:
+        print(f"以下 {len(result['unreadable'])} 个文件无法读取图片头信息（数据库中尺寸为空）:")
+        for name in result['unreadable']:
+            print(f"  - {name}")
+    if ai_app.CATALOG_BACKEND != 'sqlite':
+        print("提示: 当前 CATALOG_BACKEND 不是 sqlite，设置 CATALOG_BACKEND=sqlite 后重启服务才会使用该数据库")
+
+if __name__ == '__main__':
+    main()
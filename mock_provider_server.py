@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟服务商服务器
+功能：模拟应用用到的豆包（Ark images API）、通义千问（DashScope 多模态生成API）、
+      百度（access token + object_detect）接口，支持配置延迟分布、错误率、挂起率和返回图片大小，
+      用于离线压测和基准测试应用完整的网络I/O链路
+
+启动：
+    python mock_provider_server.py --port 5499
+    python mock_provider_server.py --latency ark=lognormal:6,0.3 --error-rate ark=0.05 --image-size 2048x2048
+
+应用指向模拟服务器（.env 或环境变量）：
+    ARK_BASE_URL=http://127.0.0.1:5499/api/v3
+    DASHSCOPE_BASE_URL=http://127.0.0.1:5499/api/v1
+    BAIDU_API_BASE_URL=http://127.0.0.1:5499
+
+延迟分布格式（单位：秒）：
+    fixed:S | uniform:MIN,MAX | normal:MEAN,STD | lognormal:MEDIAN,SIGMA | exp:MEAN
+服务名：ark, dashscope, baidu_token, baidu_detect, download
+
+运行时查看/修改配置：GET/POST /mock/config，统计：GET /mock/stats
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import math
+import base64
+import random
+import shlex
+import argparse
+import threading
+from datetime import datetime
+
+from flask import Flask, request, jsonify, Response
+from PIL import Image
+
+app = Flask(__name__)
+
+SERVICES = ('ark', 'dashscope', 'baidu_token', 'baidu_detect', 'download')
+
+# 默认配置：延迟较短，便于快速压测；真实服务的延迟可通过 --latency 模拟
+CONFIG = {
+    'latency': {
+        'ark': 'lognormal:2.0,0.3',
+        'dashscope': 'lognormal:2.0,0.3',
+        'baidu_token': 'fixed:0.05',
+        'baidu_detect': 'uniform:0.2,0.6',
+        'download': 'uniform:0.05,0.2'
+    },
+    'error_rate': {service: 0.0 for service in SERVICES},
+    'hang_rate': {service: 0.0 for service in SERVICES},
+    'hang_seconds': 300.0,
+    'image_size': '2048x2048',
+    'image_quality': 90,
+    'image_pattern': 'noise',
+    'public_url': None
+}
+
+_CONFIG_LOCK = threading.Lock()
+_STATS = {service: {'requests': 0, 'errors': 0, 'hangs': 0, 'latency_total': 0.0} for service in SERVICES}
+_STATS_LOCK = threading.Lock()
+_IMAGE_CACHE = {}
+_IMAGE_CACHE_LOCK = threading.Lock()
+
+def log_message(message):
+    """记录日志（只输出到控制台，压测时避免磁盘I/O干扰）"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
+
+def parse_distribution(spec):
+    """
+    解析延迟分布描述
+
+    参数:
+        spec: 例如 'fixed:1', 'uniform:0.5,2', 'lognormal:6,0.3'
+
+    返回:
+        callable: 无参函数，每次调用返回一个采样延迟（秒，不小于0）
+    """
+    kind, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',') if v.strip()] if params else []
+
+    if kind == 'fixed':
+        return lambda: max(0.0, values[0])
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        # 参数为中位数和对数标准差，便于直观配置
+        return lambda: random.lognormvariate(math.log(values[0]), values[1])
+    if kind == 'exp':
+        return lambda: random.expovariate(1.0 / values[0])
+    raise ValueError(f"不支持的延迟分布: {spec}")
+
+def parse_size(text):
+    width, _, height = text.lower().partition('x')
+    return int(width), int(height)
+
+def simulate(service):
+    """
+    按配置模拟一次服务调用的延迟、挂起和错误
+
+    返回:
+        bool: 本次调用是否应返回错误
+    """
+    with _CONFIG_LOCK:
+        latency_spec = CONFIG['latency'][service]
+        error_rate = CONFIG['error_rate'][service]
+        hang_rate = CONFIG['hang_rate'][service]
+        hang_seconds = CONFIG['hang_seconds']
+
+    delay = parse_distribution(latency_spec)()
+    hang = random.random() < hang_rate
+    if hang:
+        delay = hang_seconds
+    time.sleep(delay)
+
+    failed = random.random() < error_rate
+    with _STATS_LOCK:
+        stats = _STATS[service]
+        stats['requests'] += 1
+        stats['latency_total'] += delay
+        if hang:
+            stats['hangs'] += 1
+        if failed:
+            stats['errors'] += 1
+    return failed
+
+def get_image_bytes(size_text):
+    """生成（并缓存）指定尺寸的JPEG图片；噪声图案可使文件大小接近真实照片的上限"""
+    with _CONFIG_LOCK:
+        quality = CONFIG['image_quality']
+        pattern = CONFIG['image_pattern']
+    key = (size_text, quality, pattern)
+
+    with _IMAGE_CACHE_LOCK:
+        if key in _IMAGE_CACHE:
+            return _IMAGE_CACHE[key]
+
+    width, height = parse_size(size_text)
+    if pattern == 'noise':
+        channels = [Image.effect_noise((width, height), 64) for _ in range(3)]
+        image = Image.merge('RGB', channels)
+    else:
+        image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    data = buffer.getvalue()
+
+    with _IMAGE_CACHE_LOCK:
+        _IMAGE_CACHE[key] = data
+    log_message(f"生成模拟图片: {width}x{height}, {pattern}, 质量={quality}, 大小={len(data)/1024/1024:.2f}MB")
+    return data
+
+def image_url(size_text):
+    base_url = CONFIG['public_url'] or request.host_url.rstrip('/')
+    return f"{base_url}/mock/images/{uuid.uuid4().hex}.jpg?size={size_text}"
+
+def resolve_output_size(requested):
+    """Ark 的 size 参数可能是 '2K' 之类的档位，也可能是 'WxH'"""
+    if requested and 'x' in requested.lower():
+        return requested.lower()
+    return CONFIG['image_size']
+
+@app.route('/api/v3/images/generations', methods=['POST'])
+def ark_images_generations():
+    """模拟豆包 Ark 图片生成接口"""
+    payload = request.get_json(silent=True) or {}
+    if simulate('ark'):
+        return jsonify({'error': {
+            'code': 'InternalServiceError',
+            'message': 'mock: simulated internal error',
+            'type': 'InternalServiceError'
+        }}), 500
+
+    size_text = resolve_output_size(payload.get('size'))
+    response_format = payload.get('response_format', 'url')
+    if response_format == 'b64_json':
+        item = {'b64_json': base64.b64encode(get_image_bytes(size_text)).decode('ascii')}
+    else:
+        item = {'url': image_url(size_text)}
+    item['size'] = size_text
+
+    return jsonify({
+        'model': payload.get('model', 'mock-seedream'),
+        'created': int(time.time()),
+        'data': [item],
+        'usage': {'generated_images': 1, 'output_tokens': 16384, 'total_tokens': 16384}
+    })
+
+@app.route('/api/v1/services/aigc/multimodal-generation/generation', methods=['POST'])
+def dashscope_multimodal_generation():
+    """模拟通义千问（DashScope）多模态图片编辑接口"""
+    payload = request.get_json(silent=True) or {}
+    request_id = str(uuid.uuid4())
+    if simulate('dashscope'):
+        return jsonify({
+            'code': 'InternalError',
+            'message': 'mock: simulated internal error',
+            'request_id': request_id
+        }), 500
+
+    n = int((payload.get('parameters') or {}).get('n', 1))
+    size_text = CONFIG['image_size']
+    width, height = parse_size(size_text)
+    return jsonify({
+        'output': {
+            'choices': [{
+                'finish_reason': 'stop',
+                'message': {
+                    'role': 'assistant',
+                    'content': [{'image': image_url(size_text)} for _ in range(max(1, n))]
+                }
+            }]
+        },
+        'usage': {'width': width, 'height': height, 'image_count': max(1, n)},
+        'request_id': request_id
+    })
+
+@app.route('/oauth/2.0/token', methods=['GET', 'POST'])
+def baidu_token():
+    """模拟百度 access token 接口"""
+    if simulate('baidu_token'):
+        return jsonify({'error': 'invalid_client', 'error_description': 'mock: simulated token error'}), 401
+    return jsonify({
+        'access_token': f"mock.{uuid.uuid4().hex}",
+        'expires_in': 2592000,
+        'scope': 'public brain_all_scope',
+        'session_key': uuid.uuid4().hex
+    })
+
+@app.route('/rest/2.0/image-classify/v1/object_detect', methods=['POST'])
+def baidu_object_detect():
+    """模拟百度物体检测接口：返回主体区域的像素坐标"""
+    image_data = request.form.get('image', '')
+    if simulate('baidu_detect'):
+        return jsonify({'error_code': 282000, 'error_msg': 'mock: internal error', 'log_id': random.getrandbits(48)})
+
+    width, height = 1024, 768
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(image_data))) as img:
+            width, height = img.size
+    except Exception:
+        pass
+
+    # 主体区域占图片的 75%~95%，与真实接口对整屋照片的返回相近
+    ratio = random.uniform(0.75, 0.95)
+    box_width, box_height = int(width * ratio), int(height * ratio)
+    return jsonify({
+        'log_id': random.getrandbits(48),
+        'result': {
+            'left': (width - box_width) // 2,
+            'top': (height - box_height) // 2,
+            'width': box_width,
+            'height': box_height
+        }
+    })
+
+@app.route('/mock/images/<name>')
+def download_image(name):
+    """模拟生成结果的下载地址"""
+    if simulate('download'):
+        return Response('mock: simulated download error', status=500)
+    size_text = request.args.get('size', CONFIG['image_size'])
+    return Response(get_image_bytes(size_text), mimetype='image/jpeg')
+
+@app.route('/mock/config', methods=['GET', 'POST'])
+def mock_config():
+    """查看或在运行时修改模拟配置（POST 部分字段即可）"""
+    if request.method == 'POST':
+        updates = request.get_json(silent=True) or {}
+        try:
+            apply_config(updates)
+        except (ValueError, KeyError, IndexError) as e:
+            return jsonify({'error': f'配置无效: {str(e)}'}), 400
+    with _CONFIG_LOCK:
+        return jsonify(CONFIG)
+
+@app.route('/mock/stats')
+def mock_stats():
+    """各模拟服务的请求数、错误数和平均注入延迟"""
+    with _STATS_LOCK:
+        stats = {
+            service: dict(values, latency_avg=round(values['latency_total'] / values['requests'], 3) if values['requests'] else None)
+            for service, values in _STATS.items()
+        }
+    return jsonify(stats)
+
+def apply_config(updates):
+    """校验并合并配置更新"""
+    for service, spec in updates.get('latency', {}).items():
+        if service not in SERVICES:
+            raise KeyError(service)
+        parse_distribution(spec)()
+    if 'image_size' in updates:
+        parse_size(updates['image_size'])
+
+    with _CONFIG_LOCK:
+        for key, value in updates.items():
+            if isinstance(CONFIG.get(key), dict):
+                CONFIG[key].update(value)
+            else:
+                CONFIG[key] = value
+
+def parse_service_values(items, cast):
+    """解析 'service=value' 形式的命令行参数；不带服务名时应用到所有服务"""
+    result = {}
+    for item in items or []:
+        service, sep, value = item.partition('=')
+        if not sep:
+            for name in SERVICES:
+                result[name] = cast(service)
+            continue
+        if service not in SERVICES:
+            raise SystemExit(f"未知服务: {service}（可选: {', '.join(SERVICES)}）")
+        result[service] = cast(value)
+    return result
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='豆包 / DashScope / 百度 接口本地模拟服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5499)
+    parser.add_argument('--latency', action='append', help='延迟分布，如 ark=lognormal:6,0.3（可重复）')
+    parser.add_argument('--error-rate', action='append', help='错误率，如 ark=0.05；不带服务名则应用到全部服务')
+    parser.add_argument('--hang-rate', action='append', help='挂起率（模拟超时），如 dashscope=0.02')
+    parser.add_argument('--hang-seconds', type=float, default=CONFIG['hang_seconds'], help='挂起时的等待秒数')
+    parser.add_argument('--image-size', default=CONFIG['image_size'], help='返回图片尺寸，如 2048x2048')
+    parser.add_argument('--image-quality', type=int, default=CONFIG['image_quality'], help='返回图片JPEG质量')
+    parser.add_argument('--image-pattern', choices=['noise', 'gradient'], default=CONFIG['image_pattern'],
+                        help='noise 接近真实照片的文件大小，gradient 文件很小')
+    parser.add_argument('--public-url', help='生成结果URL使用的外部地址（默认取请求的Host）')
+    return parser
+
+def configure_from_args(args):
+    apply_config({
+        'latency': parse_service_values(args.latency, str),
+        'error_rate': parse_service_values(args.error_rate, float),
+        'hang_rate': parse_service_values(args.hang_rate, float),
+        'hang_seconds': args.hang_seconds,
+        'image_size': args.image_size,
+        'image_quality': args.image_quality,
+        'image_pattern': args.image_pattern,
+        'public_url': args.public_url
+    })
+
+# 通过 gunicorn 等方式加载时，从环境变量 MOCK_PROVIDER_ARGS 读取命令行参数，例如：
+# MOCK_PROVIDER_ARGS="--latency ark=fixed:5" gunicorn -k gthread --threads 64 mock_provider_server:app
+if __name__ != '__main__' and os.getenv('MOCK_PROVIDER_ARGS'):
+    configure_from_args(build_parser().parse_args(shlex.split(os.getenv('MOCK_PROVIDER_ARGS'))))
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    configure_from_args(args)
+    log_message(f"模拟服务商服务器启动: http://{args.host}:{args.port}")
+    log_message(f"配置: {json.dumps(CONFIG, ensure_ascii=False)}")
+    log_message(f"应用配置示例: ARK_BASE_URL=http://{args.host}:{args.port}/api/v3 "
+                f"DASHSCOPE_BASE_URL=http://{args.host}:{args.port}/api/v1 "
+                f"BAIDU_API_BASE_URL=http://{args.host}:{args.port}")
+    sys.stdout.flush()
+    app.run(host=args.host, port=args.port, threaded=True)
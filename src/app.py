@@ -1,17 +1,58 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, Request
 import os
+import sys
 import uuid
 import time
 from datetime import datetime
 import json
 import base64
 import mimetypes
+import binascii
+import math
+import threading
+import functools
+import random
+import mmap
+import struct
+import hashlib
+import bisect
+import heapq
+import multiprocessing
+import sqlite3
+import csv
+import hmac
+import shutil
+import tarfile
+import zipfile
+from contextlib import contextmanager
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
 from werkzeug.utils import secure_filename
-from PIL import Image, ImageDraw
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageOps
 import io
 from dotenv import load_dotenv
 import requests
 
+# CPU密集型图片任务和共享进程池（gunicorn 以 src.app 导入，直接运行时以 src 为工作目录）
+try:
+    from src import image_tasks
+except ImportError:
+    import image_tasks
+
+# NumPy（可选）：家具匹配度的向量化评分和top-k排序，未安装时退回逐个计算
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+# 文件锁（跨worker进程的共享缓存使用；Windows 下不可用）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 # 尝试导入豆包SDK
 try:
     from volcenginesdkarkruntime import Ark
@@ -25,8 +66,6 @@ try:
     from dashscope import MultiModalConversation
     import dashscope
     DASHSCOPE_AVAILABLE = True
-    # 设置API地址（中国北京地域）
-    dashscope.base_http_api_url = 'https://dashscope.aliyuncs.com/api/v1'
 except ImportError:
     DASHSCOPE_AVAILABLE = False
     print("警告: DashScope SDK未安装，图像修复功能将不可用")
@@ -34,6 +73,13 @@ except ImportError:
 # 加载环境变量
 load_dotenv()
 
+# 服务商API地址（可通过环境变量指向本地模拟服务 mock_provider_server.py 进行离线压测）
+ARK_BASE_URL = os.getenv("ARK_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3")
+BAIDU_API_BASE_URL = os.getenv("BAIDU_API_BASE_URL", "https://aip.baidubce.com").rstrip('/')
+if DASHSCOPE_AVAILABLE:
+    # 设置API地址（默认中国北京地域）
+    dashscope.base_http_api_url = os.getenv("DASHSCOPE_BASE_URL", 'https://dashscope.aliyuncs.com/api/v1')
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 
@@ -60,6 +106,9 @@ app.config['UPLOAD_FOLDER'] = os.path.join(BASE_DIR, 'data', 'user')
 app.config['FURNITURE_FOLDER'] = os.path.join(BASE_DIR, 'data', 'furniture')
 app.config['OUTPUT_FOLDER'] = os.path.join(BASE_DIR, 'data', 'output')
 app.config['MASK_FOLDER'] = os.path.join(BASE_DIR, 'data', 'masks')  # 新增：存储mask图片
+app.config['JOB_FOLDER'] = os.path.join(BASE_DIR, 'data', 'jobs')  # 生成任务的进度事件（跨worker共享）
+app.config['CACHE_FOLDER'] = os.path.join(BASE_DIR, 'data', 'cache')  # 识别结果等缓存
+app.config['CATALOG_FOLDER'] = os.path.join(BASE_DIR, 'data', 'catalog')  # 家具目录的预编译清单等
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # 确保必要的目录存在（在模块加载时执行，适用于 Gunicorn）
@@ -69,6 +118,9 @@ for folder in [
     app.config['FURNITURE_FOLDER'],
     app.config['OUTPUT_FOLDER'],
     app.config['MASK_FOLDER'],
+    app.config['JOB_FOLDER'],
+    app.config['CACHE_FOLDER'],
+    app.config['CATALOG_FOLDER'],
     os.path.join(BASE_DIR, 'project_log')
 ]:
     try:
@@ -110,70 +162,15 @@ def compress_image(image_path, max_size_mb=1.0, quality=85):
     log_project(f"图片大小 {file_size/1024/1024:.2f}MB，开始压缩...")
     
     try:
-        # 打开图片
-        with Image.open(image_path) as img:
-            # 转换为RGB模式（JPEG不支持透明度）
-            if img.mode in ('RGBA', 'LA', 'P'):
-                # 创建白色背景
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # 获取原始尺寸
-            original_size = img.size
-            original_quality = quality
-            
-            # 尝试不同的压缩策略
-            temp_path = image_path + '.tmp'
-            
-            # 策略1: 先尝试只调整质量
-            for q in range(quality, 20, -10):  # 从85降到20，每次减10
-                img.save(temp_path, 'JPEG', quality=q, optimize=True)
-                if os.path.getsize(temp_path) <= max_size_bytes:
-                    os.replace(temp_path, image_path)
-                    log_project(f"压缩成功: {file_size/1024/1024:.2f}MB -> {os.path.getsize(image_path)/1024/1024:.2f}MB (质量={q})")
-                    return True
-            
-            # 策略2: 如果质量压缩不够，调整尺寸
-            scale_factor = 0.9
-            current_size = original_size
-            
-            while scale_factor >= 0.5:  # 最小缩放到50%
-                new_size = (int(original_size[0] * scale_factor), int(original_size[1] * scale_factor))
-                resized_img = img.resize(new_size, Image.Resampling.LANCZOS)
-                
-                # 尝试不同的质量
-                for q in range(quality, 30, -10):
-                    resized_img.save(temp_path, 'JPEG', quality=q, optimize=True)
-                    if os.path.getsize(temp_path) <= max_size_bytes:
-                        os.replace(temp_path, image_path)
-                        log_project(f"压缩成功: {file_size/1024/1024:.2f}MB -> {os.path.getsize(image_path)/1024/1024:.2f}MB (尺寸={new_size}, 质量={q})")
-                        return True
-                
-                scale_factor -= 0.1
-            
-            # 如果还是太大，使用最小尺寸和最低质量
-            min_size = (int(original_size[0] * 0.5), int(original_size[1] * 0.5))
-            final_img = img.resize(min_size, Image.Resampling.LANCZOS)
-            final_img.save(temp_path, 'JPEG', quality=30, optimize=True)
-            os.replace(temp_path, image_path)
-            
-            final_size = os.path.getsize(image_path)
-            log_project(f"压缩完成: {file_size/1024/1024:.2f}MB -> {final_size/1024/1024:.2f}MB (最小尺寸={min_size}, 质量=30)")
-            return True
+        # 质量/尺寸逐级尝试的多次编码在图片处理进程池中执行
+        result, task_timing = image_tasks.run_image_task(image_tasks.compress_jpeg_to_size, image_path,
+                                                         max_size_bytes, quality)
+        log_project(f"压缩完成: {file_size/1024/1024:.2f}MB -> {result['bytes']/1024/1024:.2f}MB "
+                    f"(尺寸={tuple(result['size'])}, 质量={result['quality']}, 耗时={task_timing['run_seconds']}s)")
+        return True
             
     except Exception as e:
         log_project(f"图片压缩失败: {str(e)}")
-        # 如果压缩失败，删除临时文件
-        if os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except:
-                pass
         return False
 
 def log_project(message):
@@ -197,6 +194,9 @@ def log_project(message):
         print(f"[日志写入失败] [{timestamp}] {message}")
         print(f"[错误] {str(e)}")
 
+# 发送给服务商的JPEG质量
+API_JPEG_QUALITY = 85
+
 def compress_image_for_api(image_path, max_dimension=1024):
     """
     为API调用压缩图片，限制像素尺寸在指定范围内
@@ -213,7 +213,7 @@ def compress_image_for_api(image_path, max_dimension=1024):
         return image_path, False
     
     try:
-        with Image.open(image_path) as img:
+        with open_cached_image(image_path) as img:
             original_size = img.size
             original_width, original_height = original_size
             max_original_dimension = max(original_width, original_height)
@@ -232,27 +232,11 @@ def compress_image_for_api(image_path, max_dimension=1024):
             
             log_project(f"压缩像素尺寸: {original_width}x{original_height} -> {new_width}x{new_height}")
             
-            # 先缩放图片
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # 转换为RGB模式（JPEG不支持透明度）
-            if img.mode in ('RGBA', 'LA', 'P'):
-                # 创建白色背景
-                background = Image.new('RGB', (new_width, new_height), (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                # 粘贴到白色背景上
-                if img.mode == 'RGBA':
-                    background.paste(img, (0, 0), img.split()[-1])
-                else:
-                    background.paste(img, (0, 0))
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
+            img = image_tasks.render_api_image(img, max_dimension)
             
-            # 保存压缩后的图片（使用临时文件，避免覆盖原文件）
-            temp_path = image_path + '.api_compressed.jpg'
-            img.save(temp_path, 'JPEG', quality=85, optimize=True)
+            # 保存压缩后的图片（使用临时文件，避免覆盖原文件；文件名带随机后缀，避免并发调用互相覆盖）
+            temp_path = f"{image_path}.{uuid.uuid4().hex[:8]}.api_compressed.jpg"
+            img.save(temp_path, 'JPEG', quality=API_JPEG_QUALITY, optimize=True)
             
             compressed_size = os.path.getsize(temp_path)
             log_project(f"压缩完成: 像素尺寸={new_width}x{new_height}, 文件大小={compressed_size/1024/1024:.2f}MB")
@@ -288,6 +272,74 @@ def encode_file_to_base64(file_path):
     
     return f"data:{mime_type};base64,{encoded_string}"
 
+# 家具库图片的API预处理文件放在 data/catalog/api，不混入家具目录（否则会被当成家具列出）
+FURNITURE_API_FOLDER = os.path.join(app.config['CATALOG_FOLDER'], 'api')
+
+def get_api_sidecar_paths(image_path):
+    """返回图片对应的API预处理文件路径：(<图片>.api.jpg, <图片>.api.json)；家具库图片的在 FURNITURE_API_FOLDER 下"""
+    if os.path.dirname(os.path.abspath(image_path)) == os.path.abspath(app.config['FURNITURE_FOLDER']):
+        image_path = os.path.join(FURNITURE_API_FOLDER, os.path.basename(image_path))
+    return f"{image_path}.api.jpg", f"{image_path}.api.json"
+
+def write_api_sidecar_meta(image_path, api_image, max_dimension=1024):
+    """
+    API用JPEG（image_tasks.save_api_jpeg）写入后，记录源文件状态和JPEG信息，供 get_api_sidecar 判断是否过期
+    
+    参数:
+        api_image: image_tasks.save_api_jpeg 的返回值 {'width', 'height', 'bytes'}
+    
+    返回:
+        str: API用JPEG路径
+    """
+    jpeg_path, meta_path = get_api_sidecar_paths(image_path)
+    stat = os.stat(image_path)
+    meta = {
+        'source_mtime': stat.st_mtime,
+        'source_size': stat.st_size,
+        'max_dimension': max_dimension,
+        'width': api_image['width'],
+        'height': api_image['height'],
+        'bytes': api_image['bytes']
+    }
+    temp_meta_path = f"{meta_path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temp_meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(temp_meta_path, meta_path)
+    
+    log_project(f"已预生成API图片: {jpeg_path}, 尺寸={meta['width']}x{meta['height']}, 大小={meta['bytes']} bytes")
+    return jpeg_path
+
+def get_api_sidecar(image_path, max_dimension=1024):
+    """
+    读取图片的API预处理文件元数据，源文件未变化时返回 (JPEG路径, 元数据)，否则返回 (None, None)
+    """
+    jpeg_path, meta_path = get_api_sidecar_paths(image_path)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        stat = os.stat(image_path)
+        if (meta.get('source_mtime') == stat.st_mtime and meta.get('source_size') == stat.st_size
+                and meta.get('max_dimension') == max_dimension and os.path.exists(jpeg_path)):
+            return jpeg_path, meta
+    except (OSError, ValueError):
+        pass
+    return None, None
+
+def prepare_api_image(image_path, temp_files, max_dimension=1024):
+    """
+    获取发送给服务商的图片路径：优先使用预生成的API图片，否则按需压缩（临时文件加入 temp_files）
+    """
+    sidecar_path, _ = get_api_sidecar(image_path, max_dimension)
+    if sidecar_path:
+        log_project(f"使用预生成的API图片: {sidecar_path}")
+        return sidecar_path
+    
+    compressed_path, compressed = compress_image_for_api(image_path, max_dimension=max_dimension)
+    if compressed:
+        log_project(f"图片已压缩: {image_path} -> {compressed_path}")
+        temp_files.append(compressed_path)
+    return compressed_path
+
 def calculate_sofa_size_range(room_length, room_width):
     """
     计算适合摆放沙发的尺寸范围
@@ -317,6 +369,261 @@ def calculate_sofa_size_range(room_length, room_width):
     }
 
 
+def _env_float(name, default):
+    """读取浮点型环境变量，格式错误时使用默认值"""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return float(default)
+
+def _env_int(name, default):
+    """读取整型环境变量，格式错误时使用默认值"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return int(default)
+
+# 服务商熔断与自适应并发限制配置
+# latency_target: 期望的单次调用耗时上限（秒），超过视为慢调用
+# max_concurrency: 单个worker进程内对该服务商的最大并发调用数
+PROVIDER_GUARD_DEFAULTS = {
+    'doubao': {'latency_target': 60.0, 'max_concurrency': 8},
+    'qwen': {'latency_target': 60.0, 'max_concurrency': 8},
+    'baidu': {'latency_target': 10.0, 'max_concurrency': 16},
+}
+
+# 单次服务商调用的时限 = latency_target × 该倍数，且不超过路由总时限 PROVIDER_ROUTE_TOTAL_TIMEOUT；
+# 超时的SDK请求会结束并释放熔断器名额，被路由放弃的调用不会一直占用并发
+PROVIDER_CALL_TIMEOUT_FACTOR = _env_float('PROVIDER_CALL_TIMEOUT_FACTOR', 2.0)
+
+class ProviderGuard:
+    """
+    单个服务商的熔断器 + AIMD自适应并发限制器
+    
+    - 熔断器：统计最近 window 次调用，失败（报错或耗时超过 latency_target）比例
+      达到 error_rate 后熔断 cooldown 秒；冷却后进入半开状态，只放行一个探测请求
+    - 并发限制：调用成功且耗时达标时并发上限加 1/limit（加性增），
+      失败或慢调用时上限减半（乘性减），最小为1
+    """
+    
+    def __init__(self, name, latency_target, max_concurrency, window=20, min_calls=5,
+                 error_rate=0.5, cooldown=30.0):
+        self.name = name
+        self.latency_target = latency_target
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        
+        self.state = 'closed'
+        self.opened_at = None
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        # 调用凭证：acquire 时分配的递增编号；半开状态下放行的探测调用的凭证记在 probe_token
+        self._next_token = 0
+        self.probe_token = None
+        self.outcomes = deque(maxlen=window)
+        self.ewma_latency = None
+        self.total_calls = 0
+        self.total_failures = 0
+        self.total_rejected = 0
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """
+        申请一个调用名额
+        
+        返回:
+            tuple: (是否允许调用, 建议重试等待秒数, 拒绝原因, 调用凭证)；
+                   允许调用时 release 需传回调用凭证，据此判断是否为半开探测调用，拒绝时凭证为 None
+        """
+        with self._lock:
+            now = time.time()
+            if self.state == 'open':
+                remaining = self.cooldown - (now - self.opened_at)
+                if remaining > 0:
+                    self.total_rejected += 1
+                    return False, max(1, math.ceil(remaining)), 'circuit_open', None
+                self.state = 'half_open'
+                log_project(f"【熔断】{self.name} 冷却结束，进入半开状态")
+            
+            self._next_token += 1
+            token = self._next_token
+            if self.state == 'half_open':
+                if self.probe_token is not None:
+                    self.total_rejected += 1
+                    return False, max(1, math.ceil(self.cooldown / 2)), 'circuit_half_open', None
+                self.probe_token = token
+            elif self.in_flight >= int(self.limit):
+                self.total_rejected += 1
+                # 按平均耗时估算下一个名额释放的时间
+                expected = self.ewma_latency or self.latency_target
+                return False, max(1, math.ceil(expected / max(self.in_flight, 1))), 'concurrency_limit', None
+            
+            self.in_flight += 1
+            return True, None, None, token
+    
+    def release(self, token, latency, success):
+        """
+        释放调用名额并记录结果
+        
+        参数:
+            token: acquire 返回的调用凭证；只有探测调用的凭证会结束半开状态，
+                   熔断前已放行、在半开期间才返回的普通调用只计入统计
+            latency: 调用耗时（秒）；为None时只释放名额不计入统计（如配置错误）
+            success: 服务商是否返回成功
+        """
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            was_probe = token is not None and token == self.probe_token
+            if was_probe:
+                self.probe_token = None
+            
+            if latency is None:
+                return
+            
+            self.total_calls += 1
+            self.ewma_latency = latency if self.ewma_latency is None else 0.8 * self.ewma_latency + 0.2 * latency
+            healthy = success and latency <= self.latency_target
+            if not healthy:
+                self.total_failures += 1
+            
+            # AIMD 调整并发上限
+            if healthy:
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+            else:
+                self.limit = max(1.0, self.limit / 2)
+            
+            if was_probe:
+                if healthy:
+                    self.state = 'closed'
+                    self.outcomes.clear()
+                    log_project(f"【熔断】{self.name} 探测成功，恢复正常")
+                else:
+                    self._open(f"半开探测失败（耗时{latency:.1f}秒）")
+                return
+            
+            self.outcomes.append(healthy)
+            if self.state == 'closed' and len(self.outcomes) >= self.min_calls:
+                failures = self.outcomes.count(False)
+                if failures / len(self.outcomes) >= self.error_rate:
+                    self._open(f"最近{len(self.outcomes)}次调用失败{failures}次")
+    
+    def _open(self, reason):
+        self.state = 'open'
+        self.opened_at = time.time()
+        self.outcomes.clear()
+        log_project(f"【熔断】{self.name} 已熔断 {self.cooldown:.0f} 秒: {reason}")
+    
+    def retry_after_hint(self):
+        """熔断中时返回剩余冷却秒数，否则返回None"""
+        with self._lock:
+            if self.state == 'open':
+                remaining = self.cooldown - (time.time() - self.opened_at)
+                if remaining > 0:
+                    return max(1, math.ceil(remaining))
+            return None
+    
+    def is_available(self):
+        """服务商当前是否可以接收新请求（不占用名额）"""
+        with self._lock:
+            if self.state == 'open':
+                return time.time() - self.opened_at >= self.cooldown
+            if self.state == 'half_open':
+                return self.probe_token is None
+            return self.in_flight < int(self.limit)
+    
+    def snapshot(self):
+        """返回当前状态，用于监控接口"""
+        with self._lock:
+            return {
+                'state': self.state,
+                'concurrency_limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'ewma_latency': round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+                'recent_failure_rate': round(self.outcomes.count(False) / len(self.outcomes), 3) if self.outcomes else 0.0,
+                'total_calls': self.total_calls,
+                'total_failures': self.total_failures,
+                'total_rejected': self.total_rejected
+            }
+
+_PROVIDER_GUARDS = {}
+_PROVIDER_GUARDS_LOCK = threading.Lock()
+
+def get_provider_guard(provider_name):
+    """获取服务商的熔断器实例（按进程懒加载，配置可通过环境变量覆盖）"""
+    with _PROVIDER_GUARDS_LOCK:
+        guard = _PROVIDER_GUARDS.get(provider_name)
+        if guard is None:
+            defaults = PROVIDER_GUARD_DEFAULTS.get(provider_name, {'latency_target': 60.0, 'max_concurrency': 8})
+            prefix = f"PROVIDER_{provider_name.upper()}_"
+            guard = ProviderGuard(
+                provider_name,
+                latency_target=_env_float(prefix + 'LATENCY_TARGET', defaults['latency_target']),
+                max_concurrency=_env_int(prefix + 'MAX_CONCURRENCY', defaults['max_concurrency']),
+                window=_env_int('PROVIDER_BREAKER_WINDOW', 20),
+                min_calls=_env_int('PROVIDER_BREAKER_MIN_CALLS', 5),
+                error_rate=_env_float('PROVIDER_BREAKER_ERROR_RATE', 0.5),
+                cooldown=_env_float('PROVIDER_BREAKER_COOLDOWN', 30)
+            )
+            _PROVIDER_GUARDS[provider_name] = guard
+        return guard
+
+def get_provider_call_timeout(provider_name):
+    """单次服务商调用的时限（秒），传给SDK的 timeout / request_timeout 参数"""
+    guard = get_provider_guard(provider_name)
+    return min(guard.latency_target * PROVIDER_CALL_TIMEOUT_FACTOR, PROVIDER_ROUTE_TOTAL_TIMEOUT)
+
+def provider_guarded(provider_name):
+    """
+    装饰器：为服务商调用函数加上熔断和并发限制
+    
+    被装饰函数需返回 {'success': bool, ...} 格式的字典；服务商不可用时
+    不调用原函数，直接返回带 retry_after（秒）的失败结果。
+    结果带 default_estimate 时（服务商没有给出可用结果，返回的是默认值）调用方按成功处理，熔断统计按失败计
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            guard = get_provider_guard(provider_name)
+            allowed, retry_after, reason, token = guard.acquire()
+            if not allowed:
+                log_project(f"【熔断】{provider_name} 拒绝调用 {func.__name__}: {reason}, 建议 {retry_after} 秒后重试")
+                return {
+                    'success': False,
+                    'error': f'{provider_name} 服务暂时不可用，请 {retry_after} 秒后重试',
+                    'provider': provider_name,
+                    'retry_after': retry_after,
+                    'reject_reason': reason
+                }
+            
+            start_time = time.time()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                # 调用前的配置/环境错误，不计入服务商健康统计
+                guard.release(token, None, False)
+                raise
+            
+            if result.get('config_error'):
+                guard.release(token, None, False)
+            else:
+                guard.release(token, time.time() - start_time,
+                              bool(result.get('success')) and not result.get('default_estimate'))
+            return result
+        return wrapper
+    return decorator
+
+def provider_error_response(result):
+    """将服务商失败结果转换为HTTP响应；熔断/限流时返回503并附带Retry-After"""
+    retry_after = result.get('retry_after')
+    if retry_after:
+        response = jsonify({'error': result['error'], 'retry_after': retry_after})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 503
+    return jsonify({'error': result['error']}), 500
+
+@provider_guarded('baidu')
 def call_baidu_room_size_api(image_path):
     """
     调用百度智能云API识别客厅尺寸
@@ -347,7 +654,8 @@ def call_baidu_room_size_api(image_path):
             log_project(f"【错误】{error_msg}")
             return {
                 'success': False,
-                'error': error_msg
+                'error': error_msg,
+                'config_error': True
             }
         
         # ========== 步骤2: 读取图片并获取像素尺寸 ==========
@@ -372,7 +680,7 @@ def call_baidu_room_size_api(image_path):
         
         # ========== 步骤3: 获取Access Token ==========
         log_project("【调试】开始获取Access Token...")
-        token_url = "https://aip.baidubce.com/oauth/2.0/token"
+        token_url = f"{BAIDU_API_BASE_URL}/oauth/2.0/token"
         token_params = {
             "grant_type": "client_credentials",
             "client_id": api_key,
@@ -382,7 +690,8 @@ def call_baidu_room_size_api(image_path):
         log_project(f"【调试】Token请求URL: {token_url}")
         log_project(f"【调试】Token请求参数: grant_type=client_credentials, client_id={api_key[:10]}...")
         
-        token_response = requests.post(token_url, params=token_params, timeout=10)
+        call_timeout = get_provider_call_timeout('baidu')
+        token_response = requests.post(token_url, params=token_params, timeout=min(10, call_timeout))
         log_project(f"【调试】Token响应状态码: {token_response.status_code}")
         
         try:
@@ -428,7 +737,7 @@ def call_baidu_room_size_api(image_path):
         
         # ========== 步骤4: 调用物体检测API ==========
         log_project("【调试】开始调用百度物体检测API...")
-        api_url = f"https://aip.baidubce.com/rest/2.0/image-classify/v1/object_detect?access_token={access_token}"
+        api_url = f"{BAIDU_API_BASE_URL}/rest/2.0/image-classify/v1/object_detect?access_token={access_token}"
         log_project(f"【调试】API端点: {api_url}")
         log_project(f"【调试】使用的API: 百度智能云 - 物体检测API (object_detect)")
         log_project(f"【调试】API说明: 该API返回检测到的物体信息，不直接返回房间尺寸")
@@ -445,7 +754,7 @@ def call_baidu_room_size_api(image_path):
         log_project(f"【调试】请求头: {headers}")
         log_project(f"【调试】请求数据大小: {len(data['image'])} 字符 (Base64)")
         
-        response = requests.post(api_url, headers=headers, data=data, timeout=30)
+        response = requests.post(api_url, headers=headers, data=data, timeout=call_timeout)
         log_project(f"【调试】API响应状态码: {response.status_code}")
         log_project(f"【调试】API响应头: {dict(response.headers)}")
         
@@ -571,6 +880,8 @@ def call_baidu_room_size_api(image_path):
         log_project("【调试】尝试从API返回中提取房间尺寸...")
         length = None
         width = None
+        # 是否使用了默认估算值（服务商没有给出可用结果，熔断统计按失败计）
+        used_default = False
         
         # 方式1: 直接字段
         log_project("【调试】方式1: 检查顶级字段 length/width...")
@@ -659,11 +970,13 @@ def call_baidu_room_size_api(image_path):
                             # 使用默认估算值（中等客厅）
                             length = 5.0
                             width = 4.0
+                            used_default = True
                             log_project(f"【估算】使用默认估算值: 长={length}米, 宽={width}米")
                     else:
                         log_project(f"【警告】无法获取图片像素尺寸，使用默认估算值")
                         length = 5.0
                         width = 4.0
+                        used_default = True
                         log_project(f"【估算】使用默认估算值: 长={length}米, 宽={width}米")
                 else:
                     # 如果不是像素坐标格式，尝试提取物理尺寸字段
@@ -765,6 +1078,7 @@ def call_baidu_room_size_api(image_path):
                 'length': round(length, 2),
                 'width': round(width, 2),
                 'is_estimated': is_estimated,  # 标记是否为估算值
+                'default_estimate': used_default,
                 'sofa_length_range': {
                     'min': round(sofa_length_min, 2),
                     'max': round(sofa_length_max, 2)
@@ -807,6 +1121,7 @@ def call_baidu_room_size_api(image_path):
                 'length': default_length,
                 'width': default_width,
                 'is_estimated': True,  # 标记为估算值
+                'default_estimate': True,  # 默认值，不是识别结果
                 'sofa_length_range': {
                     'min': round(sofa_length_min, 2),
                     'max': round(sofa_length_max, 2)
@@ -848,6 +1163,421 @@ def call_baidu_room_size_api(image_path):
             'error': error_msg
         }
 
+# 进程内已解码图片缓存：同一张房间照片在上传、保存mask、压缩、贴回等步骤中会被反复解码
+DECODED_IMAGE_CACHE_MAX_BYTES = _env_int('DECODED_IMAGE_CACHE_MAX_MB', 256) * 1024 * 1024
+# 单张图片超过总容量的该比例时不缓存，避免一张大图挤掉全部缓存
+DECODED_IMAGE_CACHE_MAX_ITEM_RATIO = 0.25
+
+class DecodedImageCache:
+    """
+    按 (路径, mtime, 文件大小) 缓存已解码的像素，按像素字节总数做LRU淘汰
+    
+    L/RGB/RGBA 图片缓存为与共享缓存条目相同格式的像素缓冲区（RGB 按 RGBX 存放），取出时用 Image.frombuffer
+    构造与缓存共享像素数据的只读图片（RGB 为 RGBX 模式）：只读操作（resize/crop/convert等）不复制，
+    原地修改（paste/putalpha等）时Pillow会先为该图片复制一份像素，缓存不受影响；
+    其他模式的图片直接缓存 Image，取出时 copy() 一份
+    """
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (像素元组或Image, nbytes)
+        self._lock = threading.Lock()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.decodes = 0
+        self.decode_seconds = 0.0
+    
+    @staticmethod
+    def _make_key(path):
+        return image_tasks.get_shared_image_key(path)
+    
+    @staticmethod
+    def _view(cached):
+        if isinstance(cached, tuple):
+            return image_tasks.image_from_pixels(cached)
+        image = cached.copy()
+        image.format = cached.format
+        return image
+    
+    def get(self, path):
+        """返回图片的只读视图，未命中时解码并放入缓存"""
+        key = self._make_key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._view(entry[0])
+            self.misses += 1
+        
+        # 二级缓存：其他worker进程可能已解码过同一张图片，像素缓冲区直接引用共享缓存的映射
+        cached = _SHARED_IMAGE_CACHE.get_pixels(key) if _SHARED_IMAGE_CACHE.enabled else None
+        if cached is None:
+            decode_start = time.time()
+            with Image.open(path) as img:
+                # copy() 得到与文件句柄无关的独立图片
+                image = img.copy()
+                image.format = img.format
+            decode_seconds = time.time() - decode_start
+            if _SHARED_IMAGE_CACHE.enabled:
+                _SHARED_IMAGE_CACHE.put(key, image)
+            with self._lock:
+                self.decodes += 1
+                self.decode_seconds += decode_seconds
+            cached = image_tasks.image_to_pixels(image) or image
+        if isinstance(cached, tuple):
+            nbytes = len(cached[3])
+        else:
+            nbytes = cached.width * cached.height * len(cached.getbands())
+        
+        with self._lock:
+            if nbytes <= self.max_bytes * DECODED_IMAGE_CACHE_MAX_ITEM_RATIO and key not in self._entries:
+                self._entries[key] = (cached, nbytes)
+                self.resident_bytes += nbytes
+                while self.resident_bytes > self.max_bytes and self._entries:
+                    _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                    self.resident_bytes -= evicted_bytes
+                    self.evictions += 1
+        return self._view(cached)
+    
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'resident_bytes': self.resident_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'decodes': self.decodes,
+                'decode_seconds': round(self.decode_seconds, 3),
+                # 按平均解码耗时估算命中（含二级缓存命中）节省的时间
+                'saved_seconds_estimate': round(self.decode_seconds / self.decodes * (lookups - self.decodes), 3) if self.decodes else 0.0
+            }
+
+_DECODED_IMAGE_CACHE = DecodedImageCache(DECODED_IMAGE_CACHE_MAX_BYTES)
+
+# 跨worker进程共享的已解码图片缓存：原始像素按文件存放在 data/cache/decoded，各进程通过mmap映射读取
+# 同一用户的 /save_mask 与 /generate_v1 经常落在不同的gunicorn worker上，进程内缓存只能命中一部分
+SHARED_IMAGE_CACHE_MAX_BYTES = _env_int('SHARED_IMAGE_CACHE_MAX_MB', 512) * 1024 * 1024
+# 条目文件格式和只读映射在 image_tasks 中实现，图片处理进程池中的任务也从这里读取
+
+class SharedImageCache:
+    """
+    基于内存映射文件的跨进程解码图片缓存
+    
+    每个条目是一个不可变文件（写入临时文件后原子重命名），读取时mmap映射后直接构造图片：
+    L/RGBA 原样存放，RGB 按 RGBX 存放（多占1/3空间）并以 RGBX 模式映射，三种模式都与映射共享内存，不复制也不重新解码。
+    index.json 记录各条目的来源和字节数，写入和淘汰在文件锁（fcntl）内进行；
+    条目文件的 mtime 作为最近访问时间，总字节数超过上限时按LRU淘汰
+    """
+    
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+    
+    @property
+    def enabled(self):
+        # Windows 下没有 fcntl，跨进程缓存不可用
+        return fcntl is not None and self.max_bytes > 0
+    
+    def _entry_path(self, key):
+        return image_tasks.get_shared_image_entry(self.folder, key)
+    
+    def _index_path(self):
+        return os.path.join(self.folder, 'index.json')
+    
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.folder, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    
+    def _load_index(self):
+        try:
+            with open(self._index_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _save_index(self, index):
+        temp_path = f"{self._index_path()}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(temp_path, self._index_path())
+    
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+    
+    def get_pixels(self, key):
+        """按缓存键映射条目，返回 (模式, 尺寸, 格式, 像素缓冲区)（见 image_tasks.map_shared_pixels），未命中返回 None"""
+        pixels = image_tasks.map_shared_pixels(self._entry_path(key)[1])
+        self._count('hits' if pixels is not None else 'misses')
+        return pixels
+    
+    def get(self, key):
+        """按缓存键映射图片，未命中返回 None"""
+        pixels = self.get_pixels(key)
+        return image_tasks.image_from_pixels(pixels) if pixels is not None else None
+    
+    def put(self, key, image):
+        """写入一张已解码图片（不支持的模式或过大的图片跳过），必要时按LRU淘汰旧条目"""
+        rawmode = image_tasks.SHARED_IMAGE_RAWMODES.get(image.mode)
+        if rawmode is None:
+            return
+        nbytes = image.width * image.height * len(rawmode)
+        if nbytes > self.max_bytes * DECODED_IMAGE_CACHE_MAX_ITEM_RATIO:
+            return
+        digest, entry_path = self._entry_path(key)
+        if os.path.exists(entry_path):
+            return
+        
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            header = image_tasks.SHARED_IMAGE_HEADER.pack(image_tasks.SHARED_IMAGE_MAGIC, image.mode.encode('ascii'),
+                                                          (image.format or '').encode('ascii')[:8], image.width, image.height)
+            temp_path = f"{entry_path}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(header.ljust(image_tasks.SHARED_IMAGE_HEADER_SIZE, b'\0'))
+                f.write(image.tobytes('raw', rawmode))
+            os.replace(temp_path, entry_path)
+            self._count('writes')
+            
+            with self._locked():
+                index = self._load_index()
+                index[digest] = {'source': key[0], 'bytes': image_tasks.SHARED_IMAGE_HEADER_SIZE + nbytes}
+                self._evict(index)
+                self._save_index(index)
+        except Exception as e:
+            log_project(f"写入共享图片缓存失败 {key[0]}: {str(e)}")
+    
+    def _evict(self, index):
+        """在文件锁内调用：总字节数超过上限时，按条目文件的最近访问时间从旧到新删除"""
+        total_bytes = sum(entry['bytes'] for entry in index.values())
+        if total_bytes <= self.max_bytes:
+            return
+        
+        access_times = {}
+        for digest in list(index):
+            try:
+                access_times[digest] = os.path.getmtime(os.path.join(self.folder, f"{digest}.pix"))
+            except OSError:
+                # 条目文件已不存在
+                total_bytes -= index.pop(digest)['bytes']
+        
+        for digest in sorted(access_times, key=access_times.get):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                # 已映射该文件的进程不受影响（删除后映射仍然有效）
+                os.remove(os.path.join(self.folder, f"{digest}.pix"))
+            except OSError:
+                pass
+            total_bytes -= index.pop(digest)['bytes']
+            self._count('evictions')
+    
+    def snapshot(self):
+        index = self._load_index() if self.enabled else {}
+        with self._stats_lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(index),
+                'stored_bytes': sum(entry['bytes'] for entry in index.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions
+            }
+
+_SHARED_IMAGE_CACHE = SharedImageCache(os.path.join(app.config['CACHE_FOLDER'], 'decoded'), SHARED_IMAGE_CACHE_MAX_BYTES)
+
+def open_cached_image(image_path):
+    """
+    打开图片（优先使用进程内解码缓存），用法与 Image.open 相同，可用于 with 语句
+    
+    缓存关闭（DECODED_IMAGE_CACHE_MAX_MB=0）时直接返回 Image.open 的结果
+    """
+    if _DECODED_IMAGE_CACHE.max_bytes <= 0:
+        return Image.open(image_path)
+    return _DECODED_IMAGE_CACHE.get(image_path)
+
+# 客厅尺寸识别缓存配置（按感知哈希匹配近似重复的照片，跳过百度API调用）
+ROOM_SIZE_CACHE_ENABLED = os.getenv('ROOM_SIZE_CACHE_ENABLED', 'true').lower() == 'true'
+# 两张照片dHash的汉明距离不超过该值时视为同一张照片（64位哈希）
+ROOM_SIZE_CACHE_MAX_DISTANCE = _env_int('ROOM_SIZE_CACHE_MAX_DISTANCE', 5)
+ROOM_SIZE_CACHE_MAX_ENTRIES = _env_int('ROOM_SIZE_CACHE_MAX_ENTRIES', 2000)
+
+_ROOM_SIZE_CACHE = []
+_ROOM_SIZE_CACHE_MTIME = None
+_ROOM_SIZE_CACHE_LOCK = threading.Lock()
+# 本进程的命中统计（哈希 -> [最近命中时间, 命中次数]）：命中时不写文件，下次写入缓存文件时合并
+_ROOM_SIZE_CACHE_USAGE = {}
+
+def compute_dhash(image_path, hash_size=8):
+    """
+    计算图片的差值哈希（dHash）
+    
+    缩小为 (hash_size+1) x hash_size 的灰度图，比较相邻像素亮度得到 hash_size² 位哈希；
+    对缩放、重新压缩和轻微调色不敏感，适合识别同一张照片的不同版本
+    
+    返回:
+        int: 哈希值
+    """
+    with Image.open(image_path) as img:
+        # JPEG按缩小尺寸解码，避免完整解码大图
+        img.draft('L', (hash_size * 16, hash_size * 16))
+        return image_tasks.dhash_image(img, hash_size)
+
+def get_room_size_cache_path():
+    return os.path.join(app.config['CACHE_FOLDER'], 'room_size_cache.json')
+
+@contextmanager
+def _room_size_cache_file_lock():
+    """缓存文件的跨进程写锁：读取-修改-替换整个过程持有 fcntl 文件锁（Windows 下只有进程内锁）"""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{get_room_size_cache_path()}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def _load_room_size_cache(force=False):
+    """文件被其他worker更新后重新加载（调用方持有锁）；force 为 True 时总是重新读取（写入前在文件锁内调用）"""
+    global _ROOM_SIZE_CACHE, _ROOM_SIZE_CACHE_MTIME
+    cache_path = get_room_size_cache_path()
+    try:
+        mtime = os.stat(cache_path).st_mtime_ns
+    except FileNotFoundError:
+        return
+    if mtime == _ROOM_SIZE_CACHE_MTIME and not force:
+        return
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            _ROOM_SIZE_CACHE = json.load(f).get('entries', [])
+        _ROOM_SIZE_CACHE_MTIME = mtime
+    except Exception as e:
+        log_project(f"加载尺寸识别缓存失败: {str(e)}")
+
+def _save_room_size_cache():
+    """合并本进程的命中统计后原子写入缓存文件（调用方持有进程内锁和文件锁）"""
+    global _ROOM_SIZE_CACHE_MTIME
+    for entry in _ROOM_SIZE_CACHE:
+        usage = _ROOM_SIZE_CACHE_USAGE.get(entry['hash'])
+        if usage:
+            entry['last_used'] = max(entry['last_used'], usage[0])
+            entry['hits'] = entry.get('hits', 0) + usage[1]
+    _ROOM_SIZE_CACHE_USAGE.clear()
+    
+    cache_path = get_room_size_cache_path()
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'entries': _ROOM_SIZE_CACHE}, f, ensure_ascii=False)
+        os.replace(temp_path, cache_path)
+        _ROOM_SIZE_CACHE_MTIME = os.stat(cache_path).st_mtime_ns
+    except Exception as e:
+        log_project(f"保存尺寸识别缓存失败: {str(e)}")
+
+def _lookup_room_size_cache(image_hash):
+    """按dHash查找尺寸识别缓存，命中时返回结果副本（含 cache_hit 和 cache_distance），否则返回 None"""
+    with _ROOM_SIZE_CACHE_LOCK:
+        _load_room_size_cache()
+        best_entry, best_distance = None, None
+        for entry in _ROOM_SIZE_CACHE:
+            distance = (int(entry['hash'], 16) ^ image_hash).bit_count()
+            if distance <= ROOM_SIZE_CACHE_MAX_DISTANCE and (best_distance is None or distance < best_distance):
+                best_entry, best_distance = entry, distance
+        if best_entry is None:
+            return None
+        usage = _ROOM_SIZE_CACHE_USAGE.setdefault(best_entry['hash'], [0.0, 0])
+        usage[0] = time.time()
+        usage[1] += 1
+        log_project(f"尺寸识别缓存命中: 哈希={image_hash:016x}, 汉明距离={best_distance}, 跳过百度API调用")
+        result = dict(best_entry['result'])
+        result['cache_hit'] = True
+        result['cache_distance'] = best_distance
+        return result
+
+def get_cached_room_size(image_path):
+    """
+    只查尺寸识别缓存、不调用服务商（供GET接口使用，识别在上传和生成时进行）
+    
+    返回:
+        dict: 同 detect_room_size_cached 的命中结果；缓存未启用、未命中或图片无法读取时返回 None
+    """
+    if not ROOM_SIZE_CACHE_ENABLED:
+        return None
+    try:
+        image_hash = compute_dhash(image_path)
+    except Exception as e:
+        log_project(f"计算图片哈希失败，无法查询尺寸识别缓存: {str(e)}")
+        return None
+    return _lookup_room_size_cache(image_hash)
+
+def detect_room_size_cached(image_path):
+    """
+    识别客厅尺寸，近似重复的照片直接使用缓存结果
+    
+    缓存按照片的dHash匹配，汉明距离不超过 ROOM_SIZE_CACHE_MAX_DISTANCE 即命中；
+    缓存内容是 call_baidu_room_size_api 的完整结果（含沙发尺寸范围），只缓存成功的识别（不缓存默认估算值）。
+    命中只更新进程内的统计，不写文件；新增条目时在文件锁内重新读取、合并并替换，多个worker不会互相覆盖
+    
+    返回:
+        dict: 同 call_baidu_room_size_api，命中缓存时额外包含 cache_hit 和 cache_distance
+    """
+    if not ROOM_SIZE_CACHE_ENABLED:
+        return call_baidu_room_size_api(image_path)
+    
+    try:
+        image_hash = compute_dhash(image_path)
+    except Exception as e:
+        log_project(f"计算图片哈希失败，跳过缓存: {str(e)}")
+        return call_baidu_room_size_api(image_path)
+    
+    cached = _lookup_room_size_cache(image_hash)
+    if cached is not None:
+        return cached
+    
+    result = call_baidu_room_size_api(image_path)
+    if not result.get('success') or result.get('default_estimate'):
+        # 默认估算值不缓存，下次上传同一张照片时重新识别
+        return result
+    
+    with _ROOM_SIZE_CACHE_LOCK, _room_size_cache_file_lock():
+        _load_room_size_cache(force=True)
+        now = time.time()
+        _ROOM_SIZE_CACHE.append({
+            'hash': f"{image_hash:016x}",
+            'result': result,
+            'created': now,
+            'last_used': now,
+            'hits': 0
+        })
+        # 超出上限时淘汰最久未使用的条目
+        if len(_ROOM_SIZE_CACHE) > ROOM_SIZE_CACHE_MAX_ENTRIES:
+            _ROOM_SIZE_CACHE.sort(key=lambda e: e['last_used'], reverse=True)
+            del _ROOM_SIZE_CACHE[ROOM_SIZE_CACHE_MAX_ENTRIES:]
+        _save_room_size_cache()
+    log_project(f"尺寸识别结果已缓存: 哈希={image_hash:016x}")
+    return result
+
 def save_mask_image(original_image_filename, mask_data):
     """保存用户绘制的mask图片 - 生成原始图片+蓝色涂抹的叠加图片"""
     try:
@@ -864,48 +1594,21 @@ def save_mask_image(original_image_filename, mask_data):
         # 先分析原始mask数据（在保存到文件之前）
         log_project(f"原始mask数据分析: 数据长度={len(mask_image_data)} bytes")
         
-        # 使用PIL直接从内存分析mask数据（优化：使用逐像素访问避免加载全部像素到内存）
+        # 使用PIL直接从内存分析mask数据（alpha通道直方图一次统计，不逐像素遍历）
         try:
             with Image.open(io.BytesIO(mask_image_data)) as temp_mask:
                 log_project(f"内存中mask图片: 尺寸={temp_mask.size}, 模式={temp_mask.mode}, 格式={temp_mask.format}")
                 
-                # 转换为RGBA进行分析
-                if temp_mask.mode != 'RGBA':
-                    temp_mask = temp_mask.convert('RGBA')
-                
-                # 优化：使用load()方法逐像素访问，避免一次性加载所有像素到内存
                 width, height = temp_mask.size
-                pixels_data = temp_mask.load()
-                
-                # 采样分析：只分析部分像素，避免处理全部像素
-                sample_size = min(1000, width * height)  # 最多采样1000个像素
-                step = max(1, (width * height) // sample_size)
-                
-                non_transparent_count = 0
-                alpha_samples = []
-                sample_pixels = []
-                
-                pixel_idx = 0
-                for y in range(height):
-                    for x in range(width):
-                        if pixel_idx % step == 0:  # 采样
-                            pixel = pixels_data[x, y]
-                            if pixel[3] > 0:  # 非透明像素
-                                non_transparent_count += 1
-                                alpha_samples.append(pixel[3])
-                                if len(sample_pixels) < 10:
-                                    sample_pixels.append(pixel)
-                        pixel_idx += 1
+                alpha_histogram = temp_mask.convert('RGBA').getchannel('A').histogram()
+                non_transparent_count = width * height - alpha_histogram[0]
                 
-                log_project(f"内存分析: 图片尺寸={width}x{height}, 采样像素={len(alpha_samples)}, 非透明像素数≈{non_transparent_count * step}")
+                log_project(f"内存分析: 图片尺寸={width}x{height}, 非透明像素数={non_transparent_count}")
                 
-                if alpha_samples:
-                    log_project(f"样本像素alpha值: {[p[3] for p in sample_pixels[:10]]}")
-                    
-                    if alpha_samples:
-                        most_common_alpha = max(set(alpha_samples), key=alpha_samples.count)
-                        detected_transparency = round((255 - most_common_alpha) / 255 * 100, 1)
-                        log_project(f"内存分析检测到透明度: {detected_transparency}% (alpha={most_common_alpha})")
+                if non_transparent_count:
+                    most_common_alpha = max(range(1, 256), key=lambda value: alpha_histogram[value])
+                    detected_transparency = round((255 - most_common_alpha) / 255 * 100, 1)
+                    log_project(f"内存分析检测到透明度: {detected_transparency}% (alpha={most_common_alpha})")
                 else:
                     log_project("警告: 内存中的mask图片没有找到非透明像素!")
                     
@@ -927,116 +1630,48 @@ def save_mask_image(original_image_filename, mask_data):
         
         # 2. 生成叠加图片：原始图片 + 蓝色涂抹
         # 检查原始图片路径 - 可能在UPLOAD_FOLDER或OUTPUT_FOLDER中（擦除后的图片在OUTPUT_FOLDER）
-        original_image_path = None
-        
-        # 先检查UPLOAD_FOLDER
-        upload_path = os.path.join(app.config['UPLOAD_FOLDER'], original_image_filename)
-        if os.path.exists(upload_path):
-            original_image_path = upload_path
-            log_project(f"从UPLOAD_FOLDER读取原始图片: {original_image_filename}")
-        else:
-            # 如果在UPLOAD_FOLDER中找不到，尝试OUTPUT_FOLDER（擦除后的图片在这里）
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], original_image_filename)
-            if os.path.exists(output_path):
-                original_image_path = output_path
-                log_project(f"从OUTPUT_FOLDER读取原始图片: {original_image_filename}")
-            else:
-                log_project(f"错误: 无法找到原始图片: {original_image_filename} (已检查UPLOAD和OUTPUT文件夹)")
-                log_project(f"UPLOAD_FOLDER路径: {upload_path}")
-                log_project(f"OUTPUT_FOLDER路径: {output_path}")
-                raise FileNotFoundError(f"原始图片不存在: {original_image_filename}")
+        original_image_path = resolve_scene_image_path(original_image_filename)
+        if original_image_path is None:
+            log_project(f"错误: 无法找到原始图片: {original_image_filename} (已检查UPLOAD和OUTPUT文件夹)")
+            raise FileNotFoundError(f"原始图片不存在: {original_image_filename}")
         
         if original_image_path and os.path.exists(original_image_path):
             log_project(f"使用原始图片路径: {original_image_path}")
             log_project(f"原始图片文件大小: {os.path.getsize(original_image_path)} bytes")
             
-            # 打开原始图片和mask图片
-            with Image.open(original_image_path) as original_img:
-                log_project(f"原始图片尺寸: {original_img.size}, 模式: {original_img.mode}")
-                with Image.open(pure_mask_filepath) as mask_img:
-                    # 确保两个图片尺寸一致
-                    if original_img.size != mask_img.size:
-                        log_project(f"调整mask尺寸: {mask_img.size} -> {original_img.size}")
-                        mask_img = mask_img.resize(original_img.size, Image.Resampling.LANCZOS)
-                    
-                    # 转换为RGBA模式
-                    if original_img.mode != 'RGBA':
-                        original_img = original_img.convert('RGBA')
-                    if mask_img.mode != 'RGBA':
-                        mask_img = mask_img.convert('RGBA')
-                    
-                    # 优化：使用load()方法逐像素访问，避免一次性加载所有像素到内存
-                    width, height = original_img.size
-                    original_pixels = original_img.load()
-                    mask_pixels = mask_img.load()
-                    
-                    # 采样分析mask的透明度信息（只分析部分像素）
-                    sample_size = min(1000, width * height)
-                    step = max(1, (width * height) // sample_size)
-                    alpha_samples = []
-                    pixel_idx = 0
-                    for y in range(height):
-                        for x in range(width):
-                            if pixel_idx % step == 0:
-                                pixel = mask_pixels[x, y]
-                                if pixel[3] > 0:
-                                    alpha_samples.append(pixel[3])
-                            pixel_idx += 1
-                    
-                    avg_alpha = sum(alpha_samples) / len(alpha_samples) if alpha_samples else 0
-                    transparency_percentage = round((255 - avg_alpha) / 255 * 100, 2) if avg_alpha > 0 else 100
-                    
-                    log_project(f"Mask透明度分析: 平均Alpha={avg_alpha:.1f}, 透明度={transparency_percentage}%")
-                    
-                    # 创建叠加图片 - 使用逐像素处理，避免加载全部像素到内存
-                    composite_img = original_img.copy()
-                    composite_pixels = composite_img.load()
-                    
-                    # 逐像素混合，正确处理用户设置的透明度
-                    processed_count = 0
-                    
-                    for y in range(height):
-                        for x in range(width):
-                            mask_pixel = mask_pixels[x, y]
-                            orig_pixel = original_pixels[x, y]
-                            
-                            if mask_pixel[3] == 0:  # mask像素完全透明，保持原始像素
-                                composite_pixels[x, y] = orig_pixel
-                            else:  # mask像素有颜色，进行透明度混合
-                                processed_count += 1
-                                
-                                # 获取mask的alpha值（这是用户设置的透明度）
-                                user_alpha = mask_pixel[3]  # 用户设置的alpha值
-                                user_alpha_ratio = user_alpha / 255.0  # 转换为0-1的比例
-                                
-                                # Alpha混合公式: result = mask * user_alpha + original * (1 - user_alpha)
-                                blended_r = int(mask_pixel[0] * user_alpha_ratio + orig_pixel[0] * (1 - user_alpha_ratio))
-                                blended_g = int(mask_pixel[1] * user_alpha_ratio + orig_pixel[1] * (1 - user_alpha_ratio))
-                                blended_b = int(mask_pixel[2] * user_alpha_ratio + orig_pixel[2] * (1 - user_alpha_ratio))
-                                
-                                # 保持原始背景的不透明度，但颜色已经混合了用户的透明度设置
-                                blended_a = orig_pixel[3]  # 保持原始背景的不透明度
-                                
-                                composite_pixels[x, y] = (blended_r, blended_g, blended_b, blended_a)
-                    
-                    log_project(f"透明度处理统计: 处理了{processed_count}个mask像素")
-                    
-                    if alpha_samples:
-                        most_common_alpha = max(set(alpha_samples), key=alpha_samples.count)
-                        actual_transparency = round((255 - most_common_alpha) / 255 * 100, 1)
-                        log_project(f"检测到的用户透明度设置: {actual_transparency}% (alpha={most_common_alpha})")
-                    
-                    # 保存叠加图片
-                    composite_filename = f"{base_name}_composite_mask_{timestamp}.png"
-                    composite_filepath = os.path.join(app.config['MASK_FOLDER'], composite_filename)
-                    composite_img.save(composite_filepath, 'PNG')
-                    
-                    log_project(f"生成叠加mask图片: {composite_filename}, 保持透明度: {transparency_percentage}%")
-                    log_project(f"叠加mask图片路径: {composite_filepath}")
-                    log_project(f"叠加mask图片文件大小: {os.path.getsize(composite_filepath)} bytes")
-                    log_project(f"叠加mask图片尺寸: {composite_img.size}, 模式: {composite_img.mode}")
-                    log_project(f"原始图片文件名: {original_image_filename}, 路径: {original_image_path}")
-                    log_project(f"✓ Mask图片已基于正确的原始图片生成（擦除后的场景）")
+            # 合成叠加图片并预生成API用的JPEG（在图片处理进程池中执行，不占用请求线程的GIL）
+            composite_filename = f"{base_name}_composite_mask_{timestamp}.png"
+            composite_filepath = os.path.join(app.config['MASK_FOLDER'], composite_filename)
+            api_jpeg_path, _ = get_api_sidecar_paths(composite_filepath)
+            composite_info, task_timing = image_tasks.run_image_task(
+                image_tasks.build_mask_composite, original_image_path, pure_mask_filepath, composite_filepath,
+                api_jpeg_path, 1024, API_JPEG_QUALITY, _SHARED_IMAGE_CACHE.folder if _SHARED_IMAGE_CACHE.enabled else None)
+            write_api_sidecar_meta(composite_filepath, composite_info['api_image'])
+            
+            log_project(f"原始图片尺寸: {tuple(composite_info['original_size'])}, 模式: {composite_info['original_mode']}")
+            if composite_info['mask_size'] != composite_info['original_size']:
+                log_project(f"调整mask尺寸: {tuple(composite_info['mask_size'])} -> {tuple(composite_info['original_size'])}")
+            
+            # mask的alpha通道即用户设置的透明度，用直方图统计（不逐像素遍历）
+            alpha_histogram = composite_info['alpha_histogram']
+            processed_count = sum(alpha_histogram[1:])
+            avg_alpha = sum(value * alpha_histogram[value] for value in range(1, 256)) / processed_count if processed_count else 0
+            transparency_percentage = round((255 - avg_alpha) / 255 * 100, 2) if avg_alpha > 0 else 100
+            
+            log_project(f"Mask透明度分析: 平均Alpha={avg_alpha:.1f}, 透明度={transparency_percentage}%")
+            log_project(f"透明度处理统计: 处理了{processed_count}个mask像素")
+            
+            if processed_count:
+                most_common_alpha = max(range(1, 256), key=lambda value: alpha_histogram[value])
+                actual_transparency = round((255 - most_common_alpha) / 255 * 100, 1)
+                log_project(f"检测到的用户透明度设置: {actual_transparency}% (alpha={most_common_alpha})")
+            
+            log_project(f"生成叠加mask图片: {composite_filename}, 保持透明度: {transparency_percentage}%")
+            log_project(f"叠加mask图片路径: {composite_filepath}")
+            log_project(f"叠加mask图片文件大小: {composite_info['composite_bytes']} bytes")
+            log_project(f"叠加mask合成耗时: 排队={task_timing['queue_seconds']}s, 执行={task_timing['run_seconds']}s")
+            log_project(f"原始图片文件名: {original_image_filename}, 路径: {original_image_path}")
+            log_project(f"✓ Mask图片已基于正确的原始图片生成（擦除后的场景）")
         else:
             error_msg = f"错误: 原始图片不存在，无法生成叠加mask图片"
             if original_image_path:
@@ -1055,72 +1690,543 @@ def save_mask_image(original_image_filename, mask_data):
         log_project(f"保存mask图片失败: {str(e)}")
         raise e
 
-# 豆包客户端单例（避免重复创建客户端实例导致内存泄漏）
-_DOUBAO_CLIENT = None
+# 局部区域（ROI）处理配置：只把编辑区域外接框（加上下文边距）发给服务商，结果再贴回原始分辨率的原图
+# 边距 = max(外接框边长 × ROI_MARGIN_RATIO, ROI_MIN_MARGIN 像素)
+ROI_MARGIN_RATIO = _env_float('ROI_MARGIN_RATIO', 0.25)
+ROI_MIN_MARGIN = _env_int('ROI_MIN_MARGIN', 48)
+# 裁剪框超过原图面积的该比例时不再裁剪，直接发送整图
+ROI_MAX_AREA_RATIO = _env_float('ROI_MAX_AREA_RATIO', 0.8)
+# 贴回时编辑区域向外扩张的像素数和羽化宽度（原图像素）
+ROI_DILATE_PX = _env_int('ROI_DILATE_PX', 8)
+ROI_FEATHER_PX = _env_int('ROI_FEATHER_PX', 16)
+# 贴回时生成结果与目标区域宽高比的相对差超过该值视为不一致（服务商按支持的尺寸档位输出），先居中裁剪再缩放，避免拉伸变形
+ROI_PASTE_ASPECT_TOLERANCE = _env_float('ROI_PASTE_ASPECT_TOLERANCE', 0.02)
+# 通义千问擦除是否只发送蒙版周围的局部区域（结果贴回原图，未编辑区域保持原始像素）
+QWEN_INPAINT_ROI = os.getenv('QWEN_INPAINT_ROI', 'false').lower() == 'true'
 
-def get_doubao_client():
-    """获取豆包客户端实例（单例模式，避免内存泄漏）"""
-    global _DOUBAO_CLIENT
-    
-    if _DOUBAO_CLIENT is None:
-        if not DOUBAO_AVAILABLE:
-            raise Exception("豆包SDK未安装")
-        
-        api_key = os.getenv("ARK_API_KEY")
-        if not api_key:
-            raise Exception("未配置ARK_API_KEY环境变量")
-        
-        _DOUBAO_CLIENT = Ark(
-            base_url="https://ark.cn-beijing.volces.com/api/v3",
-            api_key=api_key
-        )
-        log_project("豆包客户端初始化成功（单例模式）")
+def binarize_mask(mask_image, threshold=10):
+    """将蒙版转换为纯黑白L模式图片：亮度大于阈值为255（编辑区域），其余为0"""
+    if mask_image.mode != 'RGB':
+        mask_image = mask_image.convert('RGB')
+    return mask_image.convert('L').point(lambda p: 255 if p > threshold else 0)
+
+def expand_box(bbox, image_size, margin_ratio=None, min_margin=None):
+    """按比例和最小像素边距扩展外接框，并限制在图片范围内"""
+    margin_ratio = ROI_MARGIN_RATIO if margin_ratio is None else margin_ratio
+    min_margin = ROI_MIN_MARGIN if min_margin is None else min_margin
+    left, top, right, bottom = bbox
+    width, height = image_size
+    margin_x = max(min_margin, int((right - left) * margin_ratio))
+    margin_y = max(min_margin, int((bottom - top) * margin_ratio))
+    return (max(0, left - margin_x), max(0, top - margin_y),
+            min(width, right + margin_x), min(height, bottom + margin_y))
+
+def is_box_worth_cropping(box, image_size):
+    """裁剪框明显小于整图时才值得走ROI流程"""
+    box_area = (box[2] - box[0]) * (box[3] - box[1])
+    return box_area < image_size[0] * image_size[1] * ROI_MAX_AREA_RATIO
+
+def build_blend_mask(region_mask, dilate_px=None, feather_px=None):
+    """
+    由编辑区域蒙版生成贴回用的混合蒙版：先向外扩张，再高斯羽化，
+    使编辑区域内部完全取生成结果、边缘平滑过渡到原图
+    """
+    dilate_px = ROI_DILATE_PX if dilate_px is None else dilate_px
+    feather_px = ROI_FEATHER_PX if feather_px is None else feather_px
+    mask = region_mask
+    if dilate_px + feather_px > 0:
+        # BoxBlur半径r后取 >0 的像素，等价于按r像素做方形膨胀；多扩张一个羽化宽度，羽化只向外过渡
+        mask = mask.filter(ImageFilter.BoxBlur(dilate_px + feather_px // 2)).point(lambda p: 255 if p > 0 else 0)
+    if feather_px > 0:
+        mask = mask.filter(ImageFilter.GaussianBlur(feather_px / 2))
+    return mask
+
+def paste_back_region(base_image, generated_image, box, blend_mask):
+    """
+    将生成结果按混合蒙版贴回原图的指定区域（原地修改 base_image）
     
-    return _DOUBAO_CLIENT
+    参数:
+        base_image: 原始分辨率的原图（RGB）
+        generated_image: 服务商返回的对应 box 区域的结果，尺寸不同时缩放到 box 尺寸；
+            宽高比不一致（超过 ROI_PASTE_ASPECT_TOLERANCE）时先居中裁剪到 box 的宽高比，不拉伸。
+            box 为整图时直接缩放到原图尺寸（整图结果由服务商缩放得到，裁剪会使内容错位）
+        box: (left, top, right, bottom)
+        blend_mask: box 尺寸的L模式混合蒙版，255取生成结果，0保留原图
+    """
+    box_size = (box[2] - box[0], box[3] - box[1])
+    if generated_image.size != box_size:
+        generated_aspect = generated_image.width / generated_image.height
+        box_aspect = box_size[0] / box_size[1]
+        full_frame = tuple(box) == (0, 0) + base_image.size
+        if abs(generated_aspect / box_aspect - 1) > ROI_PASTE_ASPECT_TOLERANCE and not full_frame:
+            log_project(f"贴回时宽高比不一致: 生成结果={generated_image.width}x{generated_image.height}, "
+                        f"目标区域={box_size[0]}x{box_size[1]}，居中裁剪后缩放")
+            generated_image = ImageOps.fit(generated_image, box_size, Image.Resampling.LANCZOS)
+        else:
+            generated_image = generated_image.resize(box_size, Image.Resampling.LANCZOS)
+    if generated_image.mode != base_image.mode:
+        generated_image = generated_image.convert(base_image.mode)
+    patch = base_image.crop(box)
+    base_image.paste(Image.composite(generated_image, patch, blend_mask), box[:2])
 
-def call_doubao_image_fusion(mask_image_path, furniture_image_path, prompt_text):
-    """调用豆包图像融合API"""
-    if not DOUBAO_AVAILABLE:
-        raise Exception("豆包SDK未安装")
+def prepare_inpaint_roi(original_image_path, mask_image_path, temp_files):
+    """
+    按蒙版外接框裁剪原图和蒙版，用于只发送局部区域给图像修复服务
     
-    # 使用全局客户端实例（单例模式）
-    client = get_doubao_client()
+    返回:
+        dict: {'box', 'image_size', 'original_crop_path', 'mask_crop_path'}；
+        蒙版为空或裁剪框接近整图时返回 None
+    """
+    with Image.open(original_image_path) as original_img, Image.open(mask_image_path) as mask_img:
+        image_size = original_img.size
+        binary_mask = binarize_mask(mask_img)
+        if binary_mask.size != image_size:
+            binary_mask = binary_mask.resize(image_size, Image.Resampling.NEAREST)
+        bbox = binary_mask.getbbox()
+        if not bbox:
+            return None
+        box = expand_box(bbox, image_size)
+        if not is_box_worth_cropping(box, image_size):
+            return None
+        
+        token = uuid.uuid4().hex[:8]
+        original_crop_path = f"{original_image_path}.{token}.roi.jpg"
+        mask_crop_path = f"{mask_image_path}.{token}.roi.png"
+        original_img.convert('RGB').crop(box).save(original_crop_path, 'JPEG', quality=95)
+        binary_mask.crop(box).save(mask_crop_path, 'PNG')
+        temp_files.extend([original_crop_path, mask_crop_path])
     
-    # 用于跟踪临时文件，以便后续清理
-    temp_files = []
+    log_project(f"ROI裁剪: 原图={image_size[0]}x{image_size[1]}, 编辑区域={bbox}, 裁剪框={box}")
+    return {
+        'box': list(box),
+        'image_size': list(image_size),
+        'original_crop_path': original_crop_path,
+        'mask_crop_path': mask_crop_path
+    }
+
+def paste_back_inpaint_roi(output_filepath, original_image_path, mask_image_path, box=None):
+    """
+    把修复结果按羽化后的蒙版贴回原始分辨率的原图，覆盖写入 output_filepath；
+    蒙版以外的像素保持原图
     
+    参数:
+        box: ROI模式的裁剪框，为 None 时结果是整图（未裁剪或切换到其他服务商），按整图贴回
+    """
+    with Image.open(original_image_path) as original_img, Image.open(mask_image_path) as mask_img, \
+            Image.open(output_filepath) as generated_img:
+        base_image = original_img.convert('RGB')
+        box = box or [0, 0, base_image.width, base_image.height]
+        binary_mask = binarize_mask(mask_img)
+        if binary_mask.size != base_image.size:
+            binary_mask = binary_mask.resize(base_image.size, Image.Resampling.NEAREST)
+        blend_mask = build_blend_mask(binary_mask.crop(box))
+        paste_back_region(base_image, generated_img.convert('RGB'), box, blend_mask)
+    base_image.save(output_filepath, 'JPEG', quality=95)
+    log_project(f"修复结果已贴回原图: {output_filepath}, 尺寸={base_image.size}, 区域={box}")
+
+# 豆包融合是否只发送蓝色涂抹区域周围的局部场景（按裁剪面积等比例降低请求的输出尺寸，结果贴回原图）
+DOUBAO_FUSION_ROI = os.getenv('DOUBAO_FUSION_ROI', 'false').lower() == 'true'
+# 豆包擦除是否只发送蒙版周围的局部区域（输出尺寸按裁剪面积分配，结果贴回原图）
+DOUBAO_INPAINT_ROI = os.getenv('DOUBAO_INPAINT_ROI', 'false').lower() == 'true'
+# 豆包整图输出尺寸：档位（1K/2K/4K）或 宽x高；结果会贴回原图分辨率，可按需调小以减少生成和下载耗时
+DOUBAO_OUTPUT_SIZE = os.getenv('DOUBAO_OUTPUT_SIZE', '2K')
+DOUBAO_SIZE_PRESET_PIXELS = {'1K': 1024 * 1024, '2K': 2048 * 2048, '4K': 4096 * 4096}
+# 服务商允许的最小输出像素数（seedream 要求不低于约 1280x720）
+DOUBAO_MIN_OUTPUT_PIXELS = _env_int('DOUBAO_MIN_OUTPUT_PIXELS', 1280 * 720)
+# 羽化裁剪框边缘的像素宽度（原图像素），避免贴回后出现矩形接缝
+ROI_BOX_FEATHER_PX = _env_int('ROI_BOX_FEATHER_PX', 24)
+# 融合结果只贴回涂抹区域（向外扩张并羽化），其余像素保持原图；家具轮廓可能略超出涂抹范围，扩张比擦除更大
+FUSION_PASTE_BACK = os.getenv('FUSION_PASTE_BACK', 'true').lower() == 'true'
+FUSION_DILATE_PX = _env_int('FUSION_DILATE_PX', 24)
+FUSION_FEATHER_PX = _env_int('FUSION_FEATHER_PX', 16)
+
+def get_output_size_pixels(size_text):
+    """将豆包 size 参数（档位或 宽x高）换算为像素数，无法识别时按2K计算"""
+    size_text = (size_text or '').strip().upper()
+    if size_text in DOUBAO_SIZE_PRESET_PIXELS:
+        return DOUBAO_SIZE_PRESET_PIXELS[size_text]
     try:
-        # 在编码前压缩图片，限制像素尺寸在1024×1024范围内
-        log_project(f"检查上传到豆包API的图片尺寸...")
-        
-        # 压缩mask图片（如果需要）
-        mask_compressed_path, mask_compressed = compress_image_for_api(mask_image_path, max_dimension=1024)
-        if mask_compressed:
-            log_project(f"Mask图片已压缩: {mask_image_path} -> {mask_compressed_path}")
-            temp_files.append(mask_compressed_path)
-            mask_path_to_encode = mask_compressed_path
-        else:
-            mask_path_to_encode = mask_image_path
-        
-        # 压缩家具图片（如果需要）
-        furniture_compressed_path, furniture_compressed = compress_image_for_api(furniture_image_path, max_dimension=1024)
-        if furniture_compressed:
-            log_project(f"家具图片已压缩: {furniture_image_path} -> {furniture_compressed_path}")
-            temp_files.append(furniture_compressed_path)
-            furniture_path_to_encode = furniture_compressed_path
-        else:
-            furniture_path_to_encode = furniture_image_path
+        width, height = size_text.split('X')
+        return int(width) * int(height)
+    except ValueError:
+        return DOUBAO_SIZE_PRESET_PIXELS['2K']
+
+def resolve_scene_image_path(image_filename):
+    """
+    查找场景原图路径：先查UPLOAD_FOLDER，再查OUTPUT_FOLDER（擦除后的图片在OUTPUT_FOLDER）
+    
+    返回:
+        str: 文件路径，找不到时返回 None
+    """
+    for folder in (app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER']):
+        path = os.path.join(folder, image_filename)
+        if os.path.exists(path):
+            return path
+    return None
+
+def get_pure_mask_path(composite_mask_path):
+    """由叠加mask路径推导同一次保存的纯mask路径（save_mask_image 命名规则），不存在时返回 None"""
+    directory, filename = os.path.split(composite_mask_path)
+    if '_composite_mask_' not in filename:
+        return None
+    pure_mask_path = os.path.join(directory, filename.replace('_composite_mask_', '_pure_mask_', 1))
+    return pure_mask_path if os.path.exists(pure_mask_path) else None
+
+def compute_mask_region_stats(pure_mask_path, image_size=None):
+    """
+    统计纯mask中蓝色涂抹区域：alpha通道求一次外接框，再只对外接框内的像素做一次直方图
+    
+    参数:
+        pure_mask_path: save_mask_image 保存的纯mask路径
+        image_size: 场景原图尺寸 (宽, 高)；前端画布与原图尺寸不同时，外接框按比例换算到原图像素
+    
+    返回:
+        dict: {'bbox': 原图像素坐标, 'bbox_ratio': 外接框占整图的宽、高比例, 'aspect_ratio': 外接框宽高比,
+               'fill_ratio': 涂抹像素占外接框的比例, 'pixel_count': 涂抹像素数, 'image_size'}；涂抹为空时返回 None
+    """
+    with open_cached_image(pure_mask_path) as pure_mask:
+        mask_size = pure_mask.size
+        alpha = pure_mask.convert('RGBA').getchannel('A')
+        bbox = alpha.getbbox()
+        if not bbox:
+            return None
+        histogram = alpha.crop(bbox).histogram()
+    
+    image_size = tuple(image_size or mask_size)
+    scale_x = image_size[0] / float(mask_size[0])
+    scale_y = image_size[1] / float(mask_size[1])
+    left, top, right, bottom = bbox
+    box_width, box_height = right - left, bottom - top
+    pixel_count = box_width * box_height - histogram[0]
+    return {
+        'bbox': [round(left * scale_x), round(top * scale_y), round(right * scale_x), round(bottom * scale_y)],
+        'bbox_ratio': [round(box_width / float(mask_size[0]), 4), round(box_height / float(mask_size[1]), 4)],
+        'aspect_ratio': round(box_width * scale_x / (box_height * scale_y), 4),
+        'fill_ratio': round(pixel_count / float(box_width * box_height), 4),
+        'pixel_count': pixel_count,
+        'image_size': list(image_size)
+    }
+
+def calculate_roi_output_size(box, image_size):
+    """
+    按裁剪框占整图的面积比例分配 DOUBAO_OUTPUT_SIZE 的像素，保持裁剪框宽高比，不低于 DOUBAO_MIN_OUTPUT_PIXELS
+    
+    返回:
+        tuple: (width, height)
+    """
+    box_width, box_height = box[2] - box[0], box[3] - box[1]
+    area_ratio = box_width * box_height / float(image_size[0] * image_size[1])
+    target_pixels = max(get_output_size_pixels(DOUBAO_OUTPUT_SIZE) * area_ratio, DOUBAO_MIN_OUTPUT_PIXELS)
+    scale = math.sqrt(target_pixels / float(box_width * box_height))
+    return math.ceil(box_width * scale), math.ceil(box_height * scale)
+
+def prepare_fusion_roi(composite_mask_path, temp_files):
+    """
+    按纯mask的涂抹区域裁剪叠加mask图片，用于只发送局部场景给豆包
+    
+    返回:
+        dict: {'box', 'image_size', 'crop_path', 'output_size'}；
+        找不到纯mask、涂抹为空或裁剪框接近整图时返回 None
+    """
+    pure_mask_path = get_pure_mask_path(composite_mask_path)
+    if not pure_mask_path:
+        return None
+    
+    with open_cached_image(composite_mask_path) as composite_img, open_cached_image(pure_mask_path) as pure_mask:
+        image_size = composite_img.size
+        alpha = pure_mask.convert('RGBA').getchannel('A')
+        if alpha.size != image_size:
+            alpha = alpha.resize(image_size, Image.Resampling.NEAREST)
+        bbox = alpha.getbbox()
+        if not bbox:
+            return None
+        box = expand_box(bbox, image_size)
+        if not is_box_worth_cropping(box, image_size):
+            return None
+        
+        crop_path = f"{composite_mask_path}.{uuid.uuid4().hex[:8]}.roi.png"
+        crop = composite_img.crop(box)
+        # 解码缓存中的RGB图片为 RGBX 模式，PNG 不支持该模式
+        if crop.mode == 'RGBX':
+            crop = crop.convert('RGB')
+        crop.save(crop_path, 'PNG')
+        temp_files.append(crop_path)
+    
+    output_size = calculate_roi_output_size(box, image_size)
+    log_project(f"融合ROI裁剪: 原图={image_size[0]}x{image_size[1]}, 涂抹区域={bbox}, 裁剪框={box}, "
+                f"请求尺寸={output_size[0]}x{output_size[1]}")
+    return {
+        'box': list(box),
+        'image_size': list(image_size),
+        'crop_path': crop_path,
+        'output_size': output_size
+    }
+
+def build_box_blend_mask(box, image_size, feather_px=None):
+    """
+    生成裁剪框贴回用的混合蒙版：框内为255，向框边缘羽化到0；
+    与整图边界重合的边不羽化（那里没有接缝）
+    """
+    feather_px = ROI_BOX_FEATHER_PX if feather_px is None else feather_px
+    width, height = box[2] - box[0], box[3] - box[1]
+    if feather_px <= 0:
+        return Image.new('L', (width, height), 255)
+    
+    # 先把需要羽化的边向内收缩一个羽化宽度，再模糊，使边缘从255平滑过渡到0
+    inset = [feather_px if box[0] > 0 else -feather_px,
+             feather_px if box[1] > 0 else -feather_px,
+             width - feather_px if box[2] < image_size[0] else width + feather_px,
+             height - feather_px if box[3] < image_size[1] else height + feather_px]
+    blend_mask = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(blend_mask).rectangle([inset[0], inset[1], inset[2] - 1, inset[3] - 1], fill=255)
+    return blend_mask.filter(ImageFilter.GaussianBlur(feather_px / 2))
+
+def scale_box(box, from_size, to_size):
+    """将 from_size 坐标系下的框换算到 to_size 坐标系"""
+    if list(from_size) == list(to_size):
+        return list(box)
+    scale_x = to_size[0] / float(from_size[0])
+    scale_y = to_size[1] / float(from_size[1])
+    return [int(round(box[0] * scale_x)), int(round(box[1] * scale_y)),
+            int(round(box[2] * scale_x)), int(round(box[3] * scale_y))]
+
+def build_fusion_paste_back(result, inputs):
+    """
+    根据融合结果和请求参数确定贴回方式
+    
+    返回:
+        dict: {'scene_path', 'pure_mask_path', 'roi'}，无需贴回时返回 None
+    """
+    roi = result.get('roi')
+    pure_mask_path = inputs.get('pure_mask_path') if FUSION_PASTE_BACK else None
+    if not roi and not pure_mask_path:
+        return None
+    return {'scene_path': inputs['scene_path'], 'pure_mask_path': pure_mask_path, 'roi': roi}
+
+def paste_back_fusion_result(output_filepath, paste_back):
+    """
+    把融合结果对齐到原始场景图分辨率并贴回，覆盖写入 output_filepath
+    
+    有纯mask时只替换涂抹区域（扩张+羽化），其余像素保持原图；
+    没有纯mask时（仅ROI）替换整个裁剪框，框边缘羽化
+    """
+    with open_cached_image(paste_back['scene_path']) as scene_img, Image.open(output_filepath) as generated_img:
+        base_image = scene_img.convert('RGB')
+        image_size = base_image.size
+        roi = paste_back['roi']
+        box = scale_box(roi['box'], roi['image_size'], image_size) if roi else [0, 0, image_size[0], image_size[1]]
+        
+        blend_mask = build_box_blend_mask(box, image_size) if roi else None
+        if paste_back['pure_mask_path']:
+            with open_cached_image(paste_back['pure_mask_path']) as pure_mask:
+                alpha = pure_mask.convert('RGBA').getchannel('A')
+            if alpha.size != image_size:
+                alpha = alpha.resize(image_size, Image.Resampling.NEAREST)
+            region_mask = alpha.crop(box).point(lambda p: 255 if p > 0 else 0)
+            region_blend = build_blend_mask(region_mask, FUSION_DILATE_PX, FUSION_FEATHER_PX)
+            blend_mask = ImageChops.multiply(region_blend, blend_mask) if blend_mask else region_blend
+        
+        paste_back_region(base_image, generated_img.convert('RGB'), box, blend_mask)
+    base_image.save(output_filepath, 'JPEG', quality=95)
+    log_project(f"融合结果已贴回原图: {output_filepath}, 尺寸={image_size}, 区域={box}")
+
+# 多图请求的负载准备（压缩、编码）并发执行；Pillow编解码和Base64编码大部分时间释放GIL
+PAYLOAD_BUILDER_THREADS = _env_int('PAYLOAD_BUILDER_THREADS', 8)
+
+_PAYLOAD_STATS = {'requests': 0, 'images': 0, 'sequential_seconds': 0.0, 'wall_seconds': 0.0}
+_PAYLOAD_STATS_LOCK = threading.Lock()
+
+def encode_api_image(image_path, temp_files, max_dimension=1024):
+    """压缩图片（或使用预生成的API图片）并编码为Base64 Data URL"""
+    return encode_file_to_base64(prepare_api_image(image_path, temp_files, max_dimension))
+
+def build_payloads(builders, label):
+    """
+    并发执行多图请求中每张图片的负载准备，按传入顺序返回结果
+    
+    参数:
+        builders: 无参可调用对象列表，每个返回一张图片的负载（如Base64 Data URL）
+        label: 日志中的调用名称
+    
+    返回:
+        list: 各图片负载；任一准备失败时等其余完成后抛出该异常（避免临时文件在清理后才写出）
+    """
+    def timed(builder):
+        start = time.time()
+        return builder(), time.time() - start
+    
+    wall_start = time.time()
+    if len(builders) > 1 and PAYLOAD_BUILDER_THREADS > 1:
+        pool = get_thread_pool('payload-builder', PAYLOAD_BUILDER_THREADS)
+        futures = [pool.submit(timed, builder) for builder in builders]
+        wait(futures)
+        outcomes = [future.result() for future in futures]
+    else:
+        outcomes = [timed(builder) for builder in builders]
+    wall_seconds = time.time() - wall_start
+    sequential_seconds = sum(seconds for _, seconds in outcomes)
+    
+    with _PAYLOAD_STATS_LOCK:
+        _PAYLOAD_STATS['requests'] += 1
+        _PAYLOAD_STATS['images'] += len(builders)
+        _PAYLOAD_STATS['sequential_seconds'] += sequential_seconds
+        _PAYLOAD_STATS['wall_seconds'] += wall_seconds
+    log_project(f"{label} 负载准备: {len(builders)}张图片, 逐张耗时合计={sequential_seconds:.3f}s, "
+                f"实际耗时={wall_seconds:.3f}s, 节省={max(0.0, sequential_seconds - wall_seconds):.3f}s")
+    return [payload for payload, _ in outcomes]
+
+def get_payload_stats():
+    """负载准备统计：顺序执行的估算耗时与并发后的实际耗时"""
+    with _PAYLOAD_STATS_LOCK:
+        stats = dict(_PAYLOAD_STATS)
+    stats['saved_seconds'] = round(max(0.0, stats['sequential_seconds'] - stats['wall_seconds']), 3)
+    stats['sequential_seconds'] = round(stats['sequential_seconds'], 3)
+    stats['wall_seconds'] = round(stats['wall_seconds'], 3)
+    return stats
+
+# 豆包客户端单例（避免重复创建客户端实例导致内存泄漏）
+_DOUBAO_CLIENT = None
+
+def get_doubao_client():
+    """获取豆包客户端实例（单例模式，避免内存泄漏）"""
+    global _DOUBAO_CLIENT
+    
+    if _DOUBAO_CLIENT is None:
+        if not DOUBAO_AVAILABLE:
+            raise Exception("豆包SDK未安装")
+        
+        api_key = os.getenv("ARK_API_KEY")
+        if not api_key:
+            raise Exception("未配置ARK_API_KEY环境变量")
+        
+        # 客户端默认时限与单次调用时限一致；不在SDK内重试，失败由路由切换到备用后端
+        _DOUBAO_CLIENT = Ark(
+            base_url=ARK_BASE_URL,
+            api_key=api_key,
+            timeout=get_provider_call_timeout('doubao'),
+            max_retries=0
+        )
+        log_project("豆包客户端初始化成功（单例模式）")
+    
+    return _DOUBAO_CLIENT
+
+def report_progress(progress, stage, **info):
+    """调用进度回调 progress(stage, **info)；回调异常不影响主流程"""
+    if progress is None:
+        return
+    try:
+        progress(stage, **info)
+    except Exception as e:
+        log_project(f"进度回调失败 ({stage}): {str(e)}")
+
+# 各服务商生成结果的返回格式：'url' 需要再下载一次图片；'b64_json' 随响应内联返回，省去下载往返
+# 通义千问（DashScope）图片编辑只支持返回URL
+PROVIDER_RESPONSE_FORMATS = {
+    'doubao': ('url', 'b64_json'),
+    'qwen': ('url',),
+}
+
+def get_response_format(provider_name, override=None):
+    """获取服务商的结果返回格式（环境变量 DOUBAO_RESPONSE_FORMAT 等，可被调用参数覆盖）"""
+    supported = PROVIDER_RESPONSE_FORMATS.get(provider_name, ('url',))
+    response_format = override or os.getenv(f"{provider_name.upper()}_RESPONSE_FORMAT", 'url')
+    if response_format not in supported:
+        log_project(f"警告: {provider_name} 不支持返回格式 {response_format}，使用 url")
+        return 'url'
+    return response_format
+
+def extract_doubao_images(response):
+    """从豆包响应中提取生成结果：URL字符串，或内联结果 {'b64_json': str}"""
+    generated_images = []
+    for item in response.data or []:
+        if getattr(item, 'b64_json', None):
+            generated_images.append({'b64_json': item.b64_json})
+        elif getattr(item, 'url', None):
+            generated_images.append(item.url)
+    return generated_images
+
+def describe_generated_image(image):
+    """生成结果的日志描述（内联结果不写入完整Base64）"""
+    if isinstance(image, dict):
+        return f"<inline b64_json, {len(image['b64_json'])} chars>"
+    return image
+
+# 内联Base64分块解码的块大小（必须是4的倍数）
+B64_DECODE_CHUNK_SIZE = 256 * 1024
+
+def save_generated_image(image, output_filepath, timeout=30):
+    """
+    将服务商生成结果写入输出文件
+    
+    URL结果流式下载写盘，不在内存中保留完整响应体；
+    内联 b64_json 结果按块解码后直接写入文件，不生成完整的解码副本
+    
+    参数:
+        image: URL字符串或 {'b64_json': str}
+        output_filepath: 输出文件路径
+        timeout: 下载超时（秒）
+    
+    返回:
+        int: 写入的字节数
+    """
+    written = 0
+    try:
+        with open(output_filepath, 'wb') as f:
+            if isinstance(image, dict):
+                data = image['b64_json']
+                for offset in range(0, len(data), B64_DECODE_CHUNK_SIZE):
+                    written += f.write(binascii.a2b_base64(data[offset:offset + B64_DECODE_CHUNK_SIZE]))
+            else:
+                with requests.get(image, stream=True, timeout=timeout) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        written += f.write(chunk)
+    except Exception:
+        # 写入失败时删除不完整的文件
+        if os.path.exists(output_filepath):
+            os.remove(output_filepath)
+        raise
+    return written
+
+@provider_guarded('doubao')
+def call_doubao_image_fusion(mask_image_path, furniture_image_path, prompt_text, response_format=None, seed=None, progress=None):
+    """调用豆包图像融合API（response_format 为 None 时使用 DOUBAO_RESPONSE_FORMAT 配置；seed 用于生成不同的候选结果；
+    progress 为可选的进度回调，见 report_progress）"""
+    if not DOUBAO_AVAILABLE:
+        raise Exception("豆包SDK未安装")
+    
+    # 使用全局客户端实例（单例模式）
+    client = get_doubao_client()
+    
+    # 用于跟踪临时文件，以便后续清理
+    temp_files = []
+    stage_start = time.time()
+    roi = None
+    
+    try:
+        # ROI模式：只发送涂抹区域周围的局部场景，并按面积比例请求更小的输出
+        if DOUBAO_FUSION_ROI:
+            roi = prepare_fusion_roi(mask_image_path, temp_files)
+        source_mask_path = roi['crop_path'] if roi else mask_image_path
+        output_size = f"{roi['output_size'][0]}x{roi['output_size'][1]}" if roi else DOUBAO_OUTPUT_SIZE
+        
+        # 在编码前压缩图片，限制像素尺寸在1024×1024范围内
+        log_project(f"检查上传到豆包API的图片尺寸...")
         
-        # 编码图片为Base64
-        mask_base64 = encode_file_to_base64(mask_path_to_encode)
-        furniture_base64 = encode_file_to_base64(furniture_path_to_encode)
+        # 并发压缩并编码mask和家具图片（/save_mask 已预生成API图片时直接使用）
+        mask_base64, furniture_base64 = build_payloads([
+            functools.partial(encode_api_image, source_mask_path, temp_files),
+            functools.partial(encode_api_image, resolve_furniture_image(furniture_image_path), temp_files)
+        ], '豆包家具融合')
         
         # 记录Base64数据大小
         mask_base64_size = len(mask_base64) / 1024 / 1024  # MB
         furniture_base64_size = len(furniture_base64) / 1024 / 1024  # MB
         log_project(f"Base64编码后大小 - Mask: {mask_base64_size:.2f}MB, Furniture: {furniture_base64_size:.2f}MB")
+        report_progress(progress, 'payload_built', provider='doubao', seconds=round(time.time() - stage_start, 3),
+                        payload_bytes=len(mask_base64) + len(furniture_base64))
         
-        log_project(f"开始调用豆包API - mask: {mask_path_to_encode}, furniture: {furniture_path_to_encode}")
+        log_project(f"开始调用豆包API - mask: {source_mask_path}, furniture: {furniture_image_path}")
         log_project(f"Prompt: {prompt_text}")
         
         # 验证mask图片内容（检查前100个字符的Base64，确保不是空图片）
@@ -1132,29 +2238,36 @@ def call_doubao_image_fusion(mask_image_path, furniture_image_path, prompt_text)
         # mask图片应该包含：原始场景（擦除后的场景）+ 蓝色涂抹区域
         # 这样API才能知道在哪个场景的哪个位置放置家具
         log_project(f"调用豆包API，传入2张图片：1. mask（场景+蓝色涂抹）, 2. 家具")
+        report_progress(progress, 'provider_called', provider='doubao')
+        provider_start = time.time()
         response = client.images.generate(
             model="doubao-seedream-4-5-251128",  # 豆包模型ID
             prompt=prompt_text,
             image=[mask_base64, furniture_base64],  # 本地图片Base64列表：[场景+蓝色涂抹, 家具]
-            size="2K",  # 输出分辨率
-            response_format="url",  # 输出格式：url
-            watermark=False  # 不添加水印
+            size=output_size,  # 输出分辨率（ROI模式为 宽x高）
+            response_format=get_response_format('doubao', response_format),  # 输出格式：url 或 b64_json
+            seed=seed,  # 随机种子（None 表示由服务端随机）
+            watermark=False,  # 不添加水印
+            timeout=get_provider_call_timeout('doubao')
         )
         
         # 处理响应
         if response.data:
-            # 获取生成的图片URL
-            generated_images = []
-            for item in response.data:
-                if hasattr(item, 'url') and item.url:
-                    generated_images.append(item.url)
+            # 获取生成的图片（URL或内联Base64）
+            generated_images = extract_doubao_images(response)
             
             log_project(f"豆包API调用成功，生成{len(generated_images)}张图片")
+            report_progress(progress, 'provider_done', provider='doubao', seconds=round(time.time() - provider_start, 3),
+                            images=len(generated_images))
             
-            return {
+            result = {
                 'success': True,
                 'images': generated_images
             }
+            if roi:
+                # 调用方需将结果贴回原始场景图对应区域
+                result['roi'] = {'box': roi['box'], 'image_size': roi['image_size']}
+            return result
         else:
             error_msg = "豆包API返回空数据"
             log_project(f"豆包API调用失败: {error_msg}")
@@ -1233,8 +2346,8 @@ def upload_file():
                 log_project(f"保存文件失败: {str(e)}")
                 return jsonify({'error': f'保存文件失败: {str(e)}'}), 500
             
-            # 调用百度智能云API识别客厅尺寸
-            size_result = call_baidu_room_size_api(filepath)
+            # 调用百度智能云API识别客厅尺寸（同一张照片的重复上传直接使用缓存结果）
+            size_result = detect_room_size_cached(filepath)
             
             response_data = {
                 'success': True,
@@ -1251,248 +2364,2847 @@ def upload_file():
         log_project(f"上传文件错误: {str(e)}")
         return jsonify({'error': '上传失败'}), 500
 
-# 家具元数据缓存（避免每次请求都重新读取文件）
+# 家具目录索引：按元数据文件和家具目录的mtime判断是否变化，变化时才重建（不再按固定TTL过期）
+FURNITURE_METADATA_FILENAME = 'furniture_metadata.json'
+# 房间尺寸过滤时家具长宽占房间对应尺寸的上限比例（留出空间）
+FURNITURE_ROOM_FIT_RATIO = 0.8
+# 分面查询的尺寸档位（按家具长度，单位米）：(key, 下限含, 上限不含)
+FURNITURE_SIZE_BUCKETS = [
+    ('lt_1.6', None, 1.6),
+    ('1.6_2.0', 1.6, 2.0),
+    ('2.0_2.4', 2.0, 2.4),
+    ('ge_2.4', 2.4, None),
+]
+FURNITURE_SIZE_UNKNOWN = 'unknown'
+FURNITURE_PAGE_SIZE_DEFAULT = 24
+FURNITURE_PAGE_SIZE_MAX = 100
+# 按房间尺寸推荐家具时默认/最多返回的数量
+FURNITURE_RECOMMEND_TOP_K_DEFAULT = 12
+FURNITURE_RECOMMEND_TOP_K_MAX = 100
+# 家具列表响应的浏览器缓存时间（秒）；过期后带 If-None-Match 重新验证，目录未变化时返回304
+FURNITURE_CACHE_MAX_AGE = _env_int('FURNITURE_CACHE_MAX_AGE', 60)
+# 每个worker进程缓存的已序列化查询结果条数（目录版本变化时整体清空）
+FURNITURE_RESPONSE_CACHE_ENTRIES = _env_int('FURNITURE_RESPONSE_CACHE_ENTRIES', 512)
+
 _FURNITURE_METADATA_CACHE = None
-_FURNITURE_METADATA_CACHE_TIME = None
-_FURNITURE_METADATA_CACHE_TTL = 300  # 缓存5分钟（300秒）
+_FURNITURE_METADATA_CACHE_KEY = None
+# 元数据文件中的 pending：已放入家具目录、但批量导入尚未提交的文件名，列出家具时跳过
+_FURNITURE_PENDING_CACHE = frozenset()
+_FURNITURE_METADATA_LOCK = threading.Lock()
+
+def get_furniture_metadata_path():
+    return os.path.join(app.config['FURNITURE_FOLDER'], FURNITURE_METADATA_FILENAME)
+
+def _stat_signature(path):
+    """返回 (mtime_ns, 文件大小)，文件不存在时返回 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
 
 def load_furniture_metadata(force_reload=False):
-    """加载家具元数据文件（带缓存机制，避免内存泄漏）"""
-    global _FURNITURE_METADATA_CACHE, _FURNITURE_METADATA_CACHE_TIME
+    """加载家具元数据文件（按文件mtime和大小缓存，文件未修改时直接返回缓存）"""
+    global _FURNITURE_METADATA_CACHE, _FURNITURE_METADATA_CACHE_KEY, _FURNITURE_PENDING_CACHE
+    
+    metadata_path = get_furniture_metadata_path()
+    cache_key = _stat_signature(metadata_path)
     
     # 检查缓存是否有效
-    if not force_reload and _FURNITURE_METADATA_CACHE is not None:
-        if _FURNITURE_METADATA_CACHE_TIME is not None:
-            current_time = time.time()
-            if current_time - _FURNITURE_METADATA_CACHE_TIME < _FURNITURE_METADATA_CACHE_TTL:
-                return _FURNITURE_METADATA_CACHE
+    if not force_reload and _FURNITURE_METADATA_CACHE is not None and cache_key == _FURNITURE_METADATA_CACHE_KEY:
+        return _FURNITURE_METADATA_CACHE
     
-    # 加载元数据
-    metadata_path = os.path.join(app.config['FURNITURE_FOLDER'], 'furniture_metadata.json')
+    if cache_key is None:
+        _FURNITURE_PENDING_CACHE = frozenset()
+        log_project("家具元数据文件不存在，将使用文件名解析")
+        return []
     
-    if os.path.exists(metadata_path):
+    with _FURNITURE_METADATA_LOCK:
+        if not force_reload and _FURNITURE_METADATA_CACHE is not None and cache_key == _FURNITURE_METADATA_CACHE_KEY:
+            return _FURNITURE_METADATA_CACHE
         try:
             with open(metadata_path, 'r', encoding='utf-8') as f:
                 metadata = json.load(f)
-                furniture_list = metadata.get('furniture', [])
-                
-                # 更新缓存
-                _FURNITURE_METADATA_CACHE = furniture_list
-                _FURNITURE_METADATA_CACHE_TIME = time.time()
-                
-                log_project(f"家具元数据加载成功，共 {len(furniture_list)} 个家具（已缓存）")
-                return furniture_list
+            furniture_list = metadata.get('furniture', [])
+            
+            # 更新缓存
+            _FURNITURE_PENDING_CACHE = frozenset(metadata.get('pending', []))
+            _FURNITURE_METADATA_CACHE = furniture_list
+            _FURNITURE_METADATA_CACHE_KEY = cache_key
+            
+            log_project(f"家具元数据加载成功，共 {len(furniture_list)} 个家具（已缓存）")
+            return furniture_list
         except Exception as e:
             log_project(f"加载家具元数据文件失败: {str(e)}")
             return []
-    else:
-        log_project("家具元数据文件不存在，将使用文件名解析")
-        return []
 
-@app.route('/furniture')
-def get_furniture_list():
-    """获取家具库列表 - 支持按风格和尺寸过滤"""
-    try:
-        # 获取查询参数
-        style = request.args.get('style', None)  # 沙发风格
-        min_length = request.args.get('min_length', None, type=float)  # 最小长度（米）
-        max_length = request.args.get('max_length', None, type=float)  # 最大长度（米）
-        min_width = request.args.get('min_width', None, type=float)  # 最小宽度（米）
-        max_width = request.args.get('max_width', None, type=float)  # 最大宽度（米）
-        room_length = request.args.get('room_length', None, type=float)  # 客厅长度
-        room_width = request.args.get('room_width', None, type=float)  # 客厅宽度
-        
-        furniture_folder = app.config['FURNITURE_FOLDER']
-        furniture_list = []
-        
-        # 加载元数据
-        metadata_list = load_furniture_metadata()
-        metadata_dict = {item['filename']: item for item in metadata_list}
-        
-        if os.path.exists(furniture_folder):
-            files = os.listdir(furniture_folder)
-            
-            for filename in files:
-                # 跳过元数据文件本身
-                if filename == 'furniture_metadata.json':
-                    continue
-                    
-                if allowed_file(filename):
-                    # 从元数据中获取信息，如果没有则使用默认值
-                    metadata = metadata_dict.get(filename, {})
-                    
-                    furniture_style = metadata.get('style')
-                    furniture_length = metadata.get('length')
-                    furniture_width = metadata.get('width')
-                    display_name = metadata.get('display_name', os.path.splitext(filename)[0])
-                    furniture_type = metadata.get('type', 'sofa')
-                    description = metadata.get('description', '')
-                    
-                    # 如果没有元数据，尝试从文件名解析（向后兼容）
-                    if not furniture_style:
-                        name_parts = os.path.splitext(filename)[0].split('_')
-                        if len(name_parts) >= 2:
-                            furniture_style = name_parts[1]
-                    
-                    furniture_item = {
-                        'name': filename,
-                        'path': f'/furniture/{filename}',
-                        'display_name': display_name,
-                        'style': furniture_style,
-                        'length': furniture_length,  # 家具长度（米）
-                        'width': furniture_width,     # 家具宽度（米）
-                        'type': furniture_type,
-                        'description': description
-                    }
-                    
-                    # 按风格过滤
-                    if style and furniture_style:
-                        if furniture_style.lower() != style.lower():
-                            continue
-                    elif style:
-                        # 如果指定了风格但没有元数据，跳过
-                        continue
-                    
-                    # 按尺寸过滤（如果提供了房间尺寸，过滤出适合的家具）
-                    if room_length and room_width:
-                        # 过滤逻辑：
-                        # 1. 如果家具没有尺寸信息，保留（让用户自己判断）
-                        # 2. 如果家具有尺寸信息，检查是否适合房间
-                        # 家具长度和宽度都应该小于房间对应尺寸的80%（留出空间）
-                        if furniture_length:
-                            if furniture_length > room_length * 0.8:
-                                continue
-                        if furniture_width:
-                            if furniture_width > room_width * 0.8:
-                                continue
-                    
-                    # 按最小/最大尺寸过滤
-                    if min_length and furniture_length:
-                        if furniture_length < min_length:
-                            continue
-                    if max_length and furniture_length:
-                        if furniture_length > max_length:
-                            continue
-                    if min_width and furniture_width:
-                        if furniture_width < min_width:
-                            continue
-                    if max_width and furniture_width:
-                        if furniture_width > max_width:
-                            continue
-                    
-                    furniture_list.append(furniture_item)
-        
-        log_project(f"返回家具列表，共 {len(furniture_list)} 个家具 (风格={style}, 房间尺寸={room_length}x{room_width})")
-        return jsonify({'furniture': furniture_list})
-        
-    except Exception as e:
-        log_project(f"获取家具列表错误: {str(e)}")
-        return jsonify({'error': '获取家具列表失败'}), 500
+def build_furniture_item(filename, metadata, image_info=None):
+    """
+    由文件名和元数据生成 /furniture 返回的家具条目
+    
+    没有元数据时使用默认值，风格尝试从文件名解析（向后兼容）；
+    image_info 为 read_image_header 的结果（来自预编译清单），没有时图片相关字段为 None
+    """
+    image_info = image_info or {}
+    furniture_style = metadata.get('style')
+    if not furniture_style:
+        name_parts = os.path.splitext(filename)[0].split('_')
+        if len(name_parts) >= 2:
+            furniture_style = name_parts[1]
+    
+    return {
+        'name': filename,
+        'path': f'/furniture/{filename}',
+        'display_name': metadata.get('display_name', os.path.splitext(filename)[0]),
+        'style': furniture_style,
+        'length': metadata.get('length'),  # 家具长度（米）
+        'width': metadata.get('width'),     # 家具宽度（米）
+        'height': metadata.get('height'),
+        'type': metadata.get('type', 'sofa'),
+        'description': metadata.get('description', ''),
+        'image_width': image_info.get('width'),
+        'image_height': image_info.get('height'),
+        'aspect_ratio': round(image_info['width'] / image_info['height'], 4) if image_info.get('height') else None,
+        'has_alpha': image_info.get('has_alpha')
+    }
 
-@app.route('/furniture/<filename>')
-def serve_furniture(filename):
-    """提供家具图片"""
-    return send_from_directory(app.config['FURNITURE_FOLDER'], filename)
+def get_size_bucket(length):
+    """返回家具长度所在的尺寸档位key，没有长度信息时返回 unknown"""
+    if not length:
+        return FURNITURE_SIZE_UNKNOWN
+    for key, low, high in FURNITURE_SIZE_BUCKETS:
+        if (low is None or length >= low) and (high is None or length < high):
+            return key
+    return FURNITURE_SIZE_UNKNOWN
 
-@app.route('/user/<filename>')
-def serve_user_image(filename):
-    """提供用户上传的图片"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+def _score_dimension(value, low, high):
+    """单个尺寸的匹配度：落在推荐范围内为 0.8~1（越接近中点越高），超出范围按超出距离线性衰减到0"""
+    span = max(high - low, 0.1)
+    if low <= value <= high:
+        middle = (low + high) / 2
+        return 1.0 - 0.2 * abs(value - middle) / (span / 2)
+    distance = low - value if value < low else value - high
+    return max(0.0, 0.8 - 0.8 * distance / span)
 
-@app.route('/output/<filename>')
-def serve_output_image(filename):
-    """提供生成的图片"""
-    return send_from_directory(app.config['OUTPUT_FOLDER'], filename)
+def score_furniture_fit(length, width, sofa_range):
+    """
+    按 calculate_sofa_size_range 给出的推荐范围给家具打分
+    
+    参数:
+        length / width: 家具长宽（米），缺失时为 None
+        sofa_range: calculate_sofa_size_range 的返回值
+    
+    返回:
+        float: 0~1 的匹配度（长度、宽度得分的平均值），没有任何尺寸信息时返回 None
+    """
+    scores = []
+    if length:
+        scores.append(_score_dimension(length, sofa_range['sofa_length_min'], sofa_range['sofa_length_max']))
+    if width:
+        scores.append(_score_dimension(width, sofa_range['sofa_width_min'], sofa_range['sofa_width_max']))
+    if not scores:
+        return None
+    return round(sum(scores) / len(scores), 4)
 
-@app.route('/masks/<filename>')
-def serve_mask_image(filename):
-    """提供mask图片"""
-    return send_from_directory(app.config['MASK_FOLDER'], filename)
+def _score_dimension_array(values, low, high):
+    """
+    _score_dimension 的向量化版本，NaN 和 0（缺失，与 score_furniture_fit 一致）为 NaN
+    
+    推荐范围不小于 0.1 米时（正常情况），两段直线在范围边界处连续，写成“中心直线 - 超出范围部分的额外斜率”，
+    避免按条件逐元素选取（np.where 在大数组上明显更慢）；范围过窄或上下限颠倒时按原公式分段计算
+    """
+    span = max(high - low, 0.1)
+    if high - low < 0.1:
+        middle = (low + high) / 2
+        inside = 1.0 - 0.2 * np.abs(values - middle) / (span / 2)
+        distance = np.where(values < low, low - values, values - high)
+        outside = np.maximum(0.0, 0.8 - 0.8 * distance / span)
+        scores = np.where((values >= low) & (values <= high), inside, outside)
+        scores[values == 0] = np.nan
+        return scores
+    
+    half_range = (high - low) / 2
+    distance = np.abs(values - (low + high) / 2)
+    excess = distance - half_range
+    np.maximum(excess, 0.0, out=excess)
+    scores = distance * (-0.4 / span)
+    scores += 1.0
+    excess *= 0.4 / span
+    scores -= excess
+    np.maximum(scores, 0.0, out=scores)
+    scores[values == 0] = np.nan
+    return scores
 
-@app.route('/save_mask', methods=['POST'])
-def save_mask():
-    """保存用户绘制的mask图片"""
-    try:
-        data = request.get_json()
-        
-        original_image = data.get('original_image', '')
-        mask_data = data.get('mask_data', '')
-        
-        if not original_image or not mask_data:
-            return jsonify({'error': '缺少必要参数'}), 400
-        
-        # 保存mask图片
-        mask_filename, mask_filepath = save_mask_image(original_image, mask_data)
-        
-        return jsonify({
-            'success': True,
-            'mask_filename': mask_filename,
-            'mask_path': f'/masks/{mask_filename}',
-            'message': 'Mask图片保存成功'
-        })
-        
-    except Exception as e:
-        log_project(f"保存mask图片错误: {str(e)}")
-        return jsonify({'error': f'保存失败: {str(e)}'}), 500
+def score_fit_array(lengths, widths, sofa_range):
+    """
+    score_furniture_fit 的向量化版本
+    
+    参数:
+        lengths / widths: float64 数组（缺失为 NaN，0 也视为缺失）
+        sofa_range: calculate_sofa_size_range 的返回值
+    
+    返回:
+        numpy.ndarray: 每个家具的匹配度，长宽都缺失的为 NaN
+    """
+    length_scores = _score_dimension_array(lengths, sofa_range['sofa_length_min'], sofa_range['sofa_length_max'])
+    width_scores = _score_dimension_array(widths, sofa_range['sofa_width_min'], sofa_range['sofa_width_max'])
+    # fmax/fmin 忽略 NaN：长宽都有时为两者平均，只有一项时为该项，都缺失时为 NaN
+    scores = np.fmax(length_scores, width_scores)
+    scores += np.fmin(length_scores, width_scores)
+    scores *= 0.5
+    return np.round(scores, 4, out=scores)
 
-@app.route('/api/inpaint', methods=['POST'])
-def inpaint_image():
-    """图像修复接口：使用通义千问qwen-image-edit-plus模型擦除家具"""
-    try:
-        if not DASHSCOPE_AVAILABLE:
-            return jsonify({'error': 'DashScope SDK未安装，图像修复功能不可用'}), 500
-        
-        # 检查是否有文件上传
-        if 'original_image' not in request.files or 'mask_image' not in request.files:
-            return jsonify({'error': '缺少必要参数：需要上传original_image和mask_image'}), 400
-        
-        original_file = request.files['original_image']
-        mask_file = request.files['mask_image']
-        
-        if original_file.filename == '' or mask_file.filename == '':
-            return jsonify({'error': '文件不能为空'}), 400
-        
-        # 保存上传的文件
-        upload_folder = app.config['UPLOAD_FOLDER']
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        original_filename = secure_filename(original_file.filename)
-        original_unique = f"{uuid.uuid4()}_inpaint_original_{timestamp}_{original_filename}"
-        original_path = os.path.join(upload_folder, original_unique)
-        original_file.save(original_path)
-        
-        mask_filename = secure_filename(mask_file.filename)
-        mask_unique = f"{uuid.uuid4()}_inpaint_mask_{timestamp}_{mask_filename}"
-        mask_path = os.path.join(upload_folder, mask_unique)
-        mask_file.save(mask_path)
-        
-        log_project(f"开始图像修复 - 原图: {original_unique}, 蒙版: {mask_unique}")
+def top_k_positions(scores, top_k):
+    """
+    取分数最高的 top_k 个下标：先用 np.partition 在 O(n) 内找到第k大的分数，只对入选的k个排序
+    
+    NaN 不参与排名；分数相同时按下标从小到大，结果与完整排序后取前k个一致
+    
+    返回:
+        numpy.ndarray: 下标，按分数从高到低
+    """
+    candidates = np.flatnonzero(~np.isnan(scores))
+    if len(candidates) > top_k:
+        candidate_scores = scores[candidates]
+        kth_score = -np.partition(-candidate_scores, top_k - 1)[top_k - 1]
+        above = candidates[candidate_scores > kth_score]
+        tied = candidates[candidate_scores == kth_score][:top_k - len(above)]
+        candidates = np.concatenate([above, tied])
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+def rank_top_fits(lengths, widths, sofa_range, top_k):
+    """
+    对一组家具按匹配度取前 top_k 个
+    
+    有NumPy时整体向量化评分，用 top_k_positions 在 O(n) 内选出前k个再对这k个排序；否则逐个评分后用堆选取。
+    无法评分（长宽都缺失）的家具不参与排名；分数相同时保持输入顺序
+    
+    参数:
+        lengths / widths: 长宽序列（NumPy数组时缺失为 NaN，列表时缺失为 None）
+        sofa_range: calculate_sofa_size_range 的返回值
+        top_k: 返回的数量
+    
+    返回:
+        tuple: ([(输入中的下标, 匹配度), ...] 按匹配度从高到低, 参与评分的家具数)
+    """
+    if NUMPY_AVAILABLE:
+        lengths = np.asarray(lengths, dtype=np.float64)
+        widths = np.asarray(widths, dtype=np.float64)
+        scores = score_fit_array(lengths, widths, sofa_range)
+        order = top_k_positions(scores, top_k)
+        return [(int(position), float(scores[position])) for position in order], int(np.count_nonzero(~np.isnan(scores)))
+    
+    scored = [(score, position) for position, score in
+              enumerate(score_furniture_fit(length, width, sofa_range) for length, width in zip(lengths, widths))
+              if score is not None]
+    best = heapq.nsmallest(top_k, scored, key=lambda pair: (-pair[0], pair[1]))
+    return [(position, score) for score, position in best], len(scored)
+
+# 按涂抹区域推荐家具：宽高比得分的权重（其余为长度得分）；比值与目标相差一倍（偏大或偏小）及以上时该项为0
+MASK_FIT_ASPECT_WEIGHT = _env_float('MASK_FIT_ASPECT_WEIGHT', 0.5)
+
+def front_aspect_ratio(length, height, image_width=None, image_height=None):
+    """家具正面宽高比：有长度和高度时取 长/高，否则取图片宽高比，都没有时返回 None"""
+    if length and height and length > 0 and height > 0:
+        return length / height
+    if image_width and image_height:
+        return image_width / float(image_height)
+    return None
+
+def _score_ratio(value, target):
+    """按对数比值打分：与目标相等为1，相差一倍为0"""
+    return max(0.0, 1.0 - abs(math.log(value / target)) / math.log(2))
+
+def score_region_fit(length, aspect, region):
+    """
+    按涂抹区域给家具打分
+    
+    参数:
+        length: 家具长度（米），缺失时为 None
+        aspect: front_aspect_ratio 的结果，缺失时为 None
+        region: {'length': 涂抹区域的估算长度（米，未知时为 None）, 'aspect_ratio': 涂抹区域外接框宽高比}
+    
+    返回:
+        float: 0~1 的匹配度（宽高比和长度得分按 MASK_FIT_ASPECT_WEIGHT 加权），两项都无法计算时返回 None
+    """
+    total, weight = 0.0, 0.0
+    if aspect and aspect > 0:
+        total += MASK_FIT_ASPECT_WEIGHT * _score_ratio(aspect, region['aspect_ratio'])
+        weight += MASK_FIT_ASPECT_WEIGHT
+    if length and length > 0 and region.get('length'):
+        total += (1.0 - MASK_FIT_ASPECT_WEIGHT) * _score_ratio(length, region['length'])
+        weight += 1.0 - MASK_FIT_ASPECT_WEIGHT
+    if not weight:
+        return None
+    return round(total / weight, 4)
+
+def _score_ratio_array(values, target):
+    """_score_ratio 的向量化版本，缺失（NaN）或非正数为 NaN"""
+    ratios = values / target
+    ratios[~(ratios > 0)] = np.nan
+    scores = np.log(ratios)
+    np.abs(scores, out=scores)
+    scores /= -math.log(2)
+    scores += 1.0
+    return np.maximum(scores, 0.0, out=scores)
+
+def score_region_fit_array(lengths, aspects, region):
+    """
+    score_region_fit 的向量化版本
+    
+    返回:
+        numpy.ndarray: 每个家具的匹配度，两项都无法计算的为 NaN
+    """
+    aspect_scores = _score_ratio_array(aspects, region['aspect_ratio'])
+    if region.get('length'):
+        length_scores = _score_ratio_array(lengths, region['length'])
+    else:
+        length_scores = np.full(len(lengths), np.nan)
+    aspect_known = ~np.isnan(aspect_scores)
+    length_known = ~np.isnan(length_scores)
+    weights = aspect_known * MASK_FIT_ASPECT_WEIGHT + length_known * (1.0 - MASK_FIT_ASPECT_WEIGHT)
+    totals = np.where(aspect_known, aspect_scores, 0.0) * MASK_FIT_ASPECT_WEIGHT
+    totals += np.where(length_known, length_scores, 0.0) * (1.0 - MASK_FIT_ASPECT_WEIGHT)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores = totals / weights
+    scores[weights == 0] = np.nan
+    return np.round(scores, 4, out=scores)
+
+def rank_top_region_fits(lengths, aspects, region, top_k):
+    """
+    对一组家具按与涂抹区域的匹配度取前 top_k 个（选取方式同 rank_top_fits）
+    
+    返回:
+        tuple: ([(输入中的下标, 匹配度), ...] 按匹配度从高到低, 参与评分的家具数)
+    """
+    if NUMPY_AVAILABLE:
+        lengths = np.asarray(lengths, dtype=np.float64)
+        aspects = np.asarray(aspects, dtype=np.float64)
+        scores = score_region_fit_array(lengths, aspects, region)
+        order = top_k_positions(scores, top_k)
+        return [(int(position), float(scores[position])) for position in order], int(np.count_nonzero(~np.isnan(scores)))
+    
+    scored = [(score, position) for position, score in
+              enumerate(score_region_fit(length, aspect, region) for length, aspect in zip(lengths, aspects))
+              if score is not None]
+    best = heapq.nsmallest(top_k, scored, key=lambda pair: (-pair[0], pair[1]))
+    return [(position, score) for score, position in best], len(scored)
+
+# 家具目录预编译清单：元数据和图片头信息编译成定长记录+字符串表的二进制文件，worker通过mmap只读加载
+# 由 build_catalog_manifest.py 生成，写临时文件后原子rename替换；记录的源文件签名与当前不一致时回退到JSON
+# 字符串表之后是预先建好的索引（各列、排序后的长宽、风格/类型倒排表，8字节对齐的小端数组），
+# 末尾的JSON目录记录各数组的位置和风格/类型key表，加载时直接映射这些数组，不再逐条扫描记录
+CATALOG_MANIFEST_PATH = os.path.join(app.config['CATALOG_FOLDER'], 'furniture_manifest.bin')
+CATALOG_MANIFEST_MAGIC = b'FCM1'
+CATALOG_MANIFEST_FORMAT_VERSION = 2
+# 文件头: magic, 格式版本, 记录数, 字符串表字节数, 源签名(目录mtime/大小, 元数据mtime/大小), 生成时间, 索引目录的偏移和字节数
+_MANIFEST_HEADER = struct.Struct('<4sHxxII4qdII')
+_MANIFEST_SIGNATURE_OFFSET = struct.calcsize('<4sHxxII')
+# 记录: 6个字符串的 (偏移, 长度)，长/宽/高（NaN表示缺失），图片宽高，是否有透明通道
+_MANIFEST_RECORD = struct.Struct('<12I3d2IB3x')
+_MANIFEST_STRING_FIELDS = ('name', 'display_name', 'style', 'type', 'description', 'image_format')
+
+def read_image_header(path):
+    """只读取图片文件头（不解码像素），返回尺寸、格式和是否带透明通道"""
+    with Image.open(path) as img:
+        return {
+            'width': img.width,
+            'height': img.height,
+            'format': img.format or '',
+            'has_alpha': img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+        }
+
+def _pack_signature(signature):
+    packed = []
+    for part in signature:
+        packed.extend(part if part is not None else (-1, -1))
+    return packed
+
+def stamp_catalog_manifest(manifest_path, signature):
+    """改写清单文件头中的源签名（其余内容不变）"""
+    with open(manifest_path, 'r+b') as f:
+        f.seek(_MANIFEST_SIGNATURE_OFFSET)
+        f.write(struct.pack('<4q', *_pack_signature(signature)))
+
+def _unpack_signature(values):
+    return tuple(None if values[i] == -1 else (values[i], values[i + 1]) for i in (0, 2))
+
+def _numeric_value(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+def _numeric_or_none(value):
+    return _numeric_value(value) or None
+
+def build_catalog_columns(items):
+    """
+    提取建索引用的列：长/宽/高（缺失为 None）、正面宽高比（front_aspect_ratio）和小写的风格、类型
+    
+    返回:
+        dict: {'length': [...], 'width': [...], 'height': [...], 'aspect': [...], 'style_key': [...], 'type_key': [...]}
+    """
+    lengths = [_numeric_or_none(item.get('length')) for item in items]
+    heights = [_numeric_or_none(item.get('height')) for item in items]
+    return {
+        'length': lengths,
+        'width': [_numeric_or_none(item.get('width')) for item in items],
+        'height': heights,
+        'aspect': [front_aspect_ratio(length, height, item.get('image_width'), item.get('image_height'))
+                   for length, height, item in zip(lengths, heights, items)],
+        'style_key': [str(item['style']).lower() if item.get('style') else None for item in items],
+        'type_key': [str(item['type']).lower() if item.get('type') else None for item in items]
+    }
+
+def build_sorted_numeric_index(values):
+    """按数值排序的 (数值, 序号) 数组，供范围查询二分查找；缺失（None）的序号单独存放"""
+    keys = []
+    missing = []
+    for position, value in enumerate(values):
+        if value is not None:
+            keys.append((value, position))
+        else:
+            missing.append(position)
+    keys.sort()
+    return {
+        'values': [value for value, _ in keys],
+        'positions': [position for _, position in keys],
+        'missing': missing
+    }
+
+def build_key_postings(keys):
+    """小写key -> 条目序号列表（升序），key 为 None 的条目不计入"""
+    postings = {}
+    for position, key in enumerate(keys):
+        if key:
+            postings.setdefault(key, []).append(position)
+    return postings
+
+def build_catalog_index(items):
+    """
+    由家具条目生成 FurnitureCatalog 查询用的索引各部分（清单来源时由 CatalogManifest.catalog_index 直接映射得到同样的结构）
+    
+    返回:
+        dict: {'columns', 'style', 'type', 'length', 'width', 'size_bucket', 'arrays'}
+    """
+    columns = build_catalog_columns(items)
+    return {
+        'columns': columns,
+        'style': build_key_postings(columns['style_key']),
+        'type': build_key_postings(columns['type_key']),
+        'length': build_sorted_numeric_index(columns['length']),
+        'width': build_sorted_numeric_index(columns['width']),
+        'size_bucket': [get_size_bucket(length) for length in columns['length']],
+        # 长宽和正面宽高比的 float64 数组（缺失为 NaN），供向量化匹配度评分使用
+        'arrays': {
+            'length': np.array(columns['length'], dtype=np.float64),
+            'width': np.array(columns['width'], dtype=np.float64),
+            'aspect': np.array(columns['aspect'], dtype=np.float64)
+        } if NUMPY_AVAILABLE else None
+    }
+
+def _pack_catalog_index(catalog_index, base_offset):
+    """
+    把 build_catalog_index 的结果打包成8字节对齐的小端数组
+    
+    参数:
+        base_offset: 数组区在清单文件中的起始偏移
+    
+    返回:
+        tuple: (数组区字节, 索引目录dict)
+    """
+    data = bytearray()
+    arrays = {}
+    
+    def add_array(name, typecode, values):
+        data.extend(bytes(-(base_offset + len(data)) % 8))
+        arrays[name] = [base_offset + len(data), len(values), typecode]
+        data.extend(struct.pack(f'<{len(values)}{typecode}', *values))
+    
+    columns = catalog_index['columns']
+    for field in ('length', 'width', 'height', 'aspect'):
+        add_array(field, 'd', [math.nan if value is None else value for value in columns[field]])
+    for field in ('length', 'width'):
+        numeric_index = catalog_index[field]
+        add_array(f'{field}_values', 'd', numeric_index['values'])
+        add_array(f'{field}_positions', 'I', numeric_index['positions'])
+        add_array(f'{field}_missing', 'I', numeric_index['missing'])
+    
+    # 风格/类型：key编号列（0 表示没有该信息）+ 按key顺序拼接的倒排表，key表和各key在倒排表中的范围记在目录中
+    keys = {}
+    for field in ('style', 'type'):
+        postings = catalog_index[field]
+        key_list = sorted(postings)
+        key_ids = {key: number for number, key in enumerate(key_list, 1)}
+        add_array(f'{field}_id', 'I', [key_ids.get(key, 0) for key in columns[f'{field}_key']])
+        ranges = {}
+        flat = []
+        for key in key_list:
+            ranges[key] = [len(flat), len(flat) + len(postings[key])]
+            flat.extend(postings[key])
+        add_array(f'{field}_postings', 'I', flat)
+        keys[field] = {'keys': key_list, 'ranges': ranges}
+    
+    size_keys = [key for key, _, _ in FURNITURE_SIZE_BUCKETS] + [FURNITURE_SIZE_UNKNOWN]
+    size_ids = {key: number for number, key in enumerate(size_keys)}
+    add_array('size_bucket', 'B', [size_ids[key] for key in catalog_index['size_bucket']])
+    
+    directory = {
+        'arrays': arrays,
+        'keys': keys,
+        # 尺寸档位定义变化（代码升级）时清单中的档位编号失效
+        'size_buckets': [list(bucket) for bucket in FURNITURE_SIZE_BUCKETS]
+    }
+    return bytes(data), directory
+
+def write_catalog_manifest(items, image_infos, signature, manifest_path=None):
+    """
+    把家具条目和预先建好的索引编译成二进制清单并原子替换
+    
+    参数:
+        items: build_furniture_item 生成的条目列表
+        image_infos: 与 items 一一对应的 read_image_header 结果（读取失败为 None）
+        signature: 编译时的源文件签名 (目录, 元数据文件)，读取时据此判断清单是否过期
+    
+    返回:
+        int: 写入的字节数
+    """
+    manifest_path = manifest_path or CATALOG_MANIFEST_PATH
+    strings = bytearray()
+    string_refs = {}
+    records = bytearray()
+    
+    def add_string(text):
+        data = (text or '').encode('utf-8')
+        if data not in string_refs:
+            string_refs[data] = len(strings)
+            strings.extend(data)
+        return string_refs[data], len(data)
+    
+    def to_float(value):
+        # 0 原样保存（读出的条目与JSON来源一致），建索引时与缺失同样处理
+        return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else math.nan
+    
+    for item, info in zip(items, image_infos):
+        info = info or {}
+        refs = []
+        for field in _MANIFEST_STRING_FIELDS:
+            refs.extend(add_string(info.get('format') if field == 'image_format' else item.get(field)))
+        records.extend(_MANIFEST_RECORD.pack(
+            *refs,
+            to_float(item.get('length')), to_float(item.get('width')), to_float(item.get('height')),
+            info.get('width') or 0, info.get('height') or 0, 1 if info.get('has_alpha') else 0
+        ))
+    
+    # 索引与加载后解码的条目一致：正面宽高比使用图片头中的像素尺寸
+    indexed_items = [dict(item, image_width=(info or {}).get('width'), image_height=(info or {}).get('height'))
+                     for item, info in zip(items, image_infos)]
+    arrays_offset = _MANIFEST_HEADER.size + len(records) + len(strings)
+    arrays, directory = _pack_catalog_index(build_catalog_index(indexed_items), arrays_offset)
+    directory_bytes = json.dumps(directory, ensure_ascii=False).encode('utf-8')
+    
+    header = _MANIFEST_HEADER.pack(CATALOG_MANIFEST_MAGIC, CATALOG_MANIFEST_FORMAT_VERSION, len(items), len(strings),
+                                   *_pack_signature(signature), time.time(),
+                                   arrays_offset + len(arrays), len(directory_bytes))
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(records)
+        f.write(strings)
+        f.write(arrays)
+        f.write(directory_bytes)
+    os.replace(temp_path, manifest_path)
+    return len(header) + len(records) + len(strings) + len(arrays) + len(directory_bytes)
+
+class _ManifestValues:
+    """清单中的 float64 列（NaN 表示缺失）：按序号取值返回 float 或 None，与JSON来源的列表列行为一致"""
+    
+    def __init__(self, values):
+        self._values = values
+    
+    def __len__(self):
+        return len(self._values)
+    
+    def __getitem__(self, position):
+        value = self._values[position]
+        return None if value != value else value
+    
+    def __iter__(self):
+        return (None if value != value else value for value in self._values)
+
+class _ManifestKeys:
+    """清单中的key编号列：按序号取值返回小写key字符串（编号0为 None）"""
+    
+    def __init__(self, ids, keys):
+        self._ids = ids
+        self._keys = keys
+    
+    def __len__(self):
+        return len(self._ids)
+    
+    def __getitem__(self, position):
+        return self._keys[self._ids[position]]
+    
+    def __iter__(self):
+        return (self._keys[key_id] for key_id in self._ids)
+
+class CatalogManifest:
+    """
+    mmap 只读映射的二进制清单，按序号访问时才解码对应的记录
+    
+    多个worker映射同一个文件时共享操作系统的页缓存；清单被rename替换后，已映射的旧文件在引用释放前仍然有效
+    """
+    
+    def __init__(self, mapped, count, strings_offset, directory):
+        self._mapped = mapped
+        self._count = count
+        self._strings_offset = strings_offset
+        self._directory = directory
+    
+    def __len__(self):
+        return self._count
+    
+    def _string(self, offset, length):
+        start = self._strings_offset + offset
+        return self._mapped[start:start + length].decode('utf-8')
+    
+    def __getitem__(self, position):
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError(position)
+        record = _MANIFEST_RECORD.unpack_from(self._mapped, _MANIFEST_HEADER.size + position * _MANIFEST_RECORD.size)
+        fields = {name: self._string(record[i * 2], record[i * 2 + 1]) for i, name in enumerate(_MANIFEST_STRING_FIELDS)}
+        length, width, height, image_width, image_height, has_alpha = record[12:]
+        metadata = {
+            'display_name': fields['display_name'],
+            'style': fields['style'] or None,
+            'type': fields['type'],
+            'description': fields['description'],
+            'length': None if math.isnan(length) else length,
+            'width': None if math.isnan(width) else width,
+            'height': None if math.isnan(height) else height
+        }
+        image_info = {'width': image_width, 'height': image_height, 'has_alpha': bool(has_alpha)} if image_height else None
+        return build_furniture_item(fields['name'], metadata, image_info)
+    
+    def __iter__(self):
+        for position in range(self._count):
+            yield self[position]
+    
+    def names(self):
+        """按序号返回全部文件名（只解码文件名字符串）"""
+        name_offset = _MANIFEST_STRING_FIELDS.index('name') * 2
+        records = self._mapped[_MANIFEST_HEADER.size:self._strings_offset]
+        return [self._string(record[name_offset], record[name_offset + 1])
+                for record in _MANIFEST_RECORD.iter_unpack(records)]
+    
+    def _array(self, name):
+        """索引数组的只读视图（直接引用映射的页面，不复制）"""
+        offset, count, typecode = self._directory['arrays'][name]
+        return memoryview(self._mapped)[offset:offset + count * struct.calcsize(typecode)].cast(typecode)
+    
+    def catalog_index(self):
+        """
+        直接映射清单中预先建好的索引，返回与 build_catalog_index 相同结构的各部分
+        
+        只按key表构造风格/类型倒排表的字典，耗时与key数量成正比，与条目数无关
+        """
+        keys = self._directory['keys']
+        columns = {field: _ManifestValues(self._array(field)) for field in ('length', 'width', 'height', 'aspect')}
+        postings = {}
+        for field in ('style', 'type'):
+            columns[f'{field}_key'] = _ManifestKeys(self._array(f'{field}_id'), [None] + keys[field]['keys'])
+            flat = self._array(f'{field}_postings')
+            postings[field] = {key: flat[start:end] for key, (start, end) in keys[field]['ranges'].items()}
+        size_keys = [key for key, _, _ in FURNITURE_SIZE_BUCKETS] + [FURNITURE_SIZE_UNKNOWN]
+        
+        arrays = None
+        if NUMPY_AVAILABLE:
+            arrays = {}
+            for field in ('length', 'width', 'aspect'):
+                offset, count, _ = self._directory['arrays'][field]
+                arrays[field] = np.frombuffer(self._mapped, dtype='<f8', count=count, offset=offset)
+        return {
+            'columns': columns,
+            'style': postings['style'],
+            'type': postings['type'],
+            'length': {part: self._array(f'length_{part}') for part in ('values', 'positions', 'missing')},
+            'width': {part: self._array(f'width_{part}') for part in ('values', 'positions', 'missing')},
+            'size_bucket': _ManifestKeys(self._array('size_bucket'), size_keys),
+            'arrays': arrays
+        }
+
+def _check_manifest_directory(directory, count, arrays_end):
+    """检查索引目录与当前代码和文件一致，返回问题描述，没有问题时返回 None"""
+    if sys.byteorder != 'little':
+        return "清单中的索引数组为小端存储，当前平台不支持直接映射"
+    if directory.get('size_buckets') != [list(bucket) for bucket in FURNITURE_SIZE_BUCKETS]:
+        return "尺寸档位定义已变化"
+    for name, (offset, length, typecode) in directory['arrays'].items():
+        if offset % 8 or offset + length * struct.calcsize(typecode) > arrays_end:
+            return f"索引数组 {name} 越界"
+        if name in ('length', 'width', 'height', 'aspect') and length != count:
+            return f"索引数组 {name} 长度不符"
+    return None
+
+def read_catalog_manifest(expected_signature, manifest_path=None):
+    """
+    通过mmap只读映射二进制清单
+    
+    参数:
+        expected_signature: 当前的源文件签名 (目录, 元数据文件)
+    
+    返回:
+        CatalogManifest: 清单；不存在、格式不符或已过期（签名不一致）时返回 None
+    """
+    manifest_path = manifest_path or CATALOG_MANIFEST_PATH
+    try:
+        with open(manifest_path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log_project(f"读取家具目录清单失败，回退到JSON: {str(e)}")
+        return None
+    
+    try:
+        header = _MANIFEST_HEADER.unpack_from(mapped, 0)
+        magic, format_version, count, strings_size = header[:4]
+        directory_offset, directory_size = header[9:11]
+        strings_offset = _MANIFEST_HEADER.size + count * _MANIFEST_RECORD.size
+        if magic != CATALOG_MANIFEST_MAGIC or format_version != CATALOG_MANIFEST_FORMAT_VERSION:
+            log_project(f"家具目录清单格式不符，回退到JSON，请重新运行 build_catalog_manifest.py: {manifest_path}")
+        elif _unpack_signature(header[4:8]) != tuple(expected_signature):
+            log_project("家具目录清单已过期（家具目录或元数据文件已修改），回退到JSON，请重新运行 build_catalog_manifest.py")
+        elif (len(mapped) < directory_offset + directory_size
+              or directory_offset < strings_offset + strings_size):
+            log_project(f"家具目录清单不完整，回退到JSON: {manifest_path}")
+        else:
+            directory = json.loads(mapped[directory_offset:directory_offset + directory_size].decode('utf-8'))
+            problem = _check_manifest_directory(directory, count, directory_offset)
+            if problem is None:
+                return CatalogManifest(mapped, count, strings_offset, directory)
+            log_project(f"家具目录清单索引不可用（{problem}），回退到JSON，请重新运行 build_catalog_manifest.py")
+    except (struct.error, ValueError, KeyError, TypeError) as e:
+        log_project(f"读取家具目录清单失败，回退到JSON: {str(e)}")
+    mapped.close()
+    return None
+
+def get_furniture_source():
+    """
+    当前家具目录的 (源文件签名, 家具条目列表)，签名为 (目录, 元数据文件) 的 (mtime_ns, 大小)
+    
+    先取签名再读取源文件：读取期间源文件被修改时，由此生成的索引会因签名不一致而被视为过期
+    """
+    signature = (_stat_signature(app.config['FURNITURE_FOLDER']), _stat_signature(get_furniture_metadata_path()))
+    return signature, list_furniture_items(force_reload=True)
+
+def build_catalog_manifest(manifest_path=None, workers=8, source=None):
+    """
+    扫描家具目录和元数据文件，读取图片头信息并生成二进制清单（供 build_catalog_manifest.py 调用）
+    
+    参数:
+        source: (源文件签名, 家具条目列表)，为 None 时使用 get_furniture_source()
+    
+    返回:
+        dict: {'items': 条目数, 'bytes': 清单字节数, 'unreadable': 读取图片头失败的文件名列表}
+    """
+    folder = app.config['FURNITURE_FOLDER']
+    signature, items = source or get_furniture_source()
+    
+    def read_header(item):
+        try:
+            return read_image_header(os.path.join(folder, item['name']))
+        except Exception:
+            return None
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        image_infos = list(executor.map(read_header, items))
+    
+    nbytes = write_catalog_manifest(items, image_infos, signature, manifest_path)
+    unreadable = [item['name'] for item, info in zip(items, image_infos) if info is None]
+    log_project(f"家具目录清单已生成: {len(items)} 个家具, {nbytes} 字节, 图片头读取失败 {len(unreadable)} 个")
+    return {'items': len(items), 'bytes': nbytes, 'unreadable': unreadable}
+
+def list_furniture_items(force_reload=False, metadata=None):
+    """
+    扫描家具目录并结合元数据文件生成家具条目列表（按文件名排序），跳过元数据 pending 中尚未提交的文件
+    
+    参数:
+        metadata: 元数据文件的完整内容（批量导入提交前用将要写入的元数据预先生成索引），为 None 时读取元数据文件
+    """
+    folder = app.config['FURNITURE_FOLDER']
+    if metadata is None:
+        furniture_list = load_furniture_metadata(force_reload)
+        pending = _FURNITURE_PENDING_CACHE
+    else:
+        furniture_list = metadata.get('furniture', [])
+        pending = frozenset(metadata.get('pending', []))
+    metadata_dict = {item['filename']: item for item in furniture_list if item.get('filename')}
+    try:
+        filenames = sorted(name for name in os.listdir(folder)
+                           if name != FURNITURE_METADATA_FILENAME and allowed_file(name) and name not in pending)
+    except OSError:
+        filenames = []
+    return [build_furniture_item(filename, metadata_dict.get(filename, {})) for filename in filenames]
+
+def resolve_size_limits(max_length=None, max_width=None, room_length=None, room_width=None):
+    """尺寸上限取用户上限和房间上限（房间尺寸的 80%）中较小的一个，返回 (长度上限, 宽度上限)，没有上限为 None"""
+    length_high = max_length or None
+    width_high = max_width or None
+    if room_length and room_width:
+        length_high = min(filter(None, (length_high, room_length * FURNITURE_ROOM_FIT_RATIO)))
+        width_high = min(filter(None, (width_high, room_width * FURNITURE_ROOM_FIT_RATIO)))
+    return length_high, width_high
+
+class FurnitureCatalog:
+    """
+    家具目录内存索引
+    
+    - 风格、类型：哈希索引（小写值 -> 条目序号列表）
+    - 长度、宽度：按数值排序的数组，范围查询用二分查找，没有尺寸信息的条目单独存放并始终通过尺寸过滤
+    - 失效：每次查询比较家具目录和元数据文件的mtime，变化时重建整个索引；未变化时查询为 O(log n + k)
+    - 清单来源：上述索引在编译清单时已建好，加载时直接映射清单中的数组（各worker共享页缓存），加载耗时与条目数无关
+    
+    索引构建完成后整体替换，查询线程拿到的始终是一份完整的索引
+    """
+    
+    def __init__(self, folder_getter):
+        self._folder_getter = folder_getter
+        self._index = None
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.build_seconds = 0.0
+        self.queries = 0
+        # 已序列化的查询结果：仅对 _responses_version 对应的目录版本有效
+        self._responses = OrderedDict()
+        self._responses_version = None
+        self._responses_lock = threading.Lock()
+        self.response_hits = 0
+        self.response_misses = 0
+        self.not_modified = 0
+    
+    def _signature(self):
+        """(家具目录, 元数据文件, 预编译清单) 的 (mtime_ns, 大小)"""
+        folder = self._folder_getter()
+        return (_stat_signature(folder), _stat_signature(os.path.join(folder, FURNITURE_METADATA_FILENAME)),
+                _stat_signature(CATALOG_MANIFEST_PATH))
+    
+    def _build(self, signature):
+        build_start = time.time()
+        # 优先使用与当前源文件一致的预编译清单：直接映射其中建好的索引，不需要listdir、解析JSON和逐条建索引
+        items = None
+        if signature[2] is not None:
+            items = read_catalog_manifest(signature[:2])
+        if items is not None:
+            source = 'manifest'
+            catalog_index = items.catalog_index()
+        else:
+            source = 'json'
+            items = list_furniture_items()
+            catalog_index = build_catalog_index(items)
+        style_index = catalog_index['style']
+        type_index = catalog_index['type']
+        
+        index = {
+            'signature': signature,
+            # 目录版本：由目录和元数据文件的mtime/大小决定，各worker进程计算结果一致，用作ETag的一部分
+            'version': hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()[:16],
+            'items': items,
+            'count': len(items),
+            **catalog_index,
+            'source': source,
+            'built_at': time.time()
+        }
+        build_seconds = time.time() - build_start
+        self.builds += 1
+        self.build_seconds += build_seconds
+        log_project(f"家具目录索引已重建（来源 {source}）: {len(items)} 个家具, 风格 {len(style_index)} 种, 类型 {len(type_index)} 种, "
+                    f"耗时 {build_seconds * 1000:.1f}ms")
+        return index
+    
+    def get_index(self):
+        """返回当前索引，目录或元数据文件变化时先重建"""
+        signature = self._signature()
+        index = self._index
+        if index is not None and index['signature'] == signature:
+            return index
+        with self._lock:
+            index = self._index
+            if index is None or index['signature'] != signature:
+                index = self._build(signature)
+                self._index = index
+            return index
+    
+    # 查询条件统一表示为 (候选数, 生成候选序号的函数, 检查单个序号的函数)
+    @staticmethod
+    def _key_condition(postings, values, key):
+        """风格/类型条件：候选为哈希索引中的序号列表，逐条检查时比较该列的小写值"""
+        positions = postings.get(key, [])
+        return len(positions), lambda: positions, lambda position: values[position] == key
+    
+    @staticmethod
+    def _range_condition(numeric_index, values, low, high):
+        """尺寸范围条件：数值落在 [low, high] 内或没有该尺寸信息；候选数由二分查找得到，需要时才展开"""
+        sorted_values = numeric_index['values']
+        start = bisect.bisect_left(sorted_values, low) if low is not None else 0
+        end = bisect.bisect_right(sorted_values, high) if high is not None else len(sorted_values)
+        missing = numeric_index['missing']
+        
+        def test(position):
+            value = values[position]
+            return value is None or ((low is None or value >= low) and (high is None or value <= high))
+        return end - start + len(missing), lambda: list(numeric_index['positions'][start:end]) + list(missing), test
+    
+    @staticmethod
+    def _text_condition(index, text):
+        """关键词条件（内存索引下为名称和描述的子串匹配，所有关键词都需命中）；候选数按全部条目计，通常只用于逐条检查"""
+        search_text = index.get('search_text')
+        if search_text is None:
+            # 首次关键词查询时才生成（清单来源时需要解码全部条目）
+            search_text = [' '.join(str(item.get(field) or '') for field in ('name', 'display_name', 'description')).lower()
+                           for item in index['items']]
+            index['search_text'] = search_text
+        terms = text.lower().split()
+        
+        def test(position):
+            haystack = search_text[position]
+            return all(term in haystack for term in terms)
+        return index['count'], lambda: [position for position in range(index['count']) if test(position)], test
+    
+    def _query_positions(self, index, style=None, furniture_type=None, min_length=None, max_length=None,
+                         min_width=None, max_width=None, room_length=None, room_width=None, text=None):
+        """
+        按条件返回命中条目的序号（升序），没有任何条件时返回 None 表示全部条目
+        
+        只展开候选最少的一个条件，其余条件按列逐条检查这些候选（不为宽范围条件生成集合），
+        耗时与最小候选数成正比
+        """
+        length_high, width_high = resolve_size_limits(max_length, max_width, room_length, room_width)
+        columns = index['columns']
+        
+        conditions = []
+        if style:
+            conditions.append(self._key_condition(index['style'], columns['style_key'], style.lower()))
+        if furniture_type:
+            conditions.append(self._key_condition(index['type'], columns['type_key'], furniture_type.lower()))
+        if min_length or length_high:
+            conditions.append(self._range_condition(index['length'], columns['length'], min_length or None, length_high))
+        if min_width or width_high:
+            conditions.append(self._range_condition(index['width'], columns['width'], min_width or None, width_high))
+        if text and text.strip():
+            conditions.append(self._text_condition(index, text))
+        
+        if not conditions:
+            return None
+        
+        conditions.sort(key=lambda condition: condition[0])
+        positions = conditions[0][1]()
+        tests = [condition[2] for condition in conditions[1:]]
+        if tests:
+            positions = [position for position in positions if all(test(position) for test in tests)]
+        return sorted(positions)
+    
+    def query(self, style=None, furniture_type=None, min_length=None, max_length=None,
+              min_width=None, max_width=None, room_length=None, room_width=None, text=None):
+        """
+        按条件查询家具，过滤语义与原 /furniture 接口一致
+        
+        参数:
+            style / furniture_type: 风格、类型（不区分大小写）；没有该信息的家具不返回
+            min_length / max_length / min_width / max_width: 尺寸范围（米），没有尺寸信息的家具保留
+            room_length / room_width: 客厅尺寸，同时提供时家具长宽不得超过其 80%
+            text: 关键词（匹配名称和描述）
+        
+        返回:
+            list: 家具条目（按文件名排序）
+        """
+        index = self.get_index()
+        self.queries += 1
+        positions = self._query_positions(index, style, furniture_type, min_length, max_length,
+                                          min_width, max_width, room_length, room_width, text)
+        items = index['items']
+        if positions is None:
+            return list(items)
+        return [items[position] for position in positions]
+    
+    def facet_query(self, styles=(), furniture_types=(), sizes=(), min_length=None, max_length=None,
+                    min_width=None, max_width=None, room_length=None, room_width=None, sort='name',
+                    offset=0, limit=None, text=None):
+        """
+        分面查询：返回排序后的一页命中条目、命中总数和风格/类型/尺寸档位的分面计数
+        
+        尺寸范围和房间尺寸先走索引得到候选集，然后只遍历一次候选集同时完成分面计数和结果筛选。
+        分面计数采用“析取”语义：某个分面的计数忽略该分面自身的选择、但应用其余所有条件，
+        这样前端勾选一个风格后，其他风格的数量仍然可见
+        
+        参数:
+            styles / furniture_types / sizes: 多选值（风格、类型不区分大小写；尺寸为档位key），空表示不限
+            sort: name / length / -length / width / -width / fit（fit 需要房间尺寸）
+            offset / limit: 分页，limit 为 None 时返回全部
+            text: 关键词（匹配名称和描述）
+        
+        返回:
+            dict: {'items': 当前页条目, 'total': 命中总数, 'facets': {'style': {...}, 'type': {...}, 'size': {...}}}
+        """
+        index = self.get_index()
+        self.queries += 1
+        positions = self._query_positions(index, None, None, min_length, max_length,
+                                          min_width, max_width, room_length, room_width, text)
+        items = index['items']
+        columns = index['columns']
+        style_keys = columns['style_key']
+        type_keys = columns['type_key']
+        size_buckets = index['size_bucket']
+        if positions is None:
+            positions = range(len(items))
+        
+        style_set = {value.lower() for value in styles}
+        type_set = {value.lower() for value in furniture_types}
+        size_set = set(sizes)
+        style_counts = {}
+        type_counts = {}
+        size_counts = {}
+        matched = []
+        for position in positions:
+            style_key = style_keys[position]
+            type_key = type_keys[position]
+            size_key = size_buckets[position]
+            style_ok = not style_set or style_key in style_set
+            type_ok = not type_set or type_key in type_set
+            size_ok = not size_set or size_key in size_set
+            if type_ok and size_ok and style_key:
+                style_counts[style_key] = style_counts.get(style_key, 0) + 1
+            if style_ok and size_ok and type_key:
+                type_counts[type_key] = type_counts.get(type_key, 0) + 1
+            if style_ok and type_ok:
+                size_counts[size_key] = size_counts.get(size_key, 0) + 1
+            if style_ok and type_ok and size_ok:
+                matched.append(position)
+        
+        # 排序只用索引列，最后只解码当前页的条目
+        scores = None
+        if sort == 'fit' and index['arrays'] is not None and matched:
+            selected = np.asarray(matched)
+            fit_scores = score_fit_array(index['arrays']['length'][selected], index['arrays']['width'][selected],
+                                         calculate_sofa_size_range(room_length, room_width))
+            # 按匹配度从高到低，没有尺寸信息（无法评分）的排在最后，同分按文件名
+            order = np.lexsort((selected, -np.nan_to_num(fit_scores), np.isnan(fit_scores)))
+            matched = selected[order].tolist()
+            scores = {position: None if math.isnan(score) else score
+                      for position, score in zip(matched, fit_scores[order].tolist())}
+        elif sort == 'fit':
+            sofa_range = calculate_sofa_size_range(room_length, room_width)
+            lengths = columns['length']
+            widths = columns['width']
+            scores = {position: score_furniture_fit(lengths[position], widths[position], sofa_range) for position in matched}
+            # 没有尺寸信息（无法评分）的排在最后
+            matched.sort(key=lambda position: (scores[position] is None, -(scores[position] or 0.0)))
+        elif sort in ('length', '-length', 'width', '-width'):
+            values = columns[sort.lstrip('-')]
+            known = [position for position in matched if values[position] is not None]
+            known.sort(key=values.__getitem__, reverse=sort.startswith('-'))
+            matched = known + [position for position in matched if values[position] is None]
+        
+        page = matched[offset:offset + limit] if limit is not None else matched[offset:]
+        if scores is not None:
+            page_items = [dict(items[position], fit_score=scores[position]) for position in page]
+        else:
+            page_items = [items[position] for position in page]
+        
+        return {
+            'items': page_items,
+            'total': len(matched),
+            'facets': {
+                'style': style_counts,
+                'type': type_counts,
+                'size': size_counts
+            }
+        }
+    
+    def get_items(self, names):
+        """按文件名取家具条目，保持 names 的顺序，目录中不存在的文件名跳过"""
+        index = self.get_index()
+        name_positions = index.get('name_positions')
+        if name_positions is None:
+            # 首次按名称查询时才生成（清单来源时只解码文件名）
+            items = index['items']
+            names_column = items.names() if isinstance(items, CatalogManifest) else [item['name'] for item in items]
+            name_positions = {name: position for position, name in enumerate(names_column)}
+            index['name_positions'] = name_positions
+        return [index['items'][name_positions[name]] for name in names if name in name_positions]
+    
+    def rank_by_fit(self, room_length, room_width, top_k, style=None, furniture_type=None, text=None):
+        """
+        按房间尺寸对（符合风格/类型/关键词条件的）全部家具评分，返回匹配度最高的 top_k 个
+        
+        不做房间尺寸的硬性过滤：放不下的家具匹配度会降到0，自然排在后面
+        
+        返回:
+            dict: {'items': 带 fit_score 的家具条目（按匹配度从高到低）, 'scored': 参与评分的家具数}
+        """
+        index = self.get_index()
+        self.queries += 1
+        positions = self._query_positions(index, style, furniture_type, text=text)
+        sofa_range = calculate_sofa_size_range(room_length, room_width)
+        
+        if index['arrays'] is not None:
+            lengths = index['arrays']['length']
+            widths = index['arrays']['width']
+            if positions is not None:
+                lengths = lengths[positions]
+                widths = widths[positions]
+        else:
+            lengths = index['columns']['length']
+            widths = index['columns']['width']
+            if positions is not None:
+                lengths = [lengths[position] for position in positions]
+                widths = [widths[position] for position in positions]
+        
+        ranked, scored = rank_top_fits(lengths, widths, sofa_range, top_k)
+        items = index['items']
+        return {
+            'items': [dict(items[positions[i] if positions is not None else i], fit_score=score) for i, score in ranked],
+            'scored': scored
+        }
+    
+    def rank_by_region(self, region, top_k, style=None, furniture_type=None, text=None):
+        """
+        按涂抹区域（外接框宽高比和估算长度）对（符合风格/类型/关键词条件的）全部家具评分，返回最匹配的 top_k 个
+        
+        参数:
+            region: {'length': 估算长度（米，未知时为 None）, 'aspect_ratio': 外接框宽高比}
+        
+        返回:
+            dict: {'items': 带 fit_score 的家具条目（按匹配度从高到低）, 'scored': 参与评分的家具数}
+        """
+        index = self.get_index()
+        self.queries += 1
+        positions = self._query_positions(index, style, furniture_type, text=text)
+        
+        source = index['arrays'] if index['arrays'] is not None else index['columns']
+        lengths = source['length']
+        aspects = source['aspect']
+        if positions is not None:
+            if index['arrays'] is not None:
+                lengths = lengths[positions]
+                aspects = aspects[positions]
+            else:
+                lengths = [lengths[position] for position in positions]
+                aspects = [aspects[position] for position in positions]
+        
+        ranked, scored = rank_top_region_fits(lengths, aspects, region, top_k)
+        items = index['items']
+        return {
+            'items': [dict(items[positions[i] if positions is not None else i], fit_score=score) for i, score in ranked],
+            'scored': scored
+        }
+    
+    def get_cached_response(self, version, query_key):
+        """返回该目录版本下已序列化的查询结果，未缓存时返回 None"""
+        with self._responses_lock:
+            if self._responses_version != version:
+                self._responses.clear()
+                self._responses_version = version
+            body = self._responses.get(query_key)
+            if body is None:
+                self.response_misses += 1
+                return None
+            self._responses.move_to_end(query_key)
+            self.response_hits += 1
+            return body
+    
+    def put_cached_response(self, version, query_key, body):
+        with self._responses_lock:
+            if self._responses_version != version:
+                return
+            self._responses[query_key] = body
+            while len(self._responses) > FURNITURE_RESPONSE_CACHE_ENTRIES:
+                self._responses.popitem(last=False)
+    
+    def snapshot(self):
+        index = self._index
+        return {
+            'items': index['count'] if index else 0,
+            'styles': len(index['style']) if index else 0,
+            'types': len(index['type']) if index else 0,
+            'version': index['version'] if index else None,
+            'source': index['source'] if index else None,
+            'built_at': index['built_at'] if index else None,
+            'builds': self.builds,
+            'build_seconds': round(self.build_seconds, 3),
+            'queries': self.queries,
+            'response_cache_entries': len(self._responses),
+            'response_hits': self.response_hits,
+            'response_misses': self.response_misses,
+            'not_modified': self.not_modified
+        }
+
+_FURNITURE_CATALOG = FurnitureCatalog(lambda: app.config['FURNITURE_FOLDER'])
+
+# SQLite家具目录（CATALOG_BACKEND=sqlite 时启用）：按风格/类型/长宽建索引，名称和描述建FTS5全文索引
+# 长宽索引同时覆盖分面列和名称，分面计数和分页排序只读索引，最后只按id取当前页的整行
+# 数据库由 migrate_catalog_to_sqlite.py 从JSON元数据生成，整体原子替换；数据库不存在时回退到内存索引
+CATALOG_BACKEND = os.getenv('CATALOG_BACKEND', 'memory').lower()
+CATALOG_SQLITE_PATH = os.getenv('CATALOG_SQLITE_PATH', os.path.join(app.config['CATALOG_FOLDER'], 'furniture.db'))
+# 表结构变化时加1，旧版本的数据库视为过期（回退到内存索引，需重新运行 migrate_catalog_to_sqlite.py）
+CATALOG_SQLITE_SCHEMA_VERSION = 2
+# length/width/height 保存元数据中的原值（与JSON来源一致，0 原样保存）；
+# length_key/width_key 是过滤、排序用的尺寸（0 与缺失同样为 NULL，与内存索引一致）
+CATALOG_SQLITE_SCHEMA = """
+CREATE TABLE furniture (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    display_name TEXT NOT NULL,
+    style TEXT,
+    style_key TEXT,
+    type TEXT,
+    type_key TEXT,
+    length REAL,
+    width REAL,
+    height REAL,
+    length_key REAL,
+    width_key REAL,
+    size_bucket TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    image_width INTEGER,
+    image_height INTEGER,
+    has_alpha INTEGER
+);
+CREATE INDEX idx_furniture_style ON furniture(style_key);
+CREATE INDEX idx_furniture_type ON furniture(type_key);
+CREATE INDEX idx_furniture_length ON furniture(length_key, width_key, style_key, type_key, size_bucket, name);
+CREATE INDEX idx_furniture_width ON furniture(width_key, length_key, style_key, type_key, size_bucket, name);
+CREATE INDEX idx_furniture_facets ON furniture(style_key, type_key, size_bucket);
+CREATE VIRTUAL TABLE furniture_fts USING fts5(
+    name, display_name, description,
+    content='furniture', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+CREATE TABLE catalog_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+def build_catalog_sqlite(db_path=None, workers=8, source=None):
+    """
+    扫描家具目录和元数据文件，生成SQLite家具目录（供 migrate_catalog_to_sqlite.py 调用）
+    
+    先写临时数据库，建好索引和全文索引后再原子替换，运行中的服务在下一次查询时切换到新数据库
+    
+    参数:
+        source: (源文件签名, 家具条目列表)，为 None 时使用 get_furniture_source()
+    
+    返回:
+        dict: {'items': 条目数, 'bytes': 数据库字节数, 'unreadable': 读取图片头失败的文件名列表}
+    """
+    db_path = db_path or CATALOG_SQLITE_PATH
+    folder = app.config['FURNITURE_FOLDER']
+    signature, items = source or get_furniture_source()
+    
+    def read_header(item):
+        try:
+            return read_image_header(os.path.join(folder, item['name']))
+        except Exception:
+            return None
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        image_infos = list(executor.map(read_header, items))
+    
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    temp_path = f"{db_path}.{os.getpid()}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    
+    conn = sqlite3.connect(temp_path)
+    try:
+        conn.executescript(CATALOG_SQLITE_SCHEMA)
+        rows = []
+        for item, info in zip(items, image_infos):
+            info = info or {}
+            length = _numeric_or_none(item.get('length'))
+            rows.append((
+                item['name'], item['display_name'], item['style'],
+                str(item['style']).lower() if item['style'] else None,
+                item['type'], str(item['type']).lower() if item['type'] else None,
+                _numeric_value(item.get('length')), _numeric_value(item.get('width')), _numeric_value(item.get('height')),
+                length, _numeric_or_none(item.get('width')),
+                get_size_bucket(length), item.get('description') or '',
+                info.get('width'), info.get('height'),
+                None if not info else int(bool(info.get('has_alpha')))
+            ))
+        conn.executemany(
+            "INSERT INTO furniture (name, display_name, style, style_key, type, type_key, length, width, height, "
+            "length_key, width_key, size_bucket, description, image_width, image_height, has_alpha) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.execute("INSERT INTO furniture_fts(furniture_fts) VALUES ('rebuild')")
+        conn.executemany("INSERT INTO catalog_meta (key, value) VALUES (?, ?)", [
+            ('source_signature', json.dumps(signature)),
+            ('schema_version', str(CATALOG_SQLITE_SCHEMA_VERSION)),
+            ('built_at', str(time.time()))
+        ])
+        conn.commit()
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+    
+    os.replace(temp_path, db_path)
+    nbytes = os.path.getsize(db_path)
+    unreadable = [item['name'] for item, info in zip(items, image_infos) if info is None]
+    log_project(f"SQLite家具目录已生成: {len(items)} 个家具, {nbytes} 字节, 图片头读取失败 {len(unreadable)} 个")
+    return {'items': len(items), 'bytes': nbytes, 'unreadable': unreadable}
+
+def stamp_catalog_sqlite(db_path, signature):
+    """改写SQLite家具目录记录的源签名"""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("UPDATE catalog_meta SET value = ? WHERE key = 'source_signature'", (json.dumps(signature),))
+        conn.commit()
+    finally:
+        conn.close()
+
+def build_fts_query(text):
+    """把用户输入转换成FTS5查询：每个词按前缀匹配，所有词都需命中；引号转义，避免用户输入被解析成FTS语法"""
+    terms = text.split()
+    return ' '.join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+class SqliteFurnitureCatalog(FurnitureCatalog):
+    """
+    SQLite实现的家具目录，查询接口、分面语义和响应缓存与内存索引一致
+    
+    - 每个线程持有一个只读连接，数据库文件被替换（签名变化）后重新连接
+    - 数据库记录生成时的源签名，与当前家具目录、元数据文件不一致时 get_furniture_catalog 回退到内存索引
+    - 分面计数用一次 GROUP BY (风格, 类型, 尺寸档位) 得到各组合的数量，再在内存中按析取语义汇总；
+      没有尺寸/关键词条件时使用加载时预先统计的组合数量
+    
+    限制：带尺寸或关键词条件的分面查询需要扫描全部命中行做 GROUP BY，按匹配度排序（sort=fit）需要为全部命中行
+    计算匹配度，约每1万条命中 10ms（10万条家具的宽范围查询约 100ms），不是亚毫秒级；
+    同一查询的重复请求由响应缓存和ETag承担
+    """
+    
+    def __init__(self, db_path):
+        super().__init__(lambda: app.config['FURNITURE_FOLDER'])
+        self.db_path = db_path
+        self._local = threading.local()
+    
+    def _signature(self):
+        return (_stat_signature(self.db_path),)
+    
+    def _connect(self, signature):
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is None or local.signature != signature:
+            if conn is not None:
+                conn.close()
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA query_only = ON')
+            local.conn = conn
+            local.signature = signature
+        return conn
+    
+    def _build(self, signature):
+        build_start = time.time()
+        conn = self._connect(signature)
+        count = conn.execute("SELECT COUNT(*) FROM furniture").fetchone()[0]
+        styles = dict(conn.execute("SELECT style_key, COUNT(*) FROM furniture WHERE style_key IS NOT NULL GROUP BY style_key").fetchall())
+        types = dict(conn.execute("SELECT type_key, COUNT(*) FROM furniture WHERE type_key IS NOT NULL GROUP BY type_key").fetchall())
+        facet_combos = conn.execute("SELECT style_key, type_key, size_bucket, COUNT(*) FROM furniture "
+                                    "GROUP BY style_key, type_key, size_bucket").fetchall()
+        row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'source_signature'").fetchone()
+        source_signature = tuple(tuple(part) if part else None for part in json.loads(row[0])) if row else None
+        row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'schema_version'").fetchone()
+        index = {
+            'signature': signature,
+            'version': hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()[:16],
+            'count': count,
+            'style': styles,
+            'type': types,
+            # 无过滤条件时各 (风格, 类型, 尺寸档位) 组合的数量
+            'facet_combos': facet_combos,
+            # 生成数据库时的 (家具目录, 元数据文件) 签名
+            'source_signature': source_signature,
+            'schema_version': int(row[0]) if row else 1,
+            'source': 'sqlite',
+            'built_at': time.time()
+        }
+        build_seconds = time.time() - build_start
+        self.builds += 1
+        self.build_seconds += build_seconds
+        log_project(f"SQLite家具目录已加载: {count} 个家具, 风格 {len(styles)} 种, 类型 {len(types)} 种")
+        return index
+    
+    def is_current(self):
+        """
+        数据库记录的源签名与当前家具目录、元数据文件一致（与 read_catalog_manifest 的过期判断相同）
+        且表结构版本为当前版本时返回 True
+        """
+        folder = self._folder_getter()
+        current = (_stat_signature(folder), _stat_signature(os.path.join(folder, FURNITURE_METADATA_FILENAME)))
+        index = self.get_index()
+        return index['schema_version'] == CATALOG_SQLITE_SCHEMA_VERSION and index['source_signature'] == current
+    
+    @staticmethod
+    def _where(style=None, furniture_type=None, min_length=None, max_length=None, min_width=None, max_width=None,
+               room_length=None, room_width=None, text=None):
+        """生成过滤条件；没有尺寸信息的家具始终通过尺寸过滤（与内存索引一致）"""
+        clauses = []
+        params = []
+        length_high, width_high = resolve_size_limits(max_length, max_width, room_length, room_width)
+        if style:
+            clauses.append("style_key = ?")
+            params.append(style.lower())
+        if furniture_type:
+            clauses.append("type_key = ?")
+            params.append(furniture_type.lower())
+        for column, low, high in (('length_key', min_length or None, length_high), ('width_key', min_width or None, width_high)):
+            # 写成单个 BETWEEN：SQLite 才能对 "IS NULL OR 范围" 使用 MULTI-INDEX OR 走长度/宽度索引
+            if low is not None or high is not None:
+                clauses.append(f"({column} IS NULL OR {column} BETWEEN ? AND ?)")
+                params.extend([low if low is not None else -math.inf, high if high is not None else math.inf])
+        if text and text.strip():
+            clauses.append("id IN (SELECT rowid FROM furniture_fts WHERE furniture_fts MATCH ?)")
+            params.append(build_fts_query(text))
+        return clauses, params
+    
+    def _fetch_items(self, conn, row_ids):
+        """按id取整行并保持 row_ids 的顺序"""
+        if not row_ids:
+            return []
+        rows = {row['id']: row for row in conn.execute(
+            f"SELECT * FROM furniture WHERE id IN ({', '.join('?' * len(row_ids))})", row_ids)}
+        return [self._row_to_item(rows[row_id]) for row_id in row_ids]
+    
+    @staticmethod
+    def _row_to_item(row):
+        metadata = {
+            'display_name': row['display_name'],
+            'style': row['style'],
+            'type': row['type'],
+            'description': row['description'],
+            'length': row['length'],
+            'width': row['width'],
+            'height': row['height']
+        }
+        image_info = {'width': row['image_width'], 'height': row['image_height'],
+                      'has_alpha': bool(row['has_alpha'])} if row['image_height'] else None
+        return build_furniture_item(row['name'], metadata, image_info)
+    
+    def query(self, style=None, furniture_type=None, min_length=None, max_length=None,
+              min_width=None, max_width=None, room_length=None, room_width=None, text=None):
+        """参数和返回值同 FurnitureCatalog.query"""
+        index = self.get_index()
+        self.queries += 1
+        clauses, params = self._where(style, furniture_type, min_length, max_length, min_width, max_width,
+                                      room_length, room_width, text)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._connect(index['signature']).execute(f"SELECT * FROM furniture {where} ORDER BY name", params)
+        return [self._row_to_item(row) for row in rows]
+    
+    def facet_query(self, styles=(), furniture_types=(), sizes=(), min_length=None, max_length=None,
+                    min_width=None, max_width=None, room_length=None, room_width=None, sort='name',
+                    offset=0, limit=None, text=None):
+        """参数和返回值同 FurnitureCatalog.facet_query"""
+        index = self.get_index()
+        self.queries += 1
+        conn = self._connect(index['signature'])
+        clauses, params = self._where(None, None, min_length, max_length, min_width, max_width,
+                                      room_length, room_width, text)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        
+        style_set = {value.lower() for value in styles}
+        type_set = {value.lower() for value in furniture_types}
+        size_set = set(sizes)
+        style_counts = {}
+        type_counts = {}
+        size_counts = {}
+        total = 0
+        if clauses:
+            combos = conn.execute(f"SELECT style_key, type_key, size_bucket, COUNT(*) FROM furniture {where} "
+                                  f"GROUP BY style_key, type_key, size_bucket", params)
+        else:
+            combos = index['facet_combos']
+        for style_key, type_key, size_key, count in combos:
+            style_ok = not style_set or style_key in style_set
+            type_ok = not type_set or type_key in type_set
+            size_ok = not size_set or size_key in size_set
+            if type_ok and size_ok and style_key:
+                style_counts[style_key] = style_counts.get(style_key, 0) + count
+            if style_ok and size_ok and type_key:
+                type_counts[type_key] = type_counts.get(type_key, 0) + count
+            if style_ok and type_ok:
+                size_counts[size_key] = size_counts.get(size_key, 0) + count
+            if style_ok and type_ok and size_ok:
+                total += count
+        
+        for column, selected in (('style_key', style_set), ('type_key', type_set), ('size_bucket', size_set)):
+            if selected:
+                clauses.append(f"{column} IN ({', '.join('?' * len(selected))})")
+                params.extend(sorted(selected))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        page_limit = limit if limit is not None else -1
+        
+        if sort == 'fit':
+            sofa_range = calculate_sofa_size_range(room_length, room_width)
+            scored = [(score_furniture_fit(length, width, sofa_range), row_id)
+                      for row_id, length, width in conn.execute(f"SELECT id, length_key, width_key FROM furniture {where} ORDER BY name", params)]
+            scored.sort(key=lambda pair: (pair[0] is None, -(pair[0] or 0.0)))
+            page = scored[offset:offset + limit] if limit is not None else scored[offset:]
+            page_items = [dict(item, fit_score=score)
+                          for item, (score, _) in zip(self._fetch_items(conn, [row_id for _, row_id in page]), page)]
+        else:
+            order = {
+                'name': "name",
+                'length': "length_key IS NULL, length_key, name",
+                '-length': "length_key IS NULL, length_key DESC, name",
+                'width': "width_key IS NULL, width_key, name",
+                '-width': "width_key IS NULL, width_key DESC, name"
+            }[sort]
+            row_ids = [row[0] for row in conn.execute(f"SELECT id FROM furniture {where} ORDER BY {order} LIMIT ? OFFSET ?",
+                                                      params + [page_limit, offset])]
+            page_items = self._fetch_items(conn, row_ids)
+        
+        return {
+            'items': page_items,
+            'total': total,
+            'facets': {
+                'style': style_counts,
+                'type': type_counts,
+                'size': size_counts
+            }
+        }
+
+    def get_items(self, names):
+        """参数和返回值同 FurnitureCatalog.get_items"""
+        index = self.get_index()
+        if not names:
+            return []
+        rows = self._connect(index['signature']).execute(
+            f"SELECT * FROM furniture WHERE name IN ({', '.join('?' * len(names))})", list(names))
+        items = {row['name']: self._row_to_item(row) for row in rows}
+        return [items[name] for name in names if name in items]
+    
+    def rank_by_fit(self, room_length, room_width, top_k, style=None, furniture_type=None, text=None):
+        """参数和返回值同 FurnitureCatalog.rank_by_fit"""
+        index = self.get_index()
+        self.queries += 1
+        conn = self._connect(index['signature'])
+        clauses, params = self._where(style, furniture_type, text=text)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = conn.execute(f"SELECT id, length_key, width_key FROM furniture {where} ORDER BY name", params).fetchall()
+        row_ids = [row[0] for row in rows]
+        lengths = [row[1] for row in rows]
+        widths = [row[2] for row in rows]
+        
+        ranked, scored = rank_top_fits(lengths, widths, calculate_sofa_size_range(room_length, room_width), top_k)
+        items = self._fetch_items(conn, [row_ids[i] for i, _ in ranked])
+        return {
+            'items': [dict(item, fit_score=score) for item, (_, score) in zip(items, ranked)],
+            'scored': scored
+        }
+    
+    def rank_by_region(self, region, top_k, style=None, furniture_type=None, text=None):
+        """参数和返回值同 FurnitureCatalog.rank_by_region"""
+        index = self.get_index()
+        self.queries += 1
+        conn = self._connect(index['signature'])
+        clauses, params = self._where(style, furniture_type, text=text)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = conn.execute(f"SELECT id, length_key, height, image_width, image_height FROM furniture {where} ORDER BY name",
+                            params).fetchall()
+        row_ids = [row[0] for row in rows]
+        lengths = [row[1] for row in rows]
+        aspects = [front_aspect_ratio(row[1], row[2], row[3], row[4]) for row in rows]
+        
+        ranked, scored = rank_top_region_fits(lengths, aspects, region, top_k)
+        items = self._fetch_items(conn, [row_ids[i] for i, _ in ranked])
+        return {
+            'items': [dict(item, fit_score=score) for item, (_, score) in zip(items, ranked)],
+            'scored': scored
+        }
+
+_SQLITE_FURNITURE_CATALOG = SqliteFurnitureCatalog(CATALOG_SQLITE_PATH)
+_CATALOG_FALLBACK_LOGGED = None
+
+def get_furniture_catalog():
+    """按 CATALOG_BACKEND 返回当前使用的家具目录；SQLite数据库不存在或已过期时回退到内存索引"""
+    global _CATALOG_FALLBACK_LOGGED
+    if CATALOG_BACKEND == 'sqlite':
+        if not os.path.exists(CATALOG_SQLITE_PATH):
+            reason = f"SQLite家具目录不存在，回退到内存索引（请运行 migrate_catalog_to_sqlite.py）: {CATALOG_SQLITE_PATH}"
+        elif _SQLITE_FURNITURE_CATALOG.is_current():
+            return _SQLITE_FURNITURE_CATALOG
+        else:
+            reason = "SQLite家具目录已过期（家具目录或元数据文件已修改），回退到内存索引，请重新运行 migrate_catalog_to_sqlite.py"
+        # 同一原因只记录一次
+        if _CATALOG_FALLBACK_LOGGED != reason:
+            _CATALOG_FALLBACK_LOGGED = reason
+            log_project(reason)
+    return _FURNITURE_CATALOG
+
+# 家具视觉相似度索引：由 build_visual_descriptors.py 离线生成（增量更新），存放在 data/catalog
+# 颜色直方图取平方根后按行存成 float32 矩阵（行向量为单位长度，点积即 Bhattacharyya 系数），dHash 存成 uint64 数组
+VISUAL_INDEX_PATH = os.path.join(app.config['CATALOG_FOLDER'], 'visual_index.json')
+# 相似度 = 颜色权重 * 直方图相似度 + (1 - 颜色权重) * (1 - dHash汉明距离/64)
+VISUAL_HIST_WEIGHT = _env_float('VISUAL_HIST_WEIGHT', 0.7)
+VISUAL_SIMILAR_TOP_K_DEFAULT = 12
+VISUAL_SIMILAR_TOP_K_MAX = 100
+
+def _normalize_visual_hist(hist):
+    """像素计数直方图 -> 平方根归一化向量（各档占比的平方根）"""
+    total = float(sum(hist)) or 1.0
+    return [math.sqrt(count / total) for count in hist]
+
+def build_visual_index(workers=None, full=False, index_path=None, items=None):
+    """
+    计算家具图片的视觉描述子并写入视觉索引（供 build_visual_descriptors.py 调用）
+    
+    增量更新：文件名、mtime和大小都未变化的图片直接复用上次的描述子，只为新增或修改过的图片计算；
+    已删除的图片从索引中去掉。矩阵文件带构建编号，索引JSON最后原子替换，读取方不会看到不一致的组合；
+    上一代的矩阵文件保留到下一次构建时才删除，刚读到旧索引JSON、尚未打开矩阵文件的worker不会找不到文件
+    
+    参数:
+        workers: 计算描述子的进程数（默认 CPU 核数）
+        full: 为 True 时忽略已有索引，全部重新计算
+        items: 家具条目列表，为 None 时扫描当前的家具目录
+    
+    返回:
+        dict: {'items', 'computed', 'reused', 'removed', 'failed': 无法读取的文件名列表}
+    """
+    index_path = index_path or VISUAL_INDEX_PATH
+    folder = app.config['FURNITURE_FOLDER']
+    catalog_dir = os.path.dirname(index_path)
+    os.makedirs(catalog_dir, exist_ok=True)
+    
+    previous = {}
+    if not full and os.path.exists(index_path):
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                old_index = json.load(f)
+            old_hist = np.load(os.path.join(catalog_dir, old_index['hist_file']))
+            old_hash = np.load(os.path.join(catalog_dir, old_index['hash_file']))
+            if old_index.get('bins') == image_tasks.VISUAL_HIST_BINS:
+                for row, entry in enumerate(old_index['items']):
+                    previous[entry['name']] = (entry['mtime_ns'], entry['size'], old_hist[row], old_hash[row])
+        except Exception as e:
+            log_project(f"读取已有视觉索引失败，将全部重新计算: {str(e)}")
+            previous = {}
+    
+    entries = []
+    pending = []
+    for item in items if items is not None else list_furniture_items(force_reload=True):
+        signature = _stat_signature(os.path.join(folder, item['name']))
+        if signature is None:
+            continue
+        cached = previous.get(item['name'])
+        if cached is not None and cached[:2] == signature:
+            entries.append({'name': item['name'], 'mtime_ns': signature[0], 'size': signature[1],
+                            'hist': cached[2], 'dhash': int(cached[3])})
+        else:
+            entry = {'name': item['name'], 'mtime_ns': signature[0], 'size': signature[1]}
+            entries.append(entry)
+            pending.append(entry)
+    
+    failed = []
+    if pending:
+        context = multiprocessing.get_context(image_tasks.IMAGE_PROCESS_START_METHOD)
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, mp_context=context) as executor:
+            futures = {executor.submit(image_tasks.compute_visual_descriptor, os.path.join(folder, entry['name'])): entry
+                       for entry in pending}
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    descriptor = future.result()
+                    entry['hist'] = _normalize_visual_hist(descriptor['hist'])
+                    entry['dhash'] = descriptor['dhash']
+                except Exception as e:
+                    log_project(f"计算视觉描述子失败 {entry['name']}: {str(e)}")
+                    failed.append(entry['name'])
+    entries = [entry for entry in entries if 'hist' in entry]
+    
+    build_id = uuid.uuid4().hex[:12]
+    hist_file = f"visual_hist.{build_id}.npy"
+    hash_file = f"visual_hash.{build_id}.npy"
+    hist_matrix = np.array([entry['hist'] for entry in entries], dtype=np.float32).reshape(len(entries), image_tasks.VISUAL_HIST_BINS)
+    hash_array = np.array([entry['dhash'] for entry in entries], dtype=np.uint64)
+    np.save(os.path.join(catalog_dir, hist_file), np.ascontiguousarray(hist_matrix))
+    np.save(os.path.join(catalog_dir, hash_file), hash_array)
+    
+    index_data = {
+        'version': 1,
+        'bins': image_tasks.VISUAL_HIST_BINS,
+        'hist_file': hist_file,
+        'hash_file': hash_file,
+        'built_at': time.time(),
+        'items': [{'name': entry['name'], 'mtime_ns': entry['mtime_ns'], 'size': entry['size']} for entry in entries]
+    }
+    # 替换前记下当前（即将成为上一代）索引引用的矩阵文件，本次构建不删除它们
+    kept_files = {hist_file, hash_file}
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            current_index = json.load(f)
+        kept_files.update((current_index['hist_file'], current_index['hash_file']))
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    
+    temp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(index_data, f, ensure_ascii=False)
+    os.replace(temp_path, index_path)
+    
+    # 清理更早构建的矩阵文件（已映射这些文件的worker在释放前仍可读取）
+    for name in os.listdir(catalog_dir):
+        if name.startswith(('visual_hist.', 'visual_hash.')) and name.endswith('.npy') and name not in kept_files:
+            try:
+                os.remove(os.path.join(catalog_dir, name))
+            except OSError:
+                pass
+    
+    result = {'items': len(entries), 'computed': len(pending) - len(failed), 'reused': len(entries) - len(pending) + len(failed),
+              'removed': len(set(previous) - {entry['name'] for entry in entries}), 'failed': failed}
+    log_project(f"视觉索引已更新: 共 {result['items']} 个, 新计算 {result['computed']} 个, 复用 {result['reused']} 个, "
+                f"移除 {result['removed']} 个, 失败 {len(failed)} 个")
+    return result
+
+class VisualIndex:
+    """
+    家具视觉相似度索引（只读）
+    
+    直方图矩阵通过 np.load(mmap_mode='r') 映射，多个worker共享页缓存；索引JSON的mtime变化时重新加载
+    """
+    
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._state = None
+        self._lock = threading.Lock()
+        self.queries = 0
+    
+    def _load(self, signature):
+        catalog_dir = os.path.dirname(self.index_path)
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            index_data = json.load(f)
+        names = [entry['name'] for entry in index_data['items']]
+        state = {
+            'signature': signature,
+            'names': names,
+            'rows': {name: row for row, name in enumerate(names)},
+            'hist': np.load(os.path.join(catalog_dir, index_data['hist_file']), mmap_mode='r'),
+            'hash': np.load(os.path.join(catalog_dir, index_data['hash_file'])),
+            'built_at': index_data.get('built_at')
+        }
+        log_project(f"视觉索引已加载: {len(names)} 个家具")
+        return state
+    
+    def get_state(self):
+        """返回当前索引，未生成时返回 None"""
+        signature = _stat_signature(self.index_path)
+        if signature is None:
+            return None
+        state = self._state
+        if state is not None and state['signature'] == signature:
+            return state
+        with self._lock:
+            if self._state is None or self._state['signature'] != signature:
+                self._state = self._load(signature)
+            return self._state
+    
+    @staticmethod
+    def _hamming(hashes, value):
+        """每个哈希与 value 的汉明距离"""
+        xor = hashes ^ np.uint64(value)
+        if hasattr(np, 'bitwise_count'):
+            return np.bitwise_count(xor)
+        return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+    
+    def similar(self, name, top_k):
+        """
+        查找与指定家具视觉上最相似的家具
+        
+        返回:
+            list: [(文件名, 相似度), ...] 按相似度从高到低（不含自身）；该家具不在索引中时返回 None
+        """
+        state = self.get_state()
+        if state is None or name not in state['rows']:
+            return None
+        self.queries += 1
+        row = state['rows'][name]
+        hist = state['hist']
+        color_similarity = hist @ np.asarray(hist[row])
+        hash_similarity = 1.0 - self._hamming(state['hash'], state['hash'][row]) / 64.0
+        scores = VISUAL_HIST_WEIGHT * color_similarity.astype(np.float64) + (1.0 - VISUAL_HIST_WEIGHT) * hash_similarity
+        scores[row] = np.nan
+        return [(state['names'][position], round(float(scores[position]), 4)) for position in top_k_positions(scores, top_k)]
+    
+    def snapshot(self):
+        state = self._state
+        return {
+            'items': len(state['names']) if state else 0,
+            'built_at': state['built_at'] if state else None,
+            'queries': self.queries
+        }
+
+_VISUAL_INDEX = VisualIndex(VISUAL_INDEX_PATH)
+
+# 家具预计算抠图：由 build_furniture_mattes.py 离线生成（增量更新），透明背景并裁掉空白边距的RGBA PNG，
+# 附带API用JPEG；家具图片在生成抠图后被修改时自动回退到原图
+MATTE_FOLDER = os.path.join(app.config['CATALOG_FOLDER'], 'mattes')
+MATTE_ENABLED = os.getenv('MATTE_ENABLED', 'true').lower() == 'true'
+
+_CATALOG_WRITE_LOCK = threading.Lock()
+
+@contextmanager
+def catalog_write_lock():
+    """家具库写操作（抠图索引、批量导入）的跨进程互斥锁：data/catalog/.write.lock 上的 fcntl 文件锁（Windows 下为进程内锁）"""
+    if fcntl is None:
+        with _CATALOG_WRITE_LOCK:
+            yield
+        return
+    with open(os.path.join(app.config['CATALOG_FOLDER'], '.write.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def write_matte_index(entries, matte_folder=None):
+    """原子写入抠图索引 mattes.json（entries: 家具文件名 -> 抠图信息）"""
+    index_path = os.path.join(matte_folder or MATTE_FOLDER, image_tasks.MATTE_INDEX_FILENAME)
+    temp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'built_at': time.time(), 'items': entries}, f, ensure_ascii=False)
+    os.replace(temp_path, index_path)
+
+def build_furniture_mattes(workers=None, full=False, matte_folder=None):
+    """
+    为家具图片生成抠图并写入抠图索引（供 build_furniture_mattes.py 调用）
+    
+    增量更新：文件名、mtime和大小都未变化且抠图文件仍在的图片直接复用；已删除的图片连同抠图文件一起移除。
+    抠图在进程池中生成，索引JSON最后原子替换
+    
+    参数:
+        workers: 生成抠图的进程数（默认 CPU 核数）
+        full: 为 True 时忽略已有索引，全部重新生成
+    
+    返回:
+        dict: {'items', 'computed', 'reused', 'removed', 'skipped': 非纯色背景或找不到前景的文件名列表,
+               'failed': 无法读取的文件名列表, 'area_ratio': 抠图面积占原图面积的比例（全部抠图合计）}
+    """
+    with catalog_write_lock():
+        return _build_furniture_mattes(workers, full, matte_folder or MATTE_FOLDER)
+
+def _build_furniture_mattes(workers, full, matte_folder):
+    folder = app.config['FURNITURE_FOLDER']
+    os.makedirs(matte_folder, exist_ok=True)
+    
+    previous = {} if full else image_tasks.load_matte_index(matte_folder)
+    entries = {}
+    pending = []
+    for item in list_furniture_items(force_reload=True):
+        name = item['name']
+        signature = _stat_signature(os.path.join(folder, name))
+        if signature is None:
+            continue
+        cached = previous.get(name)
+        matte_path = os.path.join(matte_folder, image_tasks.get_matte_filename(name))
+        if cached is not None and (cached['mtime_ns'], cached['bytes']) == signature and os.path.exists(matte_path):
+            entries[name] = cached
+        else:
+            pending.append((name, signature, matte_path))
+    
+    skipped, failed = [], []
+    if pending:
+        context = multiprocessing.get_context(image_tasks.IMAGE_PROCESS_START_METHOD)
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, mp_context=context) as executor:
+            futures = {executor.submit(image_tasks.build_furniture_matte, os.path.join(folder, name), matte_path,
+                                       get_api_sidecar_paths(matte_path)[0]): (name, signature, matte_path)
+                       for name, signature, matte_path in pending}
+            for future in as_completed(futures):
+                name, signature, matte_path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    log_project(f"生成抠图失败 {name}: {str(e)}")
+                    failed.append(name)
+                    continue
+                if result is None:
+                    skipped.append(name)
+                    continue
+                write_api_sidecar_meta(matte_path, result.pop('api_image'))
+                entries[name] = dict(result, mtime_ns=signature[0], bytes=signature[1])
+    
+    write_matte_index(entries, matte_folder)
+    
+    # 清理已删除（或不再能抠图）的家具留下的抠图文件
+    keep = {image_tasks.get_matte_filename(name) for name in entries}
+    for filename in os.listdir(matte_folder):
+        if '.matte.png' in filename and filename.split('.matte.png', 1)[0] + '.matte.png' not in keep:
+            try:
+                os.remove(os.path.join(matte_folder, filename))
+            except OSError:
+                pass
+    
+    computed = len(pending) - len(skipped) - len(failed)
+    source_area = sum(entry['source_size'][0] * entry['source_size'][1] for entry in entries.values())
+    matte_area = sum(entry['size'][0] * entry['size'][1] for entry in entries.values())
+    result = {'items': len(entries), 'computed': computed, 'reused': len(entries) - computed,
+              'removed': len(set(previous) - set(entries)), 'skipped': skipped, 'failed': failed,
+              'area_ratio': round(matte_area / float(source_area), 4) if source_area else None}
+    log_project(f"家具抠图已更新: 共 {result['items']} 个, 新生成 {computed} 个, 复用 {result['reused']} 个, "
+                f"移除 {result['removed']} 个, 跳过 {len(skipped)} 个, 失败 {len(failed)} 个, 面积比例 {result['area_ratio']}")
+    return result
+
+def resolve_furniture_image(furniture_path):
+    """
+    发送给服务商的家具图片：有最新的预计算抠图时使用抠图（空白边距已裁掉，铺白底后更小），否则使用原图
+    """
+    if MATTE_ENABLED:
+        matte = image_tasks.find_furniture_matte(furniture_path, MATTE_FOLDER)
+        if matte:
+            return matte['path']
+    return furniture_path
+
+# 家具批量导入：压缩包（zip / tar）中的图片 + CSV或JSON元数据，在 data/catalog/ingest/<任务> 下暂存，
+# 进程池并行校验、规范化并生成派生文件（缩略图、API用JPEG、抠图），全部完成后才在 catalog_write_lock 内替换到家具库
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+INGEST_FOLDER = os.path.join(app.config['CATALOG_FOLDER'], 'ingest')
+FURNITURE_THUMB_FOLDER = os.path.join(app.config['CATALOG_FOLDER'], 'thumbs')
+INGEST_WORKERS = _env_int('INGEST_WORKERS', os.cpu_count() or 1)
+INGEST_MAX_FILES = _env_int('INGEST_MAX_FILES', 20000)
+INGEST_MAX_IMAGE_MB = _env_int('INGEST_MAX_IMAGE_MB', 30)
+# /admin/ingest 的上传大小上限（其他接口仍按 MAX_CONTENT_LENGTH），更大的压缩包请用 ingest_furniture.py 在服务器上导入
+INGEST_MAX_UPLOAD_MB = _env_int('INGEST_MAX_UPLOAD_MB', 1024)
+# 规范化后家具图片的最长边
+INGEST_MAX_DIMENSION = _env_int('INGEST_MAX_DIMENSION', 2048)
+INGEST_TEXT_FIELDS = ('display_name', 'type', 'style', 'description')
+INGEST_SIZE_FIELDS = ('length', 'width', 'height')
+# 家具长/宽/高（米）的合理上限
+INGEST_MAX_SIZE_METERS = 10.0
+INGEST_ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+def get_thumbnail_filename(furniture_filename):
+    """缩略图文件名：{家具文件名}.thumb.jpg"""
+    return f"{furniture_filename}.thumb.jpg"
+
+def normalize_furniture_filename(name):
+    """导入后的家具文件名：安全文件名，PNG/GIF 存为 .png（保留透明通道），JPEG 统一为 .jpg；不是支持的图片时返回 None"""
+    filename = secure_filename(os.path.basename(str(name or '').strip()))
+    if not allowed_file(filename):
+        return None
+    stem, extension = os.path.splitext(filename)
+    return stem + ('.png' if extension.lower() in ('.png', '.gif') else '.jpg')
+
+def parse_ingest_metadata(metadata_path):
+    """
+    读取导入用的元数据（.csv 带表头，或 .json 为列表 / {"furniture": [...]}），字段同 furniture_metadata.json
+    
+    返回:
+        tuple: ({导入后的文件名: 元数据条目}, {文件名: 错误原因})；有错误的条目不导入对应图片
+    """
+    if metadata_path.lower().endswith('.csv'):
+        with open(metadata_path, 'r', encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        rows = data.get('furniture', []) if isinstance(data, dict) else data
+        if not isinstance(rows, list):
+            raise ValueError('JSON元数据应为列表或 {"furniture": [...]}')
+    
+    records, invalid = {}, {}
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        filename = normalize_furniture_filename(row.get('filename'))
+        if not filename:
+            invalid[str(row.get('filename'))] = '缺少filename或不是支持的图片格式'
+            continue
+        record = {'filename': filename}
+        for field in INGEST_TEXT_FIELDS:
+            value = row.get(field)
+            if value not in (None, ''):
+                record[field] = str(value).strip()
+        try:
+            for field in INGEST_SIZE_FIELDS:
+                value = row.get(field)
+                if value in (None, ''):
+                    continue
+                value = float(value)
+                if not 0 < value <= INGEST_MAX_SIZE_METERS:
+                    raise ValueError(f"{field}={value} 超出范围（0~{INGEST_MAX_SIZE_METERS}米）")
+                record[field] = value
+        except ValueError as e:
+            invalid[filename] = f"尺寸无效: {str(e)}"
+            continue
+        records[filename] = record
+    return records, invalid
+
+def _iter_archive_members(archive_path):
+    """遍历 zip / tar 压缩包中的普通文件，产出 (成员名, 大小, 打开函数)"""
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield info.filename, info.file_size, functools.partial(archive.open, info)
+    elif tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path) as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, member.size, functools.partial(archive.extractfile, member)
+    else:
+        raise ValueError('不是有效的zip或tar压缩包')
+
+def extract_ingest_archive(archive_path, target_dir):
+    """
+    把压缩包中的图片和元数据文件解压到 target_dir（只取文件名部分，不会写到目录外）
+    
+    返回:
+        tuple: ([(压缩包中的文件名, 解压路径), ...], 元数据文件路径或 None, [{'file', 'error'}, ...] 跳过的文件)
+    """
+    images, metadata_path, rejected = [], None, []
+    for name, size, open_member in _iter_archive_members(archive_path):
+        basename = os.path.basename(name)
+        if not basename or basename.startswith('.') or '__MACOSX' in name:
+            continue
+        extension = os.path.splitext(basename)[1].lower()
+        if allowed_file(basename):
+            if len(images) >= INGEST_MAX_FILES:
+                raise ValueError(f"图片数量超过上限 {INGEST_MAX_FILES}")
+            if size > INGEST_MAX_IMAGE_MB * 1024 * 1024:
+                rejected.append({'file': basename, 'error': f"文件超过 {INGEST_MAX_IMAGE_MB}MB"})
+                continue
+            target_path = os.path.join(target_dir, f"{len(images):06d}_{secure_filename(basename)}")
+            images.append((basename, target_path))
+        elif extension in ('.csv', '.json') and metadata_path is None:
+            target_path = os.path.join(target_dir, f"metadata{extension}")
+            metadata_path = target_path
+        else:
+            rejected.append({'file': basename, 'error': '不支持的文件类型'})
+            continue
+        with open_member() as source, open(target_path, 'wb') as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+    return images, metadata_path, rejected
+
+def _load_raw_furniture_metadata():
+    """读取元数据文件的完整内容（保留 furniture 以外的字段），文件不存在时返回空结构；文件损坏时抛出异常，避免覆盖"""
+    try:
+        with open(get_furniture_metadata_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'furniture': []}
+
+def _write_metadata_temp(metadata, temp_dir):
+    """把元数据写到 temp_dir 下的临时文件（与家具目录在同一文件系统，可原子rename），返回临时文件路径"""
+    temp_path = os.path.join(temp_dir, f"{FURNITURE_METADATA_FILENAME}.{uuid.uuid4().hex[:8]}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    return temp_path
+
+def commit_ingested_furniture(results, records, staged, workers=None, progress=None):
+    """
+    把已处理好的家具图片和派生文件替换到家具库（调用方需持有 catalog_write_lock）
+    
+    整批家具在元数据文件被原子替换的一刻同时生效，读取方看不到只导入了一部分的家具库：
+    1. 元数据文件写入 pending（本批全部文件名），列出家具时跳过这些文件（覆盖的同名家具在提交前暂不列出）
+    2. 移入缩略图、API用JPEG和抠图，写入抠图索引，再逐个rename家具图片到家具目录
+    3. 按提交后的元数据预先生成已存在的派生索引（清单、SQLite写到 .next 文件，源签名暂为空，不会被当作有效索引）
+    4. 原子替换元数据文件（写入新条目、去掉 pending），再取替换后真实的源签名（目录和元数据文件），
+       重新列出家具目录与第3步的条目核对：一致时把签名写入预生成的索引并原子替换上线；
+       不一致（期间有其他进程或手工修改了家具目录）时丢弃预生成的索引并按当前内容重新生成。
+       先取签名再核对，核对之后的修改会使签名不一致，由各索引的签名检查发现（回退到JSON）
+    
+    参数:
+        results: {文件名: image_tasks.ingest_furniture_image 的结果}
+        records: {文件名: 元数据条目}
+        staged: 暂存目录 {'furniture', 'thumbs', 'api', 'mattes'}，需与家具目录在同一文件系统
+        workers: 重建视觉索引的进程数
+        progress: 进度回调，第3步后报告 indexed，第4步后报告 committed
+    
+    返回:
+        dict: rebuild_catalog_indexes 的结果
+    """
+    folder = app.config['FURNITURE_FOLDER']
+    metadata_path = get_furniture_metadata_path()
+    for directory in (FURNITURE_THUMB_FOLDER, FURNITURE_API_FOLDER, MATTE_FOLDER):
+        os.makedirs(directory, exist_ok=True)
+    
+    metadata = _load_raw_furniture_metadata()
+    pending = set(metadata.get('pending', []))
+    os.replace(_write_metadata_temp(dict(metadata, pending=sorted(pending | set(results))), staged['furniture']),
+               metadata_path)
+    
+    matte_entries = dict(image_tasks.load_matte_index(MATTE_FOLDER))
+    replaced = [name for name in results if matte_entries.pop(name, None)]
+    if replaced:
+        write_matte_index(matte_entries)
+    for name in results:
+        _, api_meta_path = get_api_sidecar_paths(os.path.join(folder, name))
+        if os.path.exists(api_meta_path):
+            os.remove(api_meta_path)
+        os.replace(os.path.join(staged['thumbs'], get_thumbnail_filename(name)),
+                   os.path.join(FURNITURE_THUMB_FOLDER, get_thumbnail_filename(name)))
+        os.replace(os.path.join(staged['api'], f"{name}.api.jpg"), get_api_sidecar_paths(os.path.join(folder, name))[0])
+    
+    for name, result in results.items():
+        if not result['matte']:
+            continue
+        matte_filename = image_tasks.get_matte_filename(name)
+        matte_path = os.path.join(MATTE_FOLDER, matte_filename)
+        os.replace(os.path.join(staged['mattes'], matte_filename), matte_path)
+        os.replace(os.path.join(staged['mattes'], f"{matte_filename}.api.jpg"), get_api_sidecar_paths(matte_path)[0])
+        write_api_sidecar_meta(matte_path, result['matte'].pop('api_image'))
+        signature = _stat_signature(os.path.join(staged['furniture'], name))
+        matte_entries[name] = dict(result['matte'], mtime_ns=signature[0], bytes=signature[1])
+    write_matte_index(matte_entries)
+    
+    for name, result in results.items():
+        furniture_path = os.path.join(folder, name)
+        os.replace(os.path.join(staged['furniture'], name), furniture_path)
+        write_api_sidecar_meta(furniture_path, result['api_image'])
+    
+    existing = {entry.get('filename'): entry for entry in metadata.get('furniture', [])}
+    for name in results:
+        if name in records or name not in existing:
+            existing[name] = records.get(name, {'filename': name})
+    metadata['furniture'] = list(existing.values())
+    # 之前中断的导入留下的 pending 保持隐藏
+    metadata.pop('pending', None)
+    if pending - set(results):
+        metadata['pending'] = sorted(pending - set(results))
+    
+    temp_path = _write_metadata_temp(metadata, staged['furniture'])
+    items = list_furniture_items(metadata=metadata)
+    prepared, indexes = prepare_catalog_indexes(workers, items)
+    report_progress(progress, 'indexed', indexes=indexes)
+    
+    try:
+        os.replace(temp_path, metadata_path)
+        signature = (_stat_signature(folder), _stat_signature(metadata_path))
+        current = list_furniture_items(force_reload=True) == items
+    except BaseException:
+        discard_catalog_indexes(prepared)
+        raise
+    if current:
+        install_catalog_indexes(prepared, signature)
+    else:
+        log_project("提交期间家具目录或元数据文件被其他方式修改，按当前内容重新生成索引")
+        discard_catalog_indexes(prepared)
+        indexes = rebuild_catalog_indexes(workers)
+    report_progress(progress, 'committed', items=len(results))
+    return indexes
+
+def rebuild_catalog_indexes(workers=None, source=None):
+    """
+    家具库变化后重建已存在的预编译索引（二进制清单、SQLite、视觉索引），返回各索引的条目数
+    
+    参数:
+        source: (源文件签名, 家具条目列表)，为 None 时使用 get_furniture_source()
+    """
+    rebuilt = {}
+    if not any(os.path.exists(path) for path in (CATALOG_MANIFEST_PATH, CATALOG_SQLITE_PATH, VISUAL_INDEX_PATH)):
+        return rebuilt
+    signature, items = source or get_furniture_source()
+    prepared, rebuilt = prepare_catalog_indexes(workers, items)
+    install_catalog_indexes(prepared, signature)
+    return rebuilt
+
+# 提交前预生成的索引文件（源签名为空，服务不会使用），提交后写入真实签名再替换上线
+_CATALOG_PENDING_SIGNATURE = (None, None)
+
+def prepare_catalog_indexes(workers, items):
+    """
+    按给定的家具条目生成已存在的预编译索引：清单和SQLite写到 <路径>.next（源签名为空），视觉索引直接更新
+    （视觉索引按单个图片文件的签名增量更新，不依赖目录签名）
+    
+    返回:
+        tuple: ({'manifest': 预生成文件路径, 'sqlite': 预生成文件路径}, {索引名: 条目数})
+    """
+    prepared = {}
+    counts = {}
+    source = (_CATALOG_PENDING_SIGNATURE, items)
+    if os.path.exists(CATALOG_MANIFEST_PATH):
+        prepared['manifest'] = f"{CATALOG_MANIFEST_PATH}.next"
+        counts['manifest'] = build_catalog_manifest(prepared['manifest'], source=source)['items']
+    if os.path.exists(CATALOG_SQLITE_PATH):
+        prepared['sqlite'] = f"{CATALOG_SQLITE_PATH}.next"
+        counts['sqlite'] = build_catalog_sqlite(prepared['sqlite'], source=source)['items']
+    if NUMPY_AVAILABLE and os.path.exists(VISUAL_INDEX_PATH):
+        counts['visual'] = build_visual_index(workers=workers, items=items)['items']
+    return prepared, counts
+
+def install_catalog_indexes(prepared, signature):
+    """把源签名写入 prepare_catalog_indexes 预生成的索引文件，再原子替换正式文件"""
+    if 'manifest' in prepared:
+        stamp_catalog_manifest(prepared['manifest'], signature)
+        os.replace(prepared['manifest'], CATALOG_MANIFEST_PATH)
+    if 'sqlite' in prepared:
+        stamp_catalog_sqlite(prepared['sqlite'], signature)
+        os.replace(prepared['sqlite'], CATALOG_SQLITE_PATH)
+
+def discard_catalog_indexes(prepared):
+    for path in prepared.values():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def ingest_furniture_archive(archive_path, metadata_path=None, replace=False, workers=None, progress=None, job_dir=None):
+    """
+    批量导入家具（供 ingest_furniture.py 和 /admin/ingest 调用）
+    
+    参数:
+        archive_path: 图片压缩包（zip / tar / tar.gz）
+        metadata_path: CSV或JSON元数据；为 None 时使用压缩包中的第一个 .csv / .json 文件
+        replace: 为 True 时覆盖家具库中的同名家具，否则跳过
+        workers: 处理图片的进程数（默认 INGEST_WORKERS）
+        progress: 进度回调 progress(stage, **info)，阶段: extracted, processed, indexed, committed
+        job_dir: 暂存目录（默认在 INGEST_FOLDER 下新建），结束后整个删除
+    
+    返回:
+        dict: {'ingested': 导入的文件名列表, 'rejected': [{'file', 'error'}, ...], 'mattes': 生成抠图的数量,
+               'indexes': rebuild_catalog_indexes 的结果, 'seconds'}
+    """
+    start = time.time()
+    job_dir = job_dir or os.path.join(INGEST_FOLDER, uuid.uuid4().hex[:12])
+    staged = {name: os.path.join(job_dir, name) for name in ('source', 'furniture', 'thumbs', 'api', 'mattes')}
+    for directory in staged.values():
+        os.makedirs(directory, exist_ok=True)
+    
+    try:
+        images, archive_metadata_path, rejected = extract_ingest_archive(archive_path, staged['source'])
+        metadata_path = metadata_path or archive_metadata_path
+        records, invalid = parse_ingest_metadata(metadata_path) if metadata_path else ({}, {})
+        rejected.extend({'file': name, 'error': error} for name, error in invalid.items())
+        report_progress(progress, 'extracted', images=len(images), metadata=len(records))
+        
+        folder = app.config['FURNITURE_FOLDER']
+        pending = {}
+        for original_name, source_path in images:
+            name = normalize_furniture_filename(original_name)
+            if name in invalid:
+                continue
+            if name in pending:
+                rejected.append({'file': original_name, 'error': f"与压缩包中的其他图片重名（{name}）"})
+            elif not replace and os.path.exists(os.path.join(folder, name)):
+                rejected.append({'file': original_name, 'error': f"家具库中已存在 {name}"})
+            else:
+                pending[name] = source_path
+        
+        results = {}
+        if pending:
+            context = multiprocessing.get_context(image_tasks.IMAGE_PROCESS_START_METHOD)
+            with ProcessPoolExecutor(max_workers=workers or INGEST_WORKERS, mp_context=context) as executor:
+                futures = {}
+                for name, source_path in pending.items():
+                    matte_path = os.path.join(staged['mattes'], image_tasks.get_matte_filename(name))
+                    futures[executor.submit(image_tasks.ingest_furniture_image, source_path,
+                                            os.path.join(staged['furniture'], name),
+                                            os.path.join(staged['thumbs'], get_thumbnail_filename(name)),
+                                            os.path.join(staged['api'], f"{name}.api.jpg"),
+                                            matte_path, f"{matte_path}.api.jpg", INGEST_MAX_DIMENSION)] = name
+                for done, future in enumerate(as_completed(futures), 1):
+                    name = futures[future]
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        rejected.append({'file': name, 'error': str(e)})
+                    if done % 100 == 0 or done == len(futures):
+                        report_progress(progress, 'processed', done=done, total=len(futures))
+        
+        indexes = {}
+        if results:
+            with catalog_write_lock():
+                indexes = commit_ingested_furniture(results, records, staged, workers, progress)
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+    
+    report = {
+        'ingested': sorted(results),
+        'rejected': rejected,
+        'mattes': sum(1 for result in results.values() if result['matte']),
+        'indexes': indexes,
+        'seconds': round(time.time() - start, 2)
+    }
+    log_project(f"家具批量导入完成: 导入 {len(results)} 个, 跳过 {len(rejected)} 个, 抠图 {report['mattes']} 个, "
+                f"重建索引 {indexes}, 耗时 {report['seconds']}s")
+    return report
+
+class AppRequest(Request):
+    """/admin/ingest 按 INGEST_MAX_UPLOAD_MB 限制上传大小，其余请求仍按 MAX_CONTENT_LENGTH"""
+    
+    @property
+    def max_content_length(self):
+        if self.path == '/admin/ingest':
+            return INGEST_MAX_UPLOAD_MB * 1024 * 1024
+        return super().max_content_length
+
+app.request_class = AppRequest
+
+def check_admin_token():
+    """校验管理接口令牌（Authorization: Bearer <ADMIN_TOKEN> 或 X-Admin-Token），通过时返回 None，否则返回错误响应"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': '未配置ADMIN_TOKEN，管理接口已禁用'}), 403
+    authorization = request.headers.get('Authorization', '')
+    token = authorization[7:] if authorization.startswith('Bearer ') else request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        return jsonify({'error': '管理令牌无效'}), 401
+    return None
+
+def run_ingest_job(job_id, job_start, job_dir, archive_path, metadata_path, replace):
+    """后台执行一次批量导入，并把各阶段进度写入任务事件文件"""
+    emit = functools.partial(append_job_event, job_id, job_start)
+    try:
+        emit('started')
+        report = ingest_furniture_archive(archive_path, metadata_path, replace=replace, progress=emit, job_dir=job_dir)
+        emit('done', **report)
+    except Exception as e:
+        log_project(f"家具导入任务 {job_id} 异常: {str(e)}")
+        shutil.rmtree(job_dir, ignore_errors=True)
+        try:
+            emit('error', error=f'家具导入失败: {str(e)}')
+        except Exception:
+            pass
+
+@app.route('/admin/ingest', methods=['POST'])
+def create_ingest_job():
+    """
+    批量导入家具：上传 archive（zip / tar / tar.gz 图片压缩包），可选 metadata（CSV或JSON）和 replace=true；
+    创建后台任务并立即返回 job_id，进度通过 /admin/ingest/<job_id> 查看（需管理令牌，公开的事件流接口不返回导入任务）
+    """
+    error = check_admin_token()
+    if error:
+        return error
+    
+    archive = request.files.get('archive')
+    if not archive or not archive.filename.lower().endswith(INGEST_ARCHIVE_EXTENSIONS):
+        return jsonify({'error': f"需要上传压缩包 archive（{' / '.join(INGEST_ARCHIVE_EXTENSIONS)}）"}), 400
+    metadata = request.files.get('metadata')
+    if metadata and metadata.filename and os.path.splitext(metadata.filename)[1].lower() not in ('.csv', '.json'):
+        return jsonify({'error': '元数据文件 metadata 需为 .csv 或 .json'}), 400
+    
+    cleanup_job_events()
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(INGEST_FOLDER, job_id[:12])
+    os.makedirs(job_dir, exist_ok=True)
+    archive_path = os.path.join(job_dir, secure_filename(archive.filename) or 'archive.zip')
+    archive.save(archive_path)
+    metadata_path = None
+    if metadata and metadata.filename:
+        metadata_path = os.path.join(job_dir, f"metadata{os.path.splitext(metadata.filename)[1].lower()}")
+        metadata.save(metadata_path)
+    replace = request.form.get('replace', 'false').lower() == 'true'
+    
+    # 导入任务在同一进程内串行执行；多个worker之间由 catalog_write_lock 互斥
+    queue_job(job_id, 'catalog-ingest', 1, run_ingest_job, job_dir, archive_path, metadata_path, replace, kind='ingest')
+    log_project(f"创建家具导入任务 {job_id} - 压缩包: {archive.filename}, 元数据: {metadata_path}, 覆盖: {replace}")
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': f'/admin/ingest/{job_id}'
+    }), 202
+
+@app.route('/admin/ingest/<job_id>')
+def get_ingest_job(job_id):
+    """查询导入任务的全部进度事件，finished 为任务是否已结束（最后一个事件为 done 或 error）"""
+    error = check_admin_token()
+    if error:
+        return error
+    if not all(c in '0123456789abcdef' for c in job_id):
+        return jsonify({'error': '无效的任务ID'}), 400
+    try:
+        with open(get_job_events_path(job_id), 'r', encoding='utf-8') as f:
+            events = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return jsonify({'error': '任务不存在'}), 404
+    if events and events[-1]['stage'] not in JOB_TERMINAL_STAGES:
+        orphaned = mark_job_orphaned(job_id, events[0])
+        if orphaned:
+            events.append(orphaned)
+    return jsonify({
+        'job_id': job_id,
+        'events': events,
+        'finished': bool(events) and events[-1]['stage'] in JOB_TERMINAL_STAGES
+    })
+
+def catalog_json_response(build_payload, fingerprint=None):
+    """
+    带条件请求支持的家具目录JSON响应
+    
+    ETag 由目录版本和规范化后的请求路径+参数计算，判断 If-None-Match 不需要执行查询或序列化；
+    目录未变化时直接返回304，否则优先使用已序列化的缓存结果
+    
+    参数:
+        build_payload: 接收当前家具目录的函数，返回要序列化的响应数据（仅在缓存未命中时调用）；
+            返回 (响应, 状态码) 元组时表示出错，原样返回且不缓存
+        fingerprint: 响应还依赖目录和请求参数以外的输入（mask文件、场景图片）时，这些输入的指纹
+            （如 _stat_signature 组成的元组），计入 ETag 和缓存key；应只用文件状态等廉价信息计算，
+            耗时的处理（mask统计、尺寸识别）放在 build_payload 中，304 和缓存命中时不执行；
+            传入时响应使用 Cache-Control: private
+    
+    返回:
+        Response: 200（JSON）或 304
+    """
+    catalog = get_furniture_catalog()
+    version = catalog.get_index()['version']
+    query_key = request.path + '?' + '&'.join(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)))
+    if fingerprint is not None:
+        query_key += '#' + hashlib.sha1(repr(fingerprint).encode('utf-8')).hexdigest()[:16]
+    etag = f"{version}-{hashlib.sha1(query_key.encode('utf-8')).hexdigest()[:16]}"
+    # 依赖请求方自己的文件（mask、场景图片）的响应只允许浏览器缓存，不允许CDN等共享缓存按URL复用给其他用户
+    visibility = 'private' if fingerprint is not None else 'public'
+    headers = {'Cache-Control': f'{visibility}, max-age={FURNITURE_CACHE_MAX_AGE}'}
+    
+    if request.if_none_match.contains(etag):
+        catalog.not_modified += 1
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+    
+    body = catalog.get_cached_response(version, query_key)
+    if body is None:
+        payload = build_payload(catalog)
+        if isinstance(payload, tuple):
+            return payload
+        body = app.json.dumps(payload)
+        catalog.put_cached_response(version, query_key, body)
+    
+    response = Response(body, mimetype=app.json.mimetype, headers=headers)
+    response.set_etag(etag)
+    return response
+
+@app.route('/furniture')
+def get_furniture_list():
+    """获取家具库列表 - 支持按风格、类型、尺寸和关键词过滤"""
+    try:
+        # 获取查询参数
+        style = request.args.get('style', None)  # 沙发风格
+        furniture_type = request.args.get('type', None)  # 家具类型
+        min_length = request.args.get('min_length', None, type=float)  # 最小长度（米）
+        max_length = request.args.get('max_length', None, type=float)  # 最大长度（米）
+        min_width = request.args.get('min_width', None, type=float)  # 最小宽度（米）
+        max_width = request.args.get('max_width', None, type=float)  # 最大宽度（米）
+        room_length = request.args.get('room_length', None, type=float)  # 客厅长度
+        room_width = request.args.get('room_width', None, type=float)  # 客厅宽度
+        text = request.args.get('q', None)  # 关键词（名称和描述）
+        
+        def build_payload(catalog):
+            furniture_list = catalog.query(
+                style=style, furniture_type=furniture_type,
+                min_length=min_length, max_length=max_length,
+                min_width=min_width, max_width=max_width,
+                room_length=room_length, room_width=room_width,
+                text=text
+            )
+            log_project(f"返回家具列表，共 {len(furniture_list)} 个家具 (风格={style}, 房间尺寸={room_length}x{room_width})")
+            return {'furniture': furniture_list}
+        
+        return catalog_json_response(build_payload)
+        
+    except Exception as e:
+        log_project(f"获取家具列表错误: {str(e)}")
+        return jsonify({'error': '获取家具列表失败'}), 500
+
+def _get_multi_arg(name):
+    """读取多选查询参数，支持重复参数（?style=a&style=b）和逗号分隔（?style=a,b）"""
+    values = []
+    for raw in request.args.getlist(name):
+        values.extend(value.strip() for value in raw.split(',') if value.strip())
+    return values
+
+def _format_facet(counts):
+    return [{'value': value, 'count': count}
+            for value, count in sorted(counts.items(), key=lambda pair: (-pair[1], pair[0]))]
+
+@app.route('/furniture/search')
+def search_furniture():
+    """
+    家具分面查询：分页返回结果，并附带风格、类型、尺寸档位的分面计数
+    
+    查询参数: q（关键词），style / type / size（可多选），min_length / max_length / min_width / max_width，
+    room_length / room_width，sort（name / length / -length / width / -width / fit），page，page_size
+    """
+    try:
+        room_length = request.args.get('room_length', None, type=float)
+        room_width = request.args.get('room_width', None, type=float)
+        sort = request.args.get('sort', 'name')
+        page = max(request.args.get('page', 1, type=int), 1)
+        page_size = request.args.get('page_size', FURNITURE_PAGE_SIZE_DEFAULT, type=int)
+        page_size = min(max(page_size, 1), FURNITURE_PAGE_SIZE_MAX)
+        
+        if sort not in ('name', 'length', '-length', 'width', '-width', 'fit'):
+            return jsonify({'error': f'不支持的排序方式: {sort}'}), 400
+        if sort == 'fit' and not (room_length and room_width):
+            return jsonify({'error': '按匹配度排序需要提供 room_length 和 room_width'}), 400
+        
+        def build_payload(catalog):
+            result = catalog.facet_query(
+                styles=_get_multi_arg('style'),
+                furniture_types=_get_multi_arg('type'),
+                sizes=_get_multi_arg('size'),
+                min_length=request.args.get('min_length', None, type=float),
+                max_length=request.args.get('max_length', None, type=float),
+                min_width=request.args.get('min_width', None, type=float),
+                max_width=request.args.get('max_width', None, type=float),
+                room_length=room_length,
+                room_width=room_width,
+                sort=sort,
+                offset=(page - 1) * page_size,
+                limit=page_size,
+                text=request.args.get('q', None)
+            )
+            
+            total = result['total']
+            size_counts = result['facets']['size']
+            size_facet = [{'value': key, 'min': low, 'max': high, 'count': size_counts.get(key, 0)}
+                          for key, low, high in FURNITURE_SIZE_BUCKETS]
+            size_facet.append({'value': FURNITURE_SIZE_UNKNOWN, 'min': None, 'max': None,
+                               'count': size_counts.get(FURNITURE_SIZE_UNKNOWN, 0)})
+            
+            return {
+                'furniture': result['items'],
+                'total': total,
+                'page': page,
+                'page_size': page_size,
+                'pages': (total + page_size - 1) // page_size,
+                'sort': sort,
+                'facets': {
+                    'style': _format_facet(result['facets']['style']),
+                    'type': _format_facet(result['facets']['type']),
+                    'size': size_facet
+                }
+            }
+        
+        return catalog_json_response(build_payload)
+        
+    except Exception as e:
+        log_project(f"家具分面查询错误: {str(e)}")
+        return jsonify({'error': '家具查询失败'}), 500
+
+@app.route('/furniture/recommend')
+def recommend_furniture():
+    """
+    按房间尺寸推荐家具：对全部家具计算匹配度，返回最合适的 top_k 个
+    
+    查询参数: room_length / room_width（米），或 image（已上传的客厅图片文件名，使用上传时缓存的尺寸识别结果，
+    不调用服务商；尚未识别时返回409）；top_k；style / type / q（可选，先过滤再评分）
+    """
+    try:
+        room_length = request.args.get('room_length', None, type=float)
+        room_width = request.args.get('room_width', None, type=float)
+        image_path = None
+        fingerprint = None
+        
+        if not (room_length and room_width):
+            image = request.args.get('image')
+            if not image:
+                return jsonify({'error': '需要提供 room_length 和 room_width，或已上传的客厅图片 image'}), 400
+            image_path = resolve_scene_image_path(secure_filename(image))
+            if not image_path:
+                return jsonify({'error': '客厅图片不存在'}), 404
+            # 同名图片被重新上传后识别结果可能不同
+            fingerprint = (image_path, _stat_signature(image_path), _stat_signature(get_room_size_cache_path()))
+        
+        top_k = request.args.get('top_k', FURNITURE_RECOMMEND_TOP_K_DEFAULT, type=int)
+        top_k = min(max(top_k, 1), FURNITURE_RECOMMEND_TOP_K_MAX)
+        style = request.args.get('style', None)
+        furniture_type = request.args.get('type', None)
+        text = request.args.get('q', None)
+        
+        def build_payload(catalog):
+            room = {'length': room_length, 'width': room_width, 'source': 'request'}
+            if image_path:
+                # 上传时已识别并写入尺寸识别缓存；GET请求只查缓存，不调用服务商
+                size_result = get_cached_room_size(image_path)
+                if not size_result:
+                    return jsonify({'error': '客厅图片尚未识别尺寸，请提供 room_length 和 room_width'}), 409
+                room = {'length': size_result['length'], 'width': size_result['width'],
+                        'source': 'estimated' if size_result.get('is_estimated') else 'detected'}
+            
+            rank_start = time.time()
+            result = catalog.rank_by_fit(room['length'], room['width'], top_k,
+                                         style=style, furniture_type=furniture_type, text=text)
+            rank_ms = (time.time() - rank_start) * 1000
+            log_project(f"家具推荐: 房间 {room['length']}x{room['width']}（{room['source']}），评分 {result['scored']} 个，"
+                        f"返回 {len(result['items'])} 个，耗时 {rank_ms:.1f}ms（NumPy={'是' if NUMPY_AVAILABLE else '否'}）")
+            return {
+                'room': room,
+                'sofa_range': calculate_sofa_size_range(room['length'], room['width']),
+                'furniture': result['items'],
+                'scored': result['scored'],
+                'top_k': top_k
+            }
+        
+        return catalog_json_response(build_payload, fingerprint)
+        
+    except Exception as e:
+        log_project(f"家具推荐错误: {str(e)}")
+        return jsonify({'error': '家具推荐失败'}), 500
+
+def find_mask_scene_image(mask_filename):
+    """由mask文件名（save_mask_image 命名规则 {原图名}_composite_mask_{时间}.png）查找场景原图路径，找不到时返回 None"""
+    for marker in ('_composite_mask_', '_pure_mask_'):
+        if marker in mask_filename:
+            base_name = mask_filename.split(marker, 1)[0]
+            for extension in sorted(ALLOWED_EXTENSIONS):
+                path = resolve_scene_image_path(f"{base_name}.{extension}")
+                if path:
+                    return path
+    return None
+
+@app.route('/masks/<filename>/furniture')
+def recommend_furniture_for_mask(filename):
+    """
+    按蓝色涂抹区域推荐家具：外接框宽高比与家具正面宽高比（长/高）的匹配度，
+    结合客厅尺寸把外接框宽度换算成米，再与家具长度比较；返回最合适的 top_k 个
+    
+    查询参数: room_length / room_width（米），或 image（场景原图文件名，使用尺寸识别结果），都没有时按mask文件名查找原图；
+    top_k；style / type / q（可选，先过滤再评分）。
+    只使用已缓存的尺寸识别结果（上传和生成时识别），不调用服务商；找不到原图或原图尚未识别时只按宽高比评分
+    """
+    try:
+        filename = secure_filename(filename)
+        mask_path = os.path.join(app.config['MASK_FOLDER'], filename)
+        if not os.path.exists(mask_path):
+            return jsonify({'error': 'mask不存在'}), 404
+        if '_pure_mask_' in filename:
+            pure_mask_path = mask_path
+            composite_path = os.path.join(app.config['MASK_FOLDER'], filename.replace('_pure_mask_', '_composite_mask_', 1))
+        else:
+            pure_mask_path = get_pure_mask_path(mask_path)
+            composite_path = mask_path
+        if not pure_mask_path:
+            return jsonify({'error': '找不到对应的纯mask文件'}), 404
+        
+        room_length = request.args.get('room_length', None, type=float)
+        room_width = request.args.get('room_width', None, type=float)
+        image_path = None
+        if not (room_length and room_width):
+            room_length = room_width = None
+            image = request.args.get('image')
+            if image:
+                image_path = resolve_scene_image_path(secure_filename(image))
+                if not image_path:
+                    return jsonify({'error': '客厅图片不存在'}), 404
+            else:
+                image_path = find_mask_scene_image(filename)
+        top_k = request.args.get('top_k', FURNITURE_RECOMMEND_TOP_K_DEFAULT, type=int)
+        top_k = min(max(top_k, 1), FURNITURE_RECOMMEND_TOP_K_MAX)
+        style = request.args.get('style', None)
+        furniture_type = request.args.get('type', None)
+        text = request.args.get('q', None)
+        # 同名mask或场景图片被重新生成/上传后涂抹区域和识别出的客厅尺寸都会变化；
+        # 尺寸识别缓存文件变化（原图刚完成识别）后不再沿用只按宽高比评分的结果
+        fingerprint = (_stat_signature(pure_mask_path), _stat_signature(composite_path),
+                       image_path, _stat_signature(image_path) if image_path else None,
+                       _stat_signature(get_room_size_cache_path()) if image_path else None)
+        
+        def build_payload(catalog):
+            # mask统计和尺寸缓存查询只在缓存未命中时执行
+            # 叠加mask与场景原图尺寸相同，外接框按原图像素计算宽高比
+            image_size = None
+            if os.path.exists(composite_path):
+                with Image.open(composite_path) as composite_img:
+                    image_size = composite_img.size
+            stats = compute_mask_region_stats(pure_mask_path, image_size)
+            if stats is None:
+                return jsonify({'error': '涂抹区域为空'}), 400
+            
+            room = {'length': room_length, 'width': room_width, 'source': 'request'} if room_length else None
+            size_result = get_cached_room_size(image_path) if image_path else None
+            if size_result:
+                room = {'length': size_result['length'], 'width': size_result['width'],
+                        'source': 'estimated' if size_result.get('is_estimated') else 'detected'}
+            
+            # 近似：照片横向覆盖整个客厅长度，涂抹外接框宽度占整图的比例即家具长度占客厅长度的比例
+            region = {
+                'length': round(stats['bbox_ratio'][0] * room['length'], 3) if room else None,
+                'aspect_ratio': stats['aspect_ratio']
+            }
+            rank_start = time.time()
+            result = catalog.rank_by_region(region, top_k, style=style, furniture_type=furniture_type, text=text)
+            rank_ms = (time.time() - rank_start) * 1000
+            log_project(f"涂抹区域推荐家具: {filename}, 外接框宽高比 {region['aspect_ratio']}, 估算长度 {region['length']}米，"
+                        f"评分 {result['scored']} 个，返回 {len(result['items'])} 个，耗时 {rank_ms:.1f}ms")
+            return {
+                'mask': filename,
+                'region': dict(stats, length=region['length']),
+                'room': room,
+                'furniture': result['items'],
+                'scored': result['scored'],
+                'top_k': top_k
+            }
+        
+        return catalog_json_response(build_payload, fingerprint)
+    
+    except Exception as e:
+        log_project(f"涂抹区域推荐家具错误: {str(e)}")
+        return jsonify({'error': '家具推荐失败'}), 500
+
+@app.route('/furniture/<filename>/similar')
+def similar_furniture(filename):
+    """视觉相似家具：按颜色直方图和感知哈希在视觉索引中查找最相似的 top_k 个"""
+    try:
+        if not NUMPY_AVAILABLE:
+            return jsonify({'error': '相似家具查询需要安装 numpy'}), 503
+        top_k = request.args.get('top_k', VISUAL_SIMILAR_TOP_K_DEFAULT, type=int)
+        top_k = min(max(top_k, 1), VISUAL_SIMILAR_TOP_K_MAX)
+        
+        if _VISUAL_INDEX.get_state() is None:
+            return jsonify({'error': '视觉索引尚未生成，请运行 build_visual_descriptors.py'}), 503
+        query_start = time.time()
+        # 多取一些，去掉已从目录中删除的家具后仍能凑够 top_k
+        matches = _VISUAL_INDEX.similar(filename, top_k * 2)
+        if matches is None:
+            return jsonify({'error': '该家具不在视觉索引中'}), 404
+        
+        scores = dict(matches)
+        items = get_furniture_catalog().get_items([name for name, _ in matches])[:top_k]
+        log_project(f"相似家具查询: {filename}, 返回 {len(items)} 个, 耗时 {(time.time() - query_start) * 1000:.1f}ms")
+        return jsonify({
+            'query': filename,
+            'furniture': [dict(item, similarity=scores[item['name']]) for item in items]
+        })
+        
+    except Exception as e:
+        log_project(f"相似家具查询错误: {str(e)}")
+        return jsonify({'error': '相似家具查询失败'}), 500
+
+@app.route('/furniture/<filename>')
+def serve_furniture(filename):
+    """提供家具图片"""
+    return send_from_directory(app.config['FURNITURE_FOLDER'], filename)
+
+@app.route('/furniture/<filename>/thumbnail')
+def serve_furniture_thumbnail(filename):
+    """提供家具缩略图（批量导入时生成），没有缩略图时返回原图"""
+    thumbnail = get_thumbnail_filename(secure_filename(filename))
+    if os.path.exists(os.path.join(FURNITURE_THUMB_FOLDER, thumbnail)):
+        return send_from_directory(FURNITURE_THUMB_FOLDER, thumbnail)
+    return send_from_directory(app.config['FURNITURE_FOLDER'], filename)
+
+@app.route('/user/<filename>')
+def serve_user_image(filename):
+    """提供用户上传的图片"""
+    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+
+@app.route('/output/<filename>')
+def serve_output_image(filename):
+    """提供生成的图片"""
+    return send_from_directory(app.config['OUTPUT_FOLDER'], filename)
+
+@app.route('/masks/<filename>')
+def serve_mask_image(filename):
+    """提供mask图片"""
+    return send_from_directory(app.config['MASK_FOLDER'], filename)
+
+@app.route('/api/metrics')
+def get_metrics():
+    """运行状态指标：各服务商熔断状态、并发上限、耗时统计和解码图片缓存命中情况（当前worker进程）"""
+    with _PROVIDER_GUARDS_LOCK:
+        guards = dict(_PROVIDER_GUARDS)
+    with _ROUTER_STATS_LOCK:
+        routes = {f"{operation}/{name}": dict(stats) for (operation, name), stats in _ROUTER_STATS.items()}
+    return jsonify({
+        'pid': os.getpid(),
+        'providers': {name: guard.snapshot() for name, guard in guards.items()},
+        'routes': routes,
+        'decoded_image_cache': _DECODED_IMAGE_CACHE.snapshot(),
+        'shared_image_cache': _SHARED_IMAGE_CACHE.snapshot(),
+        'image_process_pool': image_tasks.get_image_process_pool().snapshot(),
+        'payload_builder': get_payload_stats(),
+        'furniture_catalog': get_furniture_catalog().snapshot(),
+        'visual_index': _VISUAL_INDEX.snapshot(),
+        'furniture_mattes': {'enabled': MATTE_ENABLED, 'count': len(image_tasks.load_matte_index(MATTE_FOLDER))}
+    })
+
+@app.route('/save_mask', methods=['POST'])
+def save_mask():
+    """保存用户绘制的mask图片"""
+    try:
+        data = request.get_json()
+        
+        original_image = data.get('original_image', '')
+        mask_data = data.get('mask_data', '')
         
-        # 调用通义千问图像修复API
-        result = call_qwen_inpaint(original_path, mask_path)
+        if not original_image or not mask_data:
+            return jsonify({'error': '缺少必要参数'}), 400
+        
+        # 保存mask图片
+        mask_filename, mask_filepath = save_mask_image(original_image, mask_data)
+        
+        return jsonify({
+            'success': True,
+            'mask_filename': mask_filename,
+            'mask_path': f'/masks/{mask_filename}',
+            'message': 'Mask图片保存成功'
+        })
+        
+    except image_tasks.ImagePoolBusy as e:
+        log_project(f"保存mask图片排队超时: {str(e)}")
+        response = jsonify({'error': f'服务繁忙，请稍后重试: {str(e)}'})
+        response.headers['Retry-After'] = '2'
+        return response, 503
+    except Exception as e:
+        log_project(f"保存mask图片错误: {str(e)}")
+        return jsonify({'error': f'保存失败: {str(e)}'}), 500
+
+@app.route('/api/inpaint', methods=['POST'])
+def inpaint_image():
+    """图像修复接口：使用通义千问qwen-image-edit-plus模型擦除家具"""
+    try:
+        if not (DASHSCOPE_AVAILABLE or DOUBAO_AVAILABLE):
+            return jsonify({'error': 'DashScope和豆包SDK均未安装，图像修复功能不可用'}), 500
+        
+        # 检查是否有文件上传
+        if 'original_image' not in request.files or 'mask_image' not in request.files:
+            return jsonify({'error': '缺少必要参数：需要上传original_image和mask_image'}), 400
+        
+        original_file = request.files['original_image']
+        mask_file = request.files['mask_image']
+        
+        if original_file.filename == '' or mask_file.filename == '':
+            return jsonify({'error': '文件不能为空'}), 400
+        
+        # 保存上传的文件
+        upload_folder = app.config['UPLOAD_FOLDER']
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        
+        original_filename = secure_filename(original_file.filename)
+        original_unique = f"{uuid.uuid4()}_inpaint_original_{timestamp}_{original_filename}"
+        original_path = os.path.join(upload_folder, original_unique)
+        original_file.save(original_path)
+        
+        mask_filename = secure_filename(mask_file.filename)
+        mask_unique = f"{uuid.uuid4()}_inpaint_mask_{timestamp}_{mask_filename}"
+        mask_path = os.path.join(upload_folder, mask_unique)
+        mask_file.save(mask_path)
+        
+        log_project(f"开始图像修复 - 原图: {original_unique}, 蒙版: {mask_unique}")
+        
+        # 调用图像修复API（默认通义千问，按耗时和健康状态路由，超时自动切换到豆包）
+        result = route_provider_call('erase', original_path, mask_path)
         
         if result['success']:
             # 下载并保存生成的图片
             generated_images = result['images']
             saved_images = []
             
-            for i, image_url in enumerate(generated_images):
+            for i, image in enumerate(generated_images):
                 try:
-                    img_response = requests.get(image_url, timeout=30)
-                    if img_response.status_code == 200:
-                        output_filename = f"inpaint_{timestamp}_{i+1}.jpg"
-                        output_filepath = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-                        
-                        with open(output_filepath, 'wb') as f:
-                            f.write(img_response.content)
-                        
-                        saved_images.append({
-                            'filename': output_filename,
-                            'path': f'/output/{output_filename}',
-                            'url': image_url
-                        })
-                        
-                        log_project(f"保存修复图片: {output_filename}")
+                    output_filename = f"inpaint_{timestamp}_{i+1}.jpg"
+                    output_filepath = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+                    save_generated_image(image, output_filepath)
+                    # ROI模式只返回局部区域，整图结果也可能改动了蒙版以外的像素或分辨率不同，都按蒙版贴回原图
+                    paste_back_inpaint_roi(output_filepath, original_path, mask_path,
+                                           result['roi']['box'] if result.get('roi') else None)
+                    
+                    saved_images.append({
+                        'filename': output_filename,
+                        'path': f'/output/{output_filename}',
+                        'url': image if isinstance(image, str) else None
+                    })
+                    
+                    log_project(f"保存修复图片: {output_filename}")
                     
                 except Exception as e:
                     log_project(f"下载修复图片失败: {str(e)}")
@@ -1512,7 +5224,7 @@ def inpaint_image():
                 'message': f'成功生成 {len(saved_images)} 张修复图片'
             })
         else:
-            return jsonify({'error': result['error']}), 500
+            return provider_error_response(result)
             
     except Exception as e:
         error_msg = f"图像修复错误: {str(e)}"
@@ -1521,6 +5233,40 @@ def inpaint_image():
         log_project(f"异常堆栈:\n{traceback.format_exc()}")
         return jsonify({'error': error_msg}), 500
 
+# 擦除家具的prompt - 明确说明要移除涂抹区域的家具，恢复为空的房间背景
+ERASE_PROMPT_TEXT = "Remove the furniture in the white marked areas, restore the empty room background naturally. Keep the room structure unchanged, only remove the furniture objects. Generate a clean, empty living room space with the original room style and lighting."
+
+def parse_qwen_image_response(response):
+    """解析通义千问 MultiModalConversation 的图片生成响应"""
+    if response.status_code == 200:
+        generated_images = []
+        if hasattr(response, 'output') and hasattr(response.output, 'choices'):
+            for choice in response.output.choices:
+                if hasattr(choice, 'message') and hasattr(choice.message, 'content'):
+                    for content_item in choice.message.content:
+                        if isinstance(content_item, dict) and 'image' in content_item:
+                            generated_images.append(content_item['image'])
+        
+        log_project(f"通义千问API调用成功，生成{len(generated_images)}张图片")
+        
+        return {
+            'success': True,
+            'images': generated_images
+        }
+    else:
+        error_msg = f"通义千问API调用失败: status_code={response.status_code}"
+        if hasattr(response, 'code'):
+            error_msg += f", code={response.code}"
+        if hasattr(response, 'message'):
+            error_msg += f", message={response.message}"
+        
+        log_project(error_msg)
+        return {
+            'success': False,
+            'error': error_msg
+        }
+
+@provider_guarded('qwen')
 def call_qwen_inpaint(original_image_path, mask_image_path):
     """调用通义千问qwen-image-edit-plus模型进行图像修复"""
     if not DASHSCOPE_AVAILABLE:
@@ -1530,75 +5276,132 @@ def call_qwen_inpaint(original_image_path, mask_image_path):
     if not api_key:
         raise Exception("未配置DASHSCOPE_API_KEY环境变量")
     
+    temp_files = []
+    roi = None
+    
     try:
-        # 压缩图片（如果需要）
-        original_compressed_path, original_compressed = compress_image_for_api(original_image_path, max_dimension=1024)
-        mask_compressed_path, mask_compressed = compress_image_for_api(mask_image_path, max_dimension=1024)
-        
-        temp_files = []
-        if original_compressed:
-            temp_files.append(original_compressed_path)
-        if mask_compressed:
-            temp_files.append(mask_compressed_path)
+        # ROI模式：只发送蒙版外接框附近的局部区域，服务商按 ≤1024 处理时局部细节保留得更多
+        if QWEN_INPAINT_ROI:
+            roi = prepare_inpaint_roi(original_image_path, mask_image_path, temp_files)
+        source_original_path = roi['original_crop_path'] if roi else original_image_path
+        source_mask_path = roi['mask_crop_path'] if roi else mask_image_path
         
-        # 编码原始图片为Base64
-        original_base64 = encode_file_to_base64(original_compressed_path if original_compressed else original_image_path)
+        def build_mask_payload():
+            # 压缩蒙版（如果需要）
+            mask_compressed_path, mask_compressed = compress_image_for_api(source_mask_path, max_dimension=1024)
+            if mask_compressed:
+                temp_files.append(mask_compressed_path)
+            
+            # 处理蒙版图片，确保是纯黑白格式
+            try:
+                with Image.open(mask_compressed_path) as mask_img:
+                    # 二值化：将非黑色区域（要擦除的区域）设为白色(255)，黑色区域(保留)保持为0
+                    binary_mask_img = binarize_mask(mask_img)
+                    white_count = binary_mask_img.histogram()[255]
+                    black_count = binary_mask_img.width * binary_mask_img.height - white_count
+                    
+                    # 转换为RGB（因为API可能需要RGB格式）
+                    binary_mask_rgb = binary_mask_img.convert('RGB')
+                    
+                    # 保存处理后的蒙版（临时文件）
+                    processed_mask_path = f"{mask_image_path}.{uuid.uuid4().hex[:8]}.processed.png"
+                    binary_mask_rgb.save(processed_mask_path, 'PNG')
+                    temp_files.append(processed_mask_path)
+                    
+                    # 使用处理后的蒙版
+                    mask_path_to_encode = processed_mask_path
+                    
+                    log_project(f"蒙版已处理为纯黑白格式，白色区域={white_count}像素（要擦除），黑色区域={black_count}像素（保留）")
+            except Exception as e:
+                log_project(f"处理蒙版图片失败，使用原始蒙版: {str(e)}")
+                mask_path_to_encode = mask_compressed_path
+            
+            # 编码处理后的蒙版
+            return encode_file_to_base64(mask_path_to_encode)
         
         log_project(f"开始调用通义千问图像修复API")
         
-        # 处理蒙版图片，确保是纯黑白格式
-        try:
-            with Image.open(mask_compressed_path if mask_compressed else mask_image_path) as mask_img:
-                # 转换为RGB模式（去除透明度）
-                if mask_img.mode != 'RGB':
-                    mask_img = mask_img.convert('RGB')
-                
-                # 转换为灰度图
-                mask_gray = mask_img.convert('L')
-                
-                # 二值化：将非黑色区域（要擦除的区域）设为白色(255)，黑色区域(保留)保持为0
-                # 使用PIL的像素操作，避免依赖numpy
-                pixels = list(mask_gray.getdata())
-                binary_pixels = []
-                white_count = 0
-                black_count = 0
-                
-                for pixel in pixels:
-                    # 阈值处理：大于10的像素设为255（白色），其余为0（黑色）
-                    if pixel > 10:
-                        binary_pixels.append(255)  # 白色 = 要擦除
-                        white_count += 1
-                    else:
-                        binary_pixels.append(0)   # 黑色 = 保留
-                        black_count += 1
-                
-                # 创建新的纯黑白蒙版图片
-                binary_mask_img = Image.new('L', mask_gray.size)
-                binary_mask_img.putdata(binary_pixels)
-                
-                # 转换为RGB（因为API可能需要RGB格式）
-                binary_mask_rgb = binary_mask_img.convert('RGB')
-                
-                # 保存处理后的蒙版（临时文件）
-                processed_mask_path = mask_image_path + '.processed.png'
-                binary_mask_rgb.save(processed_mask_path, 'PNG')
-                temp_files.append(processed_mask_path)
-                
-                # 使用处理后的蒙版
-                mask_path_to_encode = processed_mask_path
-                
-                log_project(f"蒙版已处理为纯黑白格式，白色区域={white_count}像素（要擦除），黑色区域={black_count}像素（保留）")
-        except Exception as e:
-            log_project(f"处理蒙版图片失败，使用原始蒙版: {str(e)}")
-            mask_path_to_encode = mask_compressed_path if mask_compressed else mask_image_path
+        # 并发压缩编码原图、处理编码蒙版
+        original_base64, mask_base64 = build_payloads([
+            functools.partial(encode_api_image, source_original_path, temp_files),
+            build_mask_payload
+        ], '通义千问擦除')
+        
+        prompt_text = ERASE_PROMPT_TEXT
+        
+        # 调用API
+        response = MultiModalConversation.call(
+            api_key=api_key,
+            model="qwen-image-edit-plus",
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"image": original_base64},
+                        {"image": mask_base64},
+                        {"text": prompt_text}
+                    ]
+                }
+            ],
+            stream=False,
+            n=1,  # 生成1张图片
+            watermark=False,
+            negative_prompt="low quality, blurry, distorted, unrealistic, furniture visible",
+            prompt_extend=True,
+            request_timeout=get_provider_call_timeout('qwen')
+        )
         
-        # 编码处理后的蒙版
-        mask_base64 = encode_file_to_base64(mask_path_to_encode)
+        # 处理响应
+        result = parse_qwen_image_response(response)
+        if roi and result.get('success'):
+            # 调用方需将结果贴回原图对应区域
+            result['roi'] = {'box': roi['box'], 'image_size': roi['image_size']}
+        return result
+            
+    except Exception as e:
+        error_msg = f"通义千问图像修复异常: {str(e)}"
+        log_project(error_msg)
+        import traceback
+        log_project(f"异常堆栈:\n{traceback.format_exc()}")
+        return {
+            'success': False,
+            'error': error_msg
+        }
+    finally:
+        # 清理临时压缩文件
+        for temp_file in temp_files:
+            try:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                    log_project(f"已清理临时文件: {temp_file}")
+            except Exception as e:
+                log_project(f"清理临时文件失败 {temp_file}: {str(e)}")
+
+@provider_guarded('qwen')
+def call_qwen_image_fusion(mask_image_path, furniture_image_path, prompt_text, seed=None, progress=None):
+    """调用通义千问qwen-image-edit-plus模型进行家具融合（豆包不可用或较慢时的备选）"""
+    if not DASHSCOPE_AVAILABLE:
+        raise Exception("DashScope SDK未安装")
+    
+    api_key = os.getenv("DASHSCOPE_API_KEY")
+    if not api_key:
+        raise Exception("未配置DASHSCOPE_API_KEY环境变量")
+    
+    temp_files = []
+    stage_start = time.time()
+    
+    try:
+        mask_base64, furniture_base64 = build_payloads([
+            functools.partial(encode_api_image, mask_image_path, temp_files),
+            functools.partial(encode_api_image, resolve_furniture_image(furniture_image_path), temp_files)
+        ], '通义千问家具融合')
+        report_progress(progress, 'payload_built', provider='qwen', seconds=round(time.time() - stage_start, 3),
+                        payload_bytes=len(mask_base64) + len(furniture_base64))
         
-        # 构造prompt - 明确说明要移除涂抹区域的家具，恢复为空的房间背景
-        prompt_text = "Remove the furniture in the white marked areas, restore the empty room background naturally. Keep the room structure unchanged, only remove the furniture objects. Generate a clean, empty living room space with the original room style and lighting."
+        log_project(f"开始调用通义千问家具融合API - mask: {mask_image_path}, furniture: {furniture_image_path}")
+        report_progress(progress, 'provider_called', provider='qwen')
+        provider_start = time.time()
         
-        # 调用API
         response = MultiModalConversation.call(
             api_key=api_key,
             model="qwen-image-edit-plus",
@@ -1606,50 +5409,100 @@ def call_qwen_inpaint(original_image_path, mask_image_path):
                 {
                     "role": "user",
                     "content": [
-                        {"image": original_base64},
                         {"image": mask_base64},
+                        {"image": furniture_base64},
                         {"text": prompt_text}
                     ]
                 }
             ],
             stream=False,
-            n=1,  # 生成1张图片
+            n=1,
             watermark=False,
-            negative_prompt="low quality, blurry, distorted, unrealistic, furniture visible",
-            prompt_extend=True
+            negative_prompt="low quality, blurry, distorted, unrealistic, blue marks visible",
+            prompt_extend=True,
+            seed=seed,
+            request_timeout=get_provider_call_timeout('qwen')
         )
         
-        # 处理响应
-        if response.status_code == 200:
-            generated_images = []
-            if hasattr(response, 'output') and hasattr(response.output, 'choices'):
-                for choice in response.output.choices:
-                    if hasattr(choice, 'message') and hasattr(choice.message, 'content'):
-                        for content_item in choice.message.content:
-                            if isinstance(content_item, dict) and 'image' in content_item:
-                                generated_images.append(content_item['image'])
-            
-            log_project(f"通义千问API调用成功，生成{len(generated_images)}张图片")
-            
-            return {
-                'success': True,
-                'images': generated_images
-            }
+        result = parse_qwen_image_response(response)
+        if result['success']:
+            report_progress(progress, 'provider_done', provider='qwen', seconds=round(time.time() - provider_start, 3),
+                            images=len(result['images']))
+        return result
+        
+    except Exception as e:
+        error_msg = f"通义千问家具融合异常: {str(e)}"
+        log_project(error_msg)
+        import traceback
+        log_project(f"异常堆栈:\n{traceback.format_exc()}")
+        return {
+            'success': False,
+            'error': error_msg
+        }
+    finally:
+        for temp_file in temp_files:
+            try:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                    log_project(f"已清理临时文件: {temp_file}")
+            except Exception as e:
+                log_project(f"清理临时文件失败 {temp_file}: {str(e)}")
+
+@provider_guarded('doubao')
+def call_doubao_inpaint(original_image_path, mask_image_path):
+    """调用豆包图片生成API擦除家具（通义千问不可用或较慢时的备选）"""
+    if not DOUBAO_AVAILABLE:
+        raise Exception("豆包SDK未安装")
+    
+    client = get_doubao_client()
+    temp_files = []
+    roi = None
+    
+    try:
+        # ROI模式：只发送蒙版外接框附近的局部区域，并按面积比例请求更小的输出
+        if DOUBAO_INPAINT_ROI:
+            roi = prepare_inpaint_roi(original_image_path, mask_image_path, temp_files)
+        if roi:
+            output_size = '{}x{}'.format(*calculate_roi_output_size(roi['box'], roi['image_size']))
         else:
-            error_msg = f"通义千问API调用失败: status_code={response.status_code}"
-            if hasattr(response, 'code'):
-                error_msg += f", code={response.code}"
-            if hasattr(response, 'message'):
-                error_msg += f", message={response.message}"
-            
-            log_project(error_msg)
+            output_size = DOUBAO_OUTPUT_SIZE
+        original_base64, mask_base64 = build_payloads([
+            functools.partial(encode_api_image, roi['original_crop_path'] if roi else original_image_path, temp_files),
+            functools.partial(encode_api_image, roi['mask_crop_path'] if roi else mask_image_path, temp_files)
+        ], '豆包擦除')
+        
+        log_project(f"开始调用豆包API擦除家具 - 原图: {original_image_path}, 蒙版: {mask_image_path}, 输出尺寸: {output_size}")
+        
+        response = client.images.generate(
+            model="doubao-seedream-4-5-251128",
+            prompt=f"图二是图一的蒙版。{ERASE_PROMPT_TEXT}",
+            image=[original_base64, mask_base64],
+            size=output_size,
+            response_format=get_response_format('doubao'),
+            watermark=False,
+            timeout=get_provider_call_timeout('doubao')
+        )
+        
+        generated_images = extract_doubao_images(response)
+        if not generated_images:
+            log_project("豆包API擦除失败: 返回空数据")
             return {
                 'success': False,
-                'error': error_msg
+                'error': "豆包API返回空数据"
             }
-            
+        
+        log_project(f"豆包API擦除成功，生成{len(generated_images)}张图片")
+        result = {
+            'success': True,
+            'images': generated_images
+        }
+        if roi:
+            # 调用方需将结果贴回原图对应区域
+            result['roi'] = {'box': roi['box'], 'image_size': roi['image_size']}
+        return result
+        
     except Exception as e:
-        error_msg = f"通义千问图像修复异常: {str(e)}"
+        error_msg = f"豆包图像擦除异常: {str(e)}"
         log_project(error_msg)
         import traceback
         log_project(f"异常堆栈:\n{traceback.format_exc()}")
@@ -1658,7 +5511,6 @@ def call_qwen_inpaint(original_image_path, mask_image_path):
             'error': error_msg
         }
     finally:
-        # 清理临时压缩文件
         for temp_file in temp_files:
             try:
                 if os.path.exists(temp_file):
@@ -1667,81 +5519,351 @@ def call_qwen_inpaint(original_image_path, mask_image_path):
             except Exception as e:
                 log_project(f"清理临时文件失败 {temp_file}: {str(e)}")
 
+# 服务商路由表：每种操作可用的后端，列表顺序为没有统计数据时的优先顺序
+# 可通过环境变量 PROVIDER_ROUTE_FUSION / PROVIDER_ROUTE_ERASE（逗号分隔）调整候选及顺序
+PROVIDER_ROUTES = {
+    'fusion': {'doubao': call_doubao_image_fusion, 'qwen': call_qwen_image_fusion},
+    'erase': {'qwen': call_qwen_inpaint, 'doubao': call_doubao_inpaint},
+}
+
+# 主后端超时后启动备用后端的等待时间（秒），以及整个路由调用的总时限（需小于gunicorn超时120秒）
+PROVIDER_FAILOVER_TIMEOUT = _env_float('PROVIDER_FAILOVER_TIMEOUT', 45)
+PROVIDER_ROUTE_TOTAL_TIMEOUT = _env_float('PROVIDER_ROUTE_TOTAL_TIMEOUT', 110)
+# 没有历史数据的后端按此耗时（秒）参与排序
+PROVIDER_ROUTER_PRIOR_LATENCY = _env_float('PROVIDER_ROUTER_PRIOR_LATENCY', 30)
+# 错误率滑动平均达到该值的后端视为不健康
+PROVIDER_ROUTER_MAX_ERROR_RATE = _env_float('PROVIDER_ROUTER_MAX_ERROR_RATE', 0.5)
+
+_ROUTER_STATS = {}
+_ROUTER_STATS_LOCK = threading.Lock()
+_THREAD_POOLS = {}
+_THREAD_POOLS_LOCK = threading.Lock()
+
+def get_thread_pool(name, max_workers):
+    """
+    获取命名线程池（按进程懒加载）
+    
+    gunicorn preload 模式下线程不会随 fork 复制到worker进程，
+    因此按进程号缓存，每个worker首次使用时各自创建
+    """
+    key = (name, os.getpid())
+    with _THREAD_POOLS_LOCK:
+        pool = _THREAD_POOLS.get(key)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+            _THREAD_POOLS[key] = pool
+        return pool
+
+def get_router_executor():
+    """获取路由调用线程池"""
+    return get_thread_pool('provider-call', _env_int('PROVIDER_ROUTER_THREADS', 16))
+
+def is_provider_configured(provider_name):
+    """检查服务商SDK和密钥是否就绪"""
+    if provider_name == 'doubao':
+        return DOUBAO_AVAILABLE and bool(os.getenv("ARK_API_KEY"))
+    if provider_name == 'qwen':
+        return DASHSCOPE_AVAILABLE and bool(os.getenv("DASHSCOPE_API_KEY"))
+    return False
+
+def record_route_outcome(operation, provider_name, latency, success):
+    """更新 (操作, 后端) 的耗时和错误率滑动平均"""
+    with _ROUTER_STATS_LOCK:
+        stats = _ROUTER_STATS.setdefault((operation, provider_name), {
+            'ewma_latency': None, 'ewma_error': 0.0, 'calls': 0
+        })
+        stats['calls'] += 1
+        stats['ewma_latency'] = latency if stats['ewma_latency'] is None else 0.7 * stats['ewma_latency'] + 0.3 * latency
+        stats['ewma_error'] = 0.7 * stats['ewma_error'] + 0.3 * (0.0 if success else 1.0)
+
+def rank_route_candidates(operation):
+    """
+    按预期耗时对某操作的可用后端排序
+    
+    预期耗时 = 平均耗时 / (1 - 错误率)，即考虑失败重试后得到一次成功结果的期望时间；
+    熔断中或未配置的后端不参与路由，错误率达到 PROVIDER_ROUTER_MAX_ERROR_RATE 的后端排在最后
+    
+    返回:
+        list: [{'provider': str, 'score': float, 'healthy': bool, 'ewma_latency': float, 'ewma_error': float}, ...]
+    """
+    routes = PROVIDER_ROUTES.get(operation, {})
+    order = os.getenv(f"PROVIDER_ROUTE_{operation.upper()}")
+    names = [n.strip() for n in order.split(',') if n.strip() in routes] if order else list(routes)
+    
+    candidates = []
+    for index, name in enumerate(names):
+        if not is_provider_configured(name) or not get_provider_guard(name).is_available():
+            continue
+        with _ROUTER_STATS_LOCK:
+            stats = dict(_ROUTER_STATS.get((operation, name), {}))
+        latency = stats.get('ewma_latency') or PROVIDER_ROUTER_PRIOR_LATENCY
+        error = min(stats.get('ewma_error', 0.0), 0.95)
+        # 加上按优先顺序的微小偏移，保证无数据时按配置顺序选择
+        score = latency / (1 - error) + index * 0.001
+        candidates.append({
+            'provider': name,
+            'score': round(score, 3),
+            'healthy': error < PROVIDER_ROUTER_MAX_ERROR_RATE,
+            'ewma_latency': stats.get('ewma_latency'),
+            'ewma_error': round(error, 3)
+        })
+    
+    # 错误率过高的后端即使响应快也排在最后，只作为兜底
+    candidates.sort(key=lambda c: (not c['healthy'], c['score']))
+    return candidates
+
+def log_routing_decision(record):
+    """记录路由决策（JSON Lines，便于离线分析）"""
+    log_file = os.path.join(BASE_DIR, 'project_log', 'provider_routing.jsonl')
+    try:
+        with open(log_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception as e:
+        log_project(f"写入路由日志失败: {str(e)}")
+
+def route_provider_call(operation, *args, hedge=True, **kwargs):
+    """
+    将一次图像任务路由到最快的健康后端，主后端超时或失败时切换到备用后端
+    
+    主后端超过 PROVIDER_FAILOVER_TIMEOUT 秒未返回时，备用后端会并行启动，
+    取先成功的结果；被放弃的调用在后台完成后仍会计入耗时统计，
+    各后端的SDK请求带 get_provider_call_timeout 时限，超时后结束并释放熔断器名额
+    
+    参数:
+        operation: 操作类型（'fusion' 或 'erase'）
+        hedge: 为 False 时不在主后端超时后并行启动备用后端，也不在总时限到达时放弃进行中的调用，
+            任何时刻最多只有一个上游调用（单次调用由SDK时限约束），只在失败后切换到备用后端；
+            用于按上游调用数限流的场景（多候选生成的每用户并发上限）
+        其余参数原样传给后端调用函数
+    
+    返回:
+        dict: 后端调用结果，额外包含 'provider' 字段
+    """
+    candidates = rank_route_candidates(operation)
+    route_start = time.time()
+    record = {
+        'timestamp': datetime.now().isoformat(),
+        'operation': operation,
+        'candidates': candidates,
+        'events': []
+    }
+    
+    if not candidates:
+        record['result'] = 'no_candidate'
+        log_routing_decision(record)
+        log_project(f"【路由】{operation} 没有可用的后端")
+        hints = [get_provider_guard(n).retry_after_hint() for n in PROVIDER_ROUTES.get(operation, {}) if is_provider_configured(n)]
+        hints = [h for h in hints if h]
+        return {
+            'success': False,
+            'error': f'没有可用的图像服务（{operation}），请稍后重试',
+            'retry_after': min(hints) if hints else None
+        }
+    
+    log_project(f"【路由】{operation} 候选后端: {[(c['provider'], c['score']) for c in candidates]}")
+    
+    def timed_call(provider_name):
+        start_time = time.time()
+        try:
+            result = PROVIDER_ROUTES[operation][provider_name](*args, **kwargs)
+        except Exception as e:
+            result = {'success': False, 'error': f'{provider_name} 调用异常: {str(e)}'}
+        latency = time.time() - start_time
+        # 被熔断器直接拒绝的调用没有到达服务商，不计入路由统计
+        if not result.get('reject_reason'):
+            record_route_outcome(operation, provider_name, latency, bool(result.get('success')))
+        return provider_name, latency, result
+    
+    executor = get_router_executor()
+    backups = [c['provider'] for c in candidates[1:]]
+    futures = {executor.submit(timed_call, candidates[0]['provider'])}
+    record['events'].append({'t': 0.0, 'event': 'start', 'provider': candidates[0]['provider']})
+    failures = []
+    
+    while futures:
+        if hedge:
+            remaining = PROVIDER_ROUTE_TOTAL_TIMEOUT - (time.time() - route_start)
+            if remaining <= 0:
+                break
+            wait_timeout = min(PROVIDER_FAILOVER_TIMEOUT, remaining) if backups else remaining
+        else:
+            wait_timeout = None
+        done, futures = wait(futures, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+        
+        if not done:
+            if backups:
+                backup = backups.pop(0)
+                futures.add(executor.submit(timed_call, backup))
+                record['events'].append({'t': round(time.time() - route_start, 3), 'event': 'failover_timeout', 'provider': backup})
+                log_project(f"【路由】{operation} 主后端超过 {PROVIDER_FAILOVER_TIMEOUT:.0f} 秒未返回，启动备用后端 {backup}")
+            continue
+        
+        for future in done:
+            provider_name, latency, result = future.result()
+            record['events'].append({
+                't': round(time.time() - route_start, 3),
+                'event': 'success' if result.get('success') else 'failure',
+                'provider': provider_name,
+                'latency': round(latency, 3)
+            })
+            if result.get('success'):
+                result['provider'] = provider_name
+                record['result'] = provider_name
+                record['total_latency'] = round(time.time() - route_start, 3)
+                log_routing_decision(record)
+                log_project(f"【路由】{operation} 由 {provider_name} 完成，耗时 {latency:.2f} 秒")
+                return result
+            
+            failures.append(result)
+            log_project(f"【路由】{operation} 后端 {provider_name} 失败: {result.get('error')}")
+            if backups:
+                backup = backups.pop(0)
+                futures.add(executor.submit(timed_call, backup))
+                record['events'].append({'t': round(time.time() - route_start, 3), 'event': 'failover_error', 'provider': backup})
+    
+    record['result'] = 'failed'
+    record['total_latency'] = round(time.time() - route_start, 3)
+    log_routing_decision(record)
+    
+    if not failures:
+        return {
+            'success': False,
+            'error': f'图像服务响应超时（{operation}），请稍后重试'
+        }
+    # 所有后端都因熔断/限流被拒绝时，带上最短的重试等待时间
+    retry_hints = [f['retry_after'] for f in failures if f.get('retry_after')]
+    result = dict(failures[-1])
+    if retry_hints and len(retry_hints) == len(failures):
+        result['retry_after'] = min(retry_hints)
+    else:
+        result.pop('retry_after', None)
+    return result
+
+# 家具融合prompt
+FUSION_PROMPT_TEXT = """在图一客厅中我涂成蓝色的部分放置图二中选择的沙发，要求自然的融入到图一中，
+尤其注意:客厅图一我没有涂蓝色的部分不要做任何变动。
+保持沙发的原始外观特征，调整光影和透视以匹配客厅环境。
+生成的图片中我用于标记沙发放置位置的蓝色不要再出现"""
+
+def save_generated_images(images, filename_prefix, timeout=60, progress=None, paste_back=None):
+    """
+    保存服务商返回的全部图片到输出目录
+    
+    参数:
+        images: 服务商结果列表（URL或内联Base64）
+        filename_prefix: 输出文件名前缀，文件名为 {prefix}_{序号}.jpg
+        timeout: 单张图片下载超时（秒）
+        progress: 可选的进度回调，每保存一张图片报告一次 'image_downloaded'
+        paste_back: build_fusion_paste_back 的结果，非空时把每张图片贴回原始场景图
+    
+    返回:
+        list: [{'filename', 'path', 'url'}, ...]，下载失败的图片会被跳过
+    """
+    saved_images = []
+    for i, image in enumerate(images):
+        try:
+            save_start = time.time()
+            output_filename = f"{filename_prefix}_{i+1}.jpg"
+            output_filepath = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+            written = save_generated_image(image, output_filepath, timeout=timeout)
+            if paste_back:
+                paste_back_fusion_result(output_filepath, paste_back)
+                written = os.path.getsize(output_filepath)
+            
+            saved_image = {
+                'filename': output_filename,
+                'path': f'/output/{output_filename}',
+                'url': image if isinstance(image, str) else None
+            }
+            saved_images.append(saved_image)
+            
+            log_project(f"保存生成图片: {output_filename}")
+            report_progress(progress, 'image_downloaded', index=i + 1, filename=output_filename,
+                            path=saved_image['path'], bytes=written, seconds=round(time.time() - save_start, 3))
+            
+        except Exception as e:
+            log_project(f"下载生成图片失败: {str(e)}")
+    return saved_images
+
+def resolve_fusion_inputs(data):
+    """
+    校验家具融合请求参数并解析文件路径
+    
+    返回:
+        tuple: ({'original_image', 'selected_furniture', 'mask_filename', 'mask_path', 'furniture_path',
+                 'scene_path', 'pure_mask_path'}, None)
+               或 (None, 错误信息)
+    """
+    original_image = data.get('original_image', '')
+    selected_furniture = data.get('selected_furniture', '')
+    mask_filename = data.get('mask_filename', '')
+    
+    if not all([original_image, selected_furniture, mask_filename]):
+        return None, '缺少必要参数'
+    
+    mask_path = os.path.join(app.config['MASK_FOLDER'], mask_filename)
+    furniture_path = os.path.join(app.config['FURNITURE_FOLDER'], selected_furniture)
+    
+    if not os.path.exists(mask_path):
+        return None, f'Mask图片不存在: {mask_filename}'
+    if not os.path.exists(furniture_path):
+        return None, f'家具图片不存在: {selected_furniture}'
+    
+    return {
+        'original_image': original_image,
+        'selected_furniture': selected_furniture,
+        'mask_filename': mask_filename,
+        'mask_path': mask_path,
+        'furniture_path': furniture_path,
+        # 叠加mask在涂抹区域外与原图一致，找不到原图时用它作为贴回底图
+        'scene_path': resolve_scene_image_path(original_image) or mask_path,
+        'pure_mask_path': get_pure_mask_path(mask_path)
+    }, None
+
+def write_generation_log(generation_log, name_prefix):
+    """将生成记录写入 project_log 下的JSON文件"""
+    log_file = os.path.join(BASE_DIR, 'project_log', f"{name_prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(log_file, 'w', encoding='utf-8') as f:
+        json.dump(generation_log, f, ensure_ascii=False, indent=2)
+
 @app.route('/generate_v1', methods=['POST'])
 def generate_decoration_v1():
     """v1.0版本：调用豆包图像融合API生成家装效果图"""
     try:
         data = request.get_json()
         
-        # 获取参数
-        original_image = data.get('original_image', '')
-        selected_furniture = data.get('selected_furniture', '')
-        mask_filename = data.get('mask_filename', '')
-        
-        if not all([original_image, selected_furniture, mask_filename]):
-            return jsonify({'error': '缺少必要参数'}), 400
-        
-        # 构建文件路径
-        mask_path = os.path.join(app.config['MASK_FOLDER'], mask_filename)
-        furniture_path = os.path.join(app.config['FURNITURE_FOLDER'], selected_furniture)
-        
-        # 检查文件是否存在
-        if not os.path.exists(mask_path):
-            return jsonify({'error': f'Mask图片不存在: {mask_filename}'}), 400
+        # 获取参数并检查文件是否存在
+        inputs, error = resolve_fusion_inputs(data)
+        if error:
+            return jsonify({'error': error}), 400
         
-        if not os.path.exists(furniture_path):
-            return jsonify({'error': f'家具图片不存在: {selected_furniture}'}), 400
+        original_image = inputs['original_image']
+        selected_furniture = inputs['selected_furniture']
+        mask_filename = inputs['mask_filename']
+        mask_path = inputs['mask_path']
+        furniture_path = inputs['furniture_path']
         
-        # 构造prompt
-        prompt_text = f"""在图一客厅中我涂成蓝色的部分放置图二中选择的沙发，要求自然的融入到图一中，
-        尤其注意:客厅图一我没有涂蓝色的部分不要做任何变动。
-        保持沙发的原始外观特征，调整光影和透视以匹配客厅环境。
-        生成的图片中我用于标记沙发放置位置的蓝色不要再出现"""
+        prompt_text = FUSION_PROMPT_TEXT
         
         log_project(f"开始生成装修效果图 - 原图: {original_image}, 家具: {selected_furniture}, Mask: {mask_filename}")
         log_project(f"Mask图片路径: {mask_path}")
         log_project(f"家具图片路径: {furniture_path}")
         
-        # 验证mask图片是否存在且可读
-        if os.path.exists(mask_path):
-            try:
-                with Image.open(mask_path) as test_img:
-                    log_project(f"Mask图片验证成功 - 尺寸: {test_img.size}, 模式: {test_img.mode}")
-            except Exception as e:
-                log_project(f"Mask图片验证失败: {str(e)}")
+        # 检查 /save_mask 是否已预生成API图片（有则调用服务商前无需再解码mask）
+        _, sidecar_meta = get_api_sidecar(mask_path)
+        if sidecar_meta:
+            log_project(f"Mask已预生成API图片 - 尺寸: {sidecar_meta['width']}x{sidecar_meta['height']}, 大小: {sidecar_meta['bytes']} bytes")
         else:
-            log_project(f"错误: Mask图片不存在: {mask_path}")
+            log_project(f"Mask无可用的预生成API图片，调用时按需压缩: {mask_path}")
         
-        # 调用豆包图像融合API
-        result = call_doubao_image_fusion(mask_path, furniture_path, prompt_text)
+        # 调用图像融合API（默认豆包，按耗时和健康状态路由，超时自动切换到通义千问）
+        result = route_provider_call('fusion', mask_path, furniture_path, prompt_text)
         
         if result['success']:
             # 下载并保存生成的图片
-            generated_images = result['images']
-            saved_images = []
-            
-            for i, image_url in enumerate(generated_images):
-                try:
-                    import requests
-                    img_response = requests.get(image_url)
-                    if img_response.status_code == 200:
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        output_filename = f"generated_v1_{timestamp}_{i+1}.jpg"
-                        output_filepath = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-                        
-                        with open(output_filepath, 'wb') as f:
-                            f.write(img_response.content)
-                        
-                        saved_images.append({
-                            'filename': output_filename,
-                            'path': f'/output/{output_filename}',
-                            'url': image_url
-                        })
-                        
-                        log_project(f"保存生成图片: {output_filename}")
-                    
-                except Exception as e:
-                    log_project(f"下载生成图片失败: {str(e)}")
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            saved_images = save_generated_images(result['images'], f"generated_v1_{timestamp}",
+                                                 paste_back=build_fusion_paste_back(result, inputs))
             
             # 记录生成日志
             generation_log = {
@@ -1755,15 +5877,14 @@ def generate_decoration_v1():
                 "prompt": prompt_text,
                 "result": {
                     "success": result['success'],
+                    "provider": result.get('provider'),
                     "images_count": len(result['images']),
-                    "generated_urls": result['images']
+                    "generated_urls": [describe_generated_image(image) for image in result['images']]
                 },
                 "saved_images": saved_images
             }
             
-            log_file = os.path.join(BASE_DIR, 'project_log', f"generation_v1_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
-            with open(log_file, 'w', encoding='utf-8') as f:
-                json.dump(generation_log, f, ensure_ascii=False, indent=2)
+            write_generation_log(generation_log, "generation_v1")
             
             return jsonify({
                 'success': True,
@@ -1771,19 +5892,449 @@ def generate_decoration_v1():
                 'message': f'成功生成 {len(saved_images)} 张装修效果图'
             })
         else:
-            return jsonify({'error': result['error']}), 500
+            return provider_error_response(result)
             
     except Exception as e:
         error_msg = f"生成装修效果图错误: {str(e)}"
         log_project(error_msg)
         return jsonify({'error': error_msg}), 500
 
+# 多候选并行生成（fan-out）配置
+FANOUT_MAX_VARIANTS = _env_int('FANOUT_MAX_VARIANTS', 6)
+# 每个用户同时进行的上游调用数上限，超出的候选排队等待。
+# 名额（_USER_UPSTREAM_SLOTS）按worker进程统计：gunicorn 有N个worker时，同一用户的请求分到不同worker，实际上限最多为 N 倍
+FANOUT_MAX_CONCURRENT_PER_USER = _env_int('FANOUT_MAX_CONCURRENT_PER_USER', 2)
+# 部署在反向代理（如 Render 的负载均衡）后面时设为代理层数，从 X-Forwarded-For 右侧取代理记录的客户端地址
+TRUSTED_PROXY_COUNT = _env_int('TRUSTED_PROXY_COUNT', 0)
+
+_USER_UPSTREAM_SLOTS = {}
+_USER_UPSTREAM_SLOTS_LOCK = threading.Lock()
+
+def get_request_user_key():
+    """
+    识别请求用户（每用户并发上限用）：按服务端看到的客户端地址，不使用客户端自报的 user_id；
+    X-Forwarded-For 只取受信任代理追加的部分（TRUSTED_PROXY_COUNT），客户端伪造的前缀会被忽略
+    """
+    if TRUSTED_PROXY_COUNT > 0:
+        hops = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+        if len(hops) >= TRUSTED_PROXY_COUNT:
+            return hops[-TRUSTED_PROXY_COUNT]
+    return request.remote_addr or 'anonymous'
+
+def submit_user_upstream_call(user_key, executor, fn, *args):
+    """
+    提交一个上游调用到线程池，每个用户同时执行的调用数不超过 FANOUT_MAX_CONCURRENT_PER_USER
+    
+    名额用尽时调用留在该用户的等待队列中（不占用线程池的线程），前一个调用结束时再提交；
+    返回的 Future 在开始执行前可以取消。fn 内同一时刻只能有一个上游调用（路由调用需 hedge=False），
+    名额才等于上游调用数。名额只在当前worker进程内统计
+    
+    返回:
+        Future: fn(*args) 的结果
+    """
+    outer = Future()
+    with _USER_UPSTREAM_SLOTS_LOCK:
+        entry = _USER_UPSTREAM_SLOTS.setdefault(user_key, {'active': 0, 'waiting': deque()})
+        if entry['active'] >= FANOUT_MAX_CONCURRENT_PER_USER:
+            entry['waiting'].append((outer, fn, args))
+            return outer
+        entry['active'] += 1
+    executor.submit(_run_user_upstream_call, user_key, executor, outer, fn, args)
+    return outer
+
+def _run_user_upstream_call(user_key, executor, outer, fn, args):
+    """执行一个已占用名额的调用，结束后把名额交给该用户等待队列中的下一个调用"""
+    if outer.set_running_or_notify_cancel():
+        try:
+            outer.set_result(fn(*args))
+        except Exception as e:
+            outer.set_exception(e)
+    
+    with _USER_UPSTREAM_SLOTS_LOCK:
+        entry = _USER_UPSTREAM_SLOTS[user_key]
+        if entry['waiting']:
+            next_call = entry['waiting'].popleft()
+        else:
+            entry['active'] -= 1
+            # 用户没有进行中的调用时清理，避免字典随用户数增长
+            if entry['active'] == 0:
+                _USER_UPSTREAM_SLOTS.pop(user_key, None)
+            return
+    executor.submit(_run_user_upstream_call, user_key, executor, next_call[0], next_call[1], next_call[2])
+
+@app.route('/generate_v1/fanout', methods=['POST'])
+def generate_decoration_fanout():
+    """
+    多候选并行生成：一次请求生成K个候选效果图（不同随机种子或不同服务商）
+    
+    响应为 NDJSON 流（每行一个JSON事件），每个候选完成后立即推送，不等待其余候选：
+        {"event": "accepted", ...}                 请求已接受
+        {"event": "result", "variant": i, ...}     某个候选完成，包含已保存的图片
+        {"event": "error", "variant": i, ...}      某个候选失败
+        {"event": "done", ...}                     全部结束
+    
+    请求参数（JSON）:
+        original_image, selected_furniture, mask_filename: 同 /generate_v1
+        variants: 候选数量K（默认3，上限 FANOUT_MAX_VARIANTS）
+        mode: 'seeds'（默认，同一路由不同种子）或 'providers'（轮流使用不同服务商）
+        seed: 起始种子（可选，第i个候选使用 seed+i）
+    
+    每用户并发上限按服务端识别的客户端地址（get_request_user_key），超出上限的候选在用户队列中等待；
+    上限按worker进程统计，多个worker时同一用户的实际上限为 worker数 × FANOUT_MAX_CONCURRENT_PER_USER
+    """
+    data = request.get_json() or {}
+    inputs, error = resolve_fusion_inputs(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    try:
+        variants = max(1, min(int(data.get('variants', 3)), FANOUT_MAX_VARIANTS))
+        base_seed = int(data['seed']) if data.get('seed') is not None else random.randint(0, 2**31 - 1)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'variants 和 seed 必须是整数'}), 400
+    
+    mode = data.get('mode', 'seeds')
+    if mode not in ('seeds', 'providers'):
+        return jsonify({'error': f'不支持的模式: {mode}'}), 400
+    
+    providers = []
+    if mode == 'providers':
+        providers = [c['provider'] for c in rank_route_candidates('fusion')]
+        if not providers:
+            return jsonify({'error': '没有可用的图像服务，请稍后重试'}), 503
+    
+    user_key = get_request_user_key()
+    job_id = uuid.uuid4().hex[:8]
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    mask_path = inputs['mask_path']
+    furniture_path = inputs['furniture_path']
+    
+    log_project(f"开始多候选生成 {job_id} - 用户: {user_key}, 候选数: {variants}, 模式: {mode}, 家具: {inputs['selected_furniture']}")
+    
+    def run_variant(index):
+        seed = (base_seed + index) % (2**31 - 1)
+        started = time.time()
+        if mode == 'providers':
+            provider = providers[index % len(providers)]
+            result = PROVIDER_ROUTES['fusion'][provider](mask_path, furniture_path, FUSION_PROMPT_TEXT, seed=seed)
+            result['provider'] = provider
+        else:
+            # 不并行启动备用后端：每个候选同一时刻只占一个上游调用，用户名额才等于实际的上游调用数
+            result = route_provider_call('fusion', mask_path, furniture_path, FUSION_PROMPT_TEXT, seed=seed, hedge=False)
+        saved_images = []
+        if result['success']:
+            saved_images = save_generated_images(result['images'], f"fanout_{timestamp}_{job_id}_v{index+1}",
+                                                 paste_back=build_fusion_paste_back(result, inputs))
+        return index, seed, result, saved_images, time.time() - started
+    
+    executor = get_thread_pool('fanout-variant', _env_int('FANOUT_THREADS', 16))
+    futures = [submit_user_upstream_call(user_key, executor, run_variant, i) for i in range(variants)]
+    start_time = time.time()
+    
+    def stream_events():
+        variant_logs = []
+        yield json.dumps({'event': 'accepted', 'job_id': job_id, 'variants': variants, 'mode': mode}) + "\n"
+        try:
+            for future in as_completed(futures):
+                try:
+                    index, seed, result, saved_images, latency = future.result()
+                except Exception as e:
+                    event = {'event': 'error', 'error': str(e)}
+                else:
+                    event = {
+                        'event': 'result' if result['success'] and saved_images else 'error',
+                        'variant': index + 1,
+                        'seed': seed,
+                        'provider': result.get('provider'),
+                        'latency': round(latency, 3)
+                    }
+                    if event['event'] == 'result':
+                        event['generated_images'] = saved_images
+                    else:
+                        event['error'] = result.get('error', '生成的图片保存失败')
+                        if result.get('retry_after'):
+                            event['retry_after'] = result['retry_after']
+                event['elapsed'] = round(time.time() - start_time, 3)
+                variant_logs.append(event)
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except GeneratorExit:
+            # 客户端断开：取消尚未开始的候选
+            for future in futures:
+                future.cancel()
+            log_project(f"多候选生成 {job_id} 客户端已断开，取消未开始的候选")
+            raise
+        
+        succeeded = sum(1 for e in variant_logs if e['event'] == 'result')
+        elapsed = round(time.time() - start_time, 3)
+        log_project(f"多候选生成 {job_id} 完成: 成功 {succeeded}/{variants}, 耗时 {elapsed} 秒")
+        write_generation_log({
+            "timestamp": datetime.now().isoformat(),
+            "version": "v1.0-fanout",
+            "job_id": job_id,
+            "input": {
+                "original_image": inputs['original_image'],
+                "selected_furniture": inputs['selected_furniture'],
+                "mask_filename": inputs['mask_filename'],
+                "variants": variants,
+                "mode": mode,
+                "base_seed": base_seed
+            },
+            "prompt": FUSION_PROMPT_TEXT,
+            "variants": variant_logs
+        }, "generation_fanout")
+        yield json.dumps({'event': 'done', 'job_id': job_id, 'succeeded': succeeded, 'elapsed': elapsed}) + "\n"
+    
+    return Response(stream_events(), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# 生成任务进度事件配置
+# 事件以JSON Lines写入 JOB_FOLDER/<job_id>.events，任意worker都可以读取并推送给客户端
+JOB_EVENT_POLL_INTERVAL = _env_float('JOB_EVENT_POLL_INTERVAL', 0.25)
+JOB_EVENT_HEARTBEAT = _env_float('JOB_EVENT_HEARTBEAT', 15)
+# 任务超过该时间（秒）没有新事件时，事件流以超时错误结束
+JOB_EVENT_IDLE_TIMEOUT = _env_float('JOB_EVENT_IDLE_TIMEOUT', 300)
+# 事件文件保留时间（秒）
+JOB_EVENT_RETENTION = _env_float('JOB_EVENT_RETENTION', 24 * 3600)
+JOB_TERMINAL_STAGES = ('done', 'error')
+
+_JOB_EVENTS_LOCK = threading.Lock()
+
+def get_job_events_path(job_id):
+    return os.path.join(app.config['JOB_FOLDER'], f"{job_id}.events")
+
+@contextmanager
+def open_job_events(job_id):
+    """以追加模式打开任务事件文件并持有文件锁（fcntl，Windows 下为进程内锁），读取-判断-追加不会与其他worker交错"""
+    with open(get_job_events_path(job_id), 'a+', encoding='utf-8') as f:
+        if fcntl is None:
+            with _JOB_EVENTS_LOCK:
+                yield f
+            return
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def append_job_event(job_id, job_start, stage, **info):
+    """追加一条任务事件，t 为距任务开始（创建任务）的秒数"""
+    event = {'stage': stage, 't': round(time.time() - job_start, 3)}
+    event.update(info)
+    with open_job_events(job_id) as f:
+        f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+def queue_job(job_id, pool_name, pool_size, fn, *args, kind='generation'):
+    """
+    写入 queued 事件并把任务提交到进程内线程池执行
+    
+    queued 事件记录任务类型、开始时间和执行任务的worker进程号，fn 以 fn(job_id, job_start, *args) 调用，
+    后续事件的 t 与 queued 使用同一个起点
+    
+    参数:
+        kind: 任务类型；'generation' 以外的任务（如管理接口的 'ingest'）不能通过公开的事件流接口读取
+    """
+    job_start = time.time()
+    append_job_event(job_id, job_start, 'queued', kind=kind, started_at=job_start, pid=os.getpid())
+    get_thread_pool(pool_name, pool_size).submit(fn, job_id, job_start, *args)
+
+def _process_alive(pid):
+    """进程是否仍在运行（只在POSIX下判断，其他平台视为运行中）"""
+    if os.name != 'posix' or not pid:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def mark_job_orphaned(job_id, queued_event):
+    """
+    任务没有结束事件且执行它的worker进程已退出时，追加一条 orphaned 的 error 事件并返回该事件，否则返回 None
+    
+    任务在worker进程内的线程池中执行，进程被回收（gunicorn max_requests）或被杀后任务随之消失；
+    多个请求同时发现时只有一个会写入（文件锁内检查已有的结束事件）
+    """
+    if not queued_event or _process_alive(queued_event.get('pid')):
+        return None
+    error = '执行任务的服务进程已退出，任务未完成，请重新提交'
+    event = {'stage': 'error', 't': round(time.time() - queued_event.get('started_at', time.time()), 3),
+             'error': error, 'orphaned': True}
+    with open_job_events(job_id) as f:
+        # 在文件锁内重新读取：其他请求（或任务自己）已写入结束事件时不再重复追加
+        f.seek(0)
+        if any(json.loads(line).get('stage') in JOB_TERMINAL_STAGES for line in f if line.strip()):
+            return None
+        f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    log_project(f"任务 {job_id} 的worker进程 {queued_event.get('pid')} 已退出，标记为中断")
+    return event
+
+def cleanup_job_events():
+    """删除过期的任务事件文件"""
+    cutoff = time.time() - JOB_EVENT_RETENTION
+    try:
+        for entry in os.scandir(app.config['JOB_FOLDER']):
+            if entry.name.endswith('.events') and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+    except Exception as e:
+        log_project(f"清理任务事件文件失败: {str(e)}")
+
+def run_generation_job(job_id, job_start, inputs):
+    """后台执行一次家具融合生成，并把各阶段进度写入事件文件"""
+    emit = functools.partial(append_job_event, job_id, job_start)
+    
+    try:
+        emit('started')
+        result = route_provider_call('fusion', inputs['mask_path'], inputs['furniture_path'], FUSION_PROMPT_TEXT,
+                                     progress=emit)
+        if not result['success']:
+            emit('error', error=result['error'], retry_after=result.get('retry_after'))
+            return
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        saved_images = save_generated_images(result['images'], f"generated_v1_{timestamp}_{job_id}", progress=emit,
+                                             paste_back=build_fusion_paste_back(result, inputs))
+        if not saved_images:
+            emit('error', error='生成的图片保存失败')
+            return
+        
+        write_generation_log({
+            "timestamp": datetime.now().isoformat(),
+            "version": "v1.0-job",
+            "job_id": job_id,
+            "input": {
+                "original_image": inputs['original_image'],
+                "selected_furniture": inputs['selected_furniture'],
+                "mask_filename": inputs['mask_filename']
+            },
+            "prompt": FUSION_PROMPT_TEXT,
+            "result": {
+                "success": True,
+                "provider": result.get('provider'),
+                "images_count": len(result['images']),
+                "generated_urls": [describe_generated_image(image) for image in result['images']]
+            },
+            "saved_images": saved_images
+        }, "generation_job")
+        
+        emit('done', provider=result.get('provider'), generated_images=saved_images,
+             message=f'成功生成 {len(saved_images)} 张装修效果图')
+        log_project(f"生成任务 {job_id} 完成，耗时 {time.time() - job_start:.2f} 秒")
+        
+    except Exception as e:
+        log_project(f"生成任务 {job_id} 异常: {str(e)}")
+        import traceback
+        log_project(f"异常堆栈:\n{traceback.format_exc()}")
+        try:
+            emit('error', error=f'生成装修效果图错误: {str(e)}')
+        except Exception:
+            pass
+
+@app.route('/generate_v1/jobs', methods=['POST'])
+def create_generation_job():
+    """
+    创建后台生成任务，立即返回 job_id；进度和结果通过 SSE 接口
+    /generate_v1/jobs/<job_id>/events 推送，请求参数同 /generate_v1
+    """
+    data = request.get_json() or {}
+    inputs, error = resolve_fusion_inputs(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    cleanup_job_events()
+    job_id = uuid.uuid4().hex
+    queue_job(job_id, 'generation-job', _env_int('GENERATION_JOB_THREADS', 8), run_generation_job, inputs)
+    
+    log_project(f"创建生成任务 {job_id} - 原图: {inputs['original_image']}, 家具: {inputs['selected_furniture']}, Mask: {inputs['mask_filename']}")
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'events_url': f'/generate_v1/jobs/{job_id}/events'
+    }), 202
+
+@app.route('/generate_v1/jobs/<job_id>/events')
+def stream_generation_job_events(job_id):
+    """
+    以 Server-Sent Events 推送生成任务的进度事件
+    
+    事件类型（event字段）: queued, started, payload_built, provider_called（已发出服务商请求）, provider_done,
+    image_downloaded（每保存一张图片推送一次，包含 /output 路径）, done, error；
+    每个事件的 id 是序号，断线重连时通过 Last-Event-ID 从断点继续。
+    执行任务的worker进程已退出（如 max_requests 回收或被杀）而任务没有结束事件时，
+    追加一条 orphaned=true 的 error 事件结束。只返回生成任务，家具导入任务请用 /admin/ingest/<job_id>
+    """
+    if not all(c in '0123456789abcdef' for c in job_id):
+        return jsonify({'error': '无效的任务ID'}), 400
+    
+    events_path = get_job_events_path(job_id)
+    try:
+        with open(events_path, 'r', encoding='utf-8') as f:
+            first_line = f.readline()
+    except FileNotFoundError:
+        return jsonify({'error': '任务不存在'}), 404
+    # 管理接口创建的任务（家具导入）只能通过管理接口查看，按不存在处理
+    if first_line.strip() and json.loads(first_line).get('kind', 'generation') != 'generation':
+        return jsonify({'error': '任务不存在'}), 404
+    
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', -1))
+    except ValueError:
+        last_event_id = -1
+    
+    def stream_events():
+        event_index = -1
+        last_activity = time.time()
+        last_heartbeat = time.time()
+        queued_event = None
+        buffer = ''
+        # 建议客户端断线后1秒重连
+        yield "retry: 1000\n\n"
+        with open(events_path, 'r', encoding='utf-8') as f:
+            while True:
+                chunk = f.read()
+                if chunk:
+                    buffer += chunk
+                    last_activity = time.time()
+                # 只处理完整的行，写入中的半行留到下次读取
+                *lines, buffer = buffer.split("\n")
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    event_index += 1
+                    event = json.loads(line)
+                    if event_index == 0:
+                        queued_event = event
+                    if event_index <= last_event_id:
+                        continue
+                    stage = event.get('stage', 'message')
+                    yield f"id: {event_index}\nevent: {stage}\ndata: {line}\n\n"
+                    if stage in JOB_TERMINAL_STAGES:
+                        return
+                
+                # 没有新事件时检查执行任务的worker进程是否还在；已退出时写入结束事件，下一轮读取并推送
+                if not chunk:
+                    mark_job_orphaned(job_id, queued_event)
+                
+                now = time.time()
+                if now - last_activity > JOB_EVENT_IDLE_TIMEOUT:
+                    data = json.dumps({'stage': 'error', 'error': '任务长时间没有进展'}, ensure_ascii=False)
+                    yield f"event: error\ndata: {data}\n\n"
+                    return
+                if now - last_heartbeat > JOB_EVENT_HEARTBEAT:
+                    last_heartbeat = now
+                    yield ": keep-alive\n\n"
+                time.sleep(JOB_EVENT_POLL_INTERVAL)
+    
+    return Response(stream_events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 def init_app_resources():
     """初始化应用资源（预加载缓存，避免首次请求延迟）"""
     try:
-        # 预加载家具元数据缓存
-        load_furniture_metadata()
-        log_project("应用资源初始化完成：家具元数据缓存已加载")
+        # 预加载家具元数据并构建家具目录索引
+        get_furniture_catalog().get_index()
+        log_project("应用资源初始化完成：家具目录索引已构建")
     except Exception as e:
         log_project(f"应用资源初始化失败: {str(e)}")
 
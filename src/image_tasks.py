@@ -0,0 +1,741 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CPU密集型图片处理任务与共享进程池
+功能：把合成、压缩、渲染等占用GIL的图片处理放到独立进程中执行，
+      使CPU计算可以随核数扩展，而不受gunicorn worker数量限制
+
+任务函数只接收和返回文件路径及少量元数据（不在进程间传递像素数据），
+主应用（src/app.py）和遮罩图生成工具（mask_generator.py）共用
+"""
+
+import os
+import io
+import mmap
+import time
+import uuid
+import struct
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import json
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageOps
+
+# 进程池大小（0 表示不使用进程池，任务在调用线程中直接执行）
+IMAGE_PROCESS_WORKERS = int(os.getenv('IMAGE_PROCESS_WORKERS', min(4, os.cpu_count() or 1)))
+# 排队+执行中的任务上限，超出后提交方等待（背压）
+IMAGE_PROCESS_MAX_PENDING = int(os.getenv('IMAGE_PROCESS_MAX_PENDING', max(1, IMAGE_PROCESS_WORKERS) * 4))
+# 提交任务时等待空位的最长时间（秒），超时抛出 ImagePoolBusy
+IMAGE_PROCESS_SUBMIT_TIMEOUT = float(os.getenv('IMAGE_PROCESS_SUBMIT_TIMEOUT', 10))
+# 子进程启动方式：worker进程是多线程的（gthread），默认用 forkserver 避免在多线程进程中直接fork
+IMAGE_PROCESS_START_METHOD = os.getenv(
+    'IMAGE_PROCESS_START_METHOD',
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+class ImagePoolBusy(RuntimeError):
+    """进程池排队已满，提交超时"""
+
+def _timed_call(fn, args, kwargs):
+    """在子进程中执行任务并记录开始时间和执行耗时"""
+    started_at = time.time()
+    result = fn(*args, **kwargs)
+    return result, started_at, time.time() - started_at
+
+class ImageProcessPool:
+    """
+    有界的图片处理进程池
+    
+    用信号量限制排队+执行中的任务数：队列满时 submit 阻塞等待，超时抛出 ImagePoolBusy，
+    从而把压力反馈给请求方，而不是在内存中无限堆积任务。
+    每个任务记录排队等待时间和执行时间，按任务名汇总
+    """
+    
+    def __init__(self, max_workers, max_pending, start_method):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.start_method = start_method
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {}
+        self.rejected = 0
+    
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context(self.start_method))
+            return self._executor
+    
+    def _record(self, name, queue_seconds, run_seconds, success):
+        with self._lock:
+            stats = self._stats.setdefault(name, {'count': 0, 'failed': 0, 'queue_seconds': 0.0,
+                                                  'run_seconds': 0.0, 'max_run_seconds': 0.0})
+            stats['count'] += 1
+            if not success:
+                stats['failed'] += 1
+            stats['queue_seconds'] += queue_seconds
+            stats['run_seconds'] += run_seconds
+            stats['max_run_seconds'] = max(stats['max_run_seconds'], run_seconds)
+    
+    def submit(self, fn, *args, submit_timeout=None, **kwargs):
+        """
+        提交一个任务（队列满时阻塞等待空位；进程池关闭时在当前线程直接执行）
+        
+        参数:
+            fn: 模块级任务函数（需可被子进程导入）
+            submit_timeout: 等待排队空位的最长时间（秒），默认 IMAGE_PROCESS_SUBMIT_TIMEOUT
+        
+        返回:
+            Future: 结果为 (任务返回值, {'task', 'queue_seconds', 'run_seconds'})
+        """
+        name = fn.__name__
+        submitted_at = time.time()
+        outer = Future()
+        
+        def finish(result, started_at, run_seconds):
+            queue_seconds = max(0.0, started_at - submitted_at)
+            self._record(name, queue_seconds, run_seconds, True)
+            outer.set_result((result, {'task': name, 'queue_seconds': round(queue_seconds, 3),
+                                       'run_seconds': round(run_seconds, 3)}))
+        
+        if self.max_workers <= 0:
+            try:
+                finish(*_timed_call(fn, args, kwargs))
+            except Exception as e:
+                self._record(name, 0.0, time.time() - submitted_at, False)
+                outer.set_exception(e)
+            return outer
+        
+        timeout = IMAGE_PROCESS_SUBMIT_TIMEOUT if submit_timeout is None else submit_timeout
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self.rejected += 1
+            raise ImagePoolBusy(f"图片处理队列已满（{self.max_pending}个任务），请稍后重试")
+        
+        def on_done(inner):
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+            try:
+                finish(*inner.result())
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    # 子进程异常退出后进程池不可再用，下次提交时重建
+                    with self._lock:
+                        if self._executor is executor:
+                            self._executor = None
+                self._record(name, 0.0, time.time() - submitted_at, False)
+                outer.set_exception(e)
+        
+        with self._lock:
+            self._pending += 1
+        try:
+            executor = self._get_executor()
+            inner = executor.submit(_timed_call, fn, args, kwargs)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+            raise
+        inner.add_done_callback(on_done)
+        return outer
+    
+    def run(self, fn, *args, submit_timeout=None, **kwargs):
+        """执行一个任务并等待结果，返回 (任务返回值, 耗时信息)，见 submit"""
+        return self.submit(fn, *args, submit_timeout=submit_timeout, **kwargs).result()
+    
+    def snapshot(self):
+        with self._lock:
+            tasks = {}
+            for name, stats in self._stats.items():
+                tasks[name] = {
+                    'count': stats['count'],
+                    'failed': stats['failed'],
+                    'avg_queue_seconds': round(stats['queue_seconds'] / stats['count'], 3),
+                    'avg_run_seconds': round(stats['run_seconds'] / stats['count'], 3),
+                    'max_run_seconds': round(stats['max_run_seconds'], 3)
+                }
+            return {
+                'workers': self.max_workers,
+                'start_method': self.start_method,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'rejected': self.rejected,
+                'tasks': tasks
+            }
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_image_process_pool():
+    """获取当前进程的图片处理进程池（按pid区分，preload后fork出的worker各自创建）"""
+    pid = os.getpid()
+    with _POOLS_LOCK:
+        pool = _POOLS.get(pid)
+        if pool is None:
+            pool = ImageProcessPool(IMAGE_PROCESS_WORKERS, IMAGE_PROCESS_MAX_PENDING, IMAGE_PROCESS_START_METHOD)
+            _POOLS[pid] = pool
+        return pool
+
+def submit_image_task(fn, *args, **kwargs):
+    """向共享进程池提交图片任务，返回 Future，见 ImageProcessPool.submit"""
+    return get_image_process_pool().submit(fn, *args, **kwargs)
+
+def run_image_task(fn, *args, **kwargs):
+    """在共享进程池中执行图片任务并等待，返回 (结果, 耗时信息)，见 ImageProcessPool.run"""
+    return get_image_process_pool().run(fn, *args, **kwargs)
+
+# ---------------------------------------------------------------------------
+# 任务函数：只接收路径和参数，结果写入文件，返回少量元数据
+# ---------------------------------------------------------------------------
+
+def _replace_atomically(image, output_path, fmt, **save_kwargs):
+    """先写临时文件再重命名，避免读取方看到写了一半的文件"""
+    temp_path = f"{output_path}.{uuid.uuid4().hex[:8]}.tmp"
+    image.save(temp_path, fmt, **save_kwargs)
+    os.replace(temp_path, output_path)
+
+def flatten_to_rgb(img):
+    """转换为可保存为JPEG的RGB图片（透明区域铺白底）"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        background.paste(img, (0, 0), img.getchannel('A'))
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+def render_api_image(img, max_dimension=1024):
+    """
+    将图片缩放到最长边不超过 max_dimension，并转换为可保存为JPEG的RGB图片（透明区域铺白底）
+    
+    返回:
+        Image: RGB图片（无需缩放和转换时为传入的图片本身）
+    """
+    width, height = img.size
+    if max(width, height) > max_dimension:
+        scale = max_dimension / max(width, height)
+        img = img.resize((int(width * scale), int(height * scale)), Image.Resampling.LANCZOS)
+    return flatten_to_rgb(img)
+
+def save_api_jpeg(img, jpeg_path, max_dimension=1024, quality=85):
+    """
+    生成API用的JPEG并原子写入 jpeg_path
+    
+    返回:
+        dict: {'width', 'height', 'bytes'}
+    """
+    api_img = render_api_image(img, max_dimension)
+    _replace_atomically(api_img, jpeg_path, 'JPEG', quality=quality, optimize=True)
+    return {'width': api_img.width, 'height': api_img.height, 'bytes': os.path.getsize(jpeg_path)}
+
+# 跨进程已解码图片缓存（主应用的 SharedImageCache 负责写入和淘汰）：条目文件为固定长度文件头 + 原始像素，
+# 文件名为缓存键 (绝对路径, mtime_ns, 文件大小) 的sha1；任务进程只读映射，命中时不需要重新解码
+SHARED_IMAGE_HEADER = struct.Struct('<4s8s8sII')
+SHARED_IMAGE_HEADER_SIZE = 64
+SHARED_IMAGE_MAGIC = b'PXB2'
+# 各模式的存储格式：RGB 按 RGBX（每像素4字节，与Pillow内部布局一致）存放并映射为 RGBX 模式的图片，
+# 不需要解包复制；RGBX 的缩放、裁剪、convert 结果与 RGB 相同
+SHARED_IMAGE_RAWMODES = {'L': 'L', 'RGB': 'RGBX', 'RGBA': 'RGBA'}
+
+def get_shared_image_key(path):
+    """共享缓存的缓存键：(绝对路径, mtime_ns, 文件大小)"""
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+def get_shared_image_entry(cache_folder, key):
+    """返回 (条目名, 条目文件路径)"""
+    # 文件名包含格式版本，旧格式的条目不会被读取，由LRU淘汰
+    digest = hashlib.sha1(SHARED_IMAGE_MAGIC + repr(key).encode('utf-8')).hexdigest()
+    return digest, os.path.join(cache_folder, f"{digest}.pix")
+
+def image_from_pixels(pixels):
+    """
+    由 (模式, 尺寸, 格式, 像素缓冲区) 构造只读图片：Image.frombuffer 直接引用缓冲区，不复制像素
+    
+    缓冲区按 SHARED_IMAGE_RAWMODES 的格式存放（RGB 为 RGBX，得到 RGBX 模式的图片）；图片为只读，
+    原地修改（paste/putalpha等）时Pillow先复制一份像素，缓冲区不受影响
+    """
+    mode, size, image_format, buffer = pixels
+    image = Image.frombuffer(mode, size, buffer, 'raw', SHARED_IMAGE_RAWMODES[mode], 0, 1)
+    image.format = image_format
+    return image
+
+def image_to_pixels(image):
+    """把已解码图片转成 image_from_pixels 使用的 (模式, 尺寸, 格式, 像素字节)，不支持的模式返回 None"""
+    rawmode = SHARED_IMAGE_RAWMODES.get(image.mode)
+    if rawmode is None:
+        return None
+    return image.mode, image.size, image.format, image.tobytes('raw', rawmode)
+
+def map_shared_pixels(entry_path):
+    """mmap映射一个缓存条目，返回 (模式, 尺寸, 格式, 像素缓冲区)（缓冲区引用映射），条目不存在或格式不符时返回 None"""
+    try:
+        with open(entry_path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, mode, image_format, width, height = SHARED_IMAGE_HEADER.unpack_from(mapped, 0)
+    except (OSError, ValueError, struct.error):
+        return None
+    mode = mode.rstrip(b'\0').decode('ascii')
+    if magic != SHARED_IMAGE_MAGIC or mode not in SHARED_IMAGE_RAWMODES:
+        return None
+    try:
+        # 更新访问时间，用于LRU淘汰
+        os.utime(entry_path)
+    except OSError:
+        pass
+    return (mode, (width, height), image_format.rstrip(b'\0').decode('ascii') or None,
+            memoryview(mapped)[SHARED_IMAGE_HEADER_SIZE:])
+
+def map_shared_image(entry_path):
+    """mmap映射一个缓存条目并构造只读图片（与映射共享内存，RGB 图片为 RGBX 模式），条目不存在或格式不符时返回 None"""
+    pixels = map_shared_pixels(entry_path)
+    return image_from_pixels(pixels) if pixels is not None else None
+
+def open_shared_image(path, cache_folder=None):
+    """打开图片：共享缓存中有该文件当前版本的解码结果时直接映射，否则用 Image.open 解码（不写入缓存）"""
+    if cache_folder:
+        image = map_shared_image(get_shared_image_entry(cache_folder, get_shared_image_key(path))[1])
+        if image is not None:
+            return image
+    return Image.open(path)
+
+def build_mask_composite(original_path, pure_mask_path, composite_path, api_jpeg_path=None,
+                         max_dimension=1024, quality=85, cache_folder=None):
+    """
+    生成叠加mask图片：以用户涂抹的alpha为权重混合原图和蓝色涂抹，保持原图不透明度；
+    可同时生成API用的JPEG
+    
+    参数:
+        cache_folder: 跨进程已解码图片缓存目录，原图优先从缓存映射（同一张房间照片通常已被解码过）
+    
+    返回:
+        dict: 原图尺寸/模式、涂抹像素统计、API图片信息
+    """
+    with open_shared_image(original_path, cache_folder) as original_img, Image.open(pure_mask_path) as mask_img:
+        original_size, original_mode = original_img.size, original_img.mode
+        mask_size = mask_img.size
+        if mask_img.size != original_img.size:
+            mask_img = mask_img.resize(original_img.size, Image.Resampling.LANCZOS)
+        original_img = original_img.convert('RGBA')
+        mask_img = mask_img.convert('RGBA')
+        
+        mask_alpha = mask_img.getchannel('A')
+        alpha_histogram = mask_alpha.histogram()
+        # result = mask * user_alpha + original * (1 - user_alpha)，mask完全透明处保持原始像素
+        composite_img = Image.composite(mask_img, original_img, mask_alpha)
+        composite_img.putalpha(original_img.getchannel('A'))
+    
+    _replace_atomically(composite_img, composite_path, 'PNG')
+    api_image = save_api_jpeg(composite_img, api_jpeg_path, max_dimension, quality) if api_jpeg_path else None
+    
+    return {
+        'original_size': list(original_size),
+        'original_mode': original_mode,
+        'mask_size': list(mask_size),
+        'alpha_histogram': alpha_histogram,
+        'composite_bytes': os.path.getsize(composite_path),
+        'api_image': api_image
+    }
+
+def compress_jpeg_to_size(image_path, max_size_bytes, quality=85):
+    """
+    将图片压缩到 max_size_bytes 以下并覆盖原文件：先逐级降低质量，不够再逐级缩小尺寸（最小50%）
+    候选结果在内存中编码，只有最终结果写盘
+    
+    返回:
+        dict: {'size': 最终像素尺寸, 'quality': 最终质量, 'bytes': 最终文件大小}
+    """
+    def encode(image, q):
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=q, optimize=True)
+        return buffer
+    
+    with Image.open(image_path) as img:
+        img = flatten_to_rgb(img)
+        img.load()
+    original_size = img.size
+    
+    def encode_first_fitting(image, qualities):
+        for q in qualities:
+            buffer = encode(image, q)
+            if buffer.tell() <= max_size_bytes:
+                return buffer, q
+        return None, None
+    
+    # 策略1: 先尝试只调整质量
+    final_img = img
+    buffer, q = encode_first_fitting(img, range(quality, 20, -10))
+    
+    # 策略2: 如果质量压缩不够，调整尺寸（最小缩放到50%）
+    scale_factor = 0.9
+    while buffer is None and scale_factor >= 0.5:
+        final_img = img.resize((int(original_size[0] * scale_factor), int(original_size[1] * scale_factor)),
+                               Image.Resampling.LANCZOS)
+        buffer, q = encode_first_fitting(final_img, range(quality, 30, -10))
+        scale_factor -= 0.1
+    
+    # 如果还是太大，使用最小尺寸和最低质量
+    if buffer is None:
+        final_img = img.resize((int(original_size[0] * 0.5), int(original_size[1] * 0.5)), Image.Resampling.LANCZOS)
+        q = 30
+        buffer = encode(final_img, q)
+    
+    temp_path = f"{image_path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(buffer.getvalue())
+    os.replace(temp_path, image_path)
+    return {'size': list(final_img.size), 'quality': q, 'bytes': os.path.getsize(image_path)}
+
+def _load_furniture_layer(item):
+    """
+    按摆放参数打开、缩放、旋转家具图片
+    
+    item 带 matte（find_furniture_matte 的结果）时改用预计算的抠图：抠图按原图中的外接框放回同样大小的透明画布，
+    摆放位置、缩放和旋转与使用原图完全一致，但背景是透明的
+    """
+    matte = item.get('matte')
+    with Image.open(matte['path'] if matte else item['path']) as furniture:
+        furniture = furniture.convert('RGBA')
+    source_width, source_height = matte['source_size'] if matte else furniture.size
+    furniture_width = int(item.get('width', source_width))
+    furniture_height = int(item.get('height', source_height))
+    if matte:
+        scale_x = furniture_width / float(source_width)
+        scale_y = furniture_height / float(source_height)
+        left, top, right, bottom = matte['bbox']
+        box = (round(left * scale_x), round(top * scale_y), round(right * scale_x), round(bottom * scale_y))
+        layer = Image.new('RGBA', (furniture_width, furniture_height), (0, 0, 0, 0))
+        layer.paste(furniture.resize((max(1, box[2] - box[0]), max(1, box[3] - box[1])), Image.Resampling.LANCZOS), box[:2])
+        furniture = layer
+    else:
+        furniture = furniture.resize((furniture_width, furniture_height), Image.Resampling.LANCZOS)
+    
+    rotation = item.get('rotation', 0)
+    if rotation != 0:
+        furniture = furniture.rotate(-rotation, expand=True, resample=Image.Resampling.BICUBIC)
+    return furniture
+
+def _scaled_living_room_size(size, min_height=512, target_height=700):
+    """高度不足 min_height 时等比放大到 target_height（与 mask_generator.resize_image_if_needed 一致）"""
+    width, height = size
+    if height < min_height:
+        return int(width * target_height / height), target_height
+    return width, height
+
+def render_furniture_composite(living_room_path, furniture_items, output_path):
+    """
+    渲染组合图：客厅图层在最底层，家具图层在上层，保存为JPG
+    
+    返回:
+        dict: {'size', 'skipped': 不存在的家具文件列表}
+    """
+    with Image.open(living_room_path) as living_room:
+        living_room = living_room.convert('RGBA')
+    target_size = _scaled_living_room_size(living_room.size)
+    if target_size != living_room.size:
+        living_room = living_room.resize(target_size, Image.Resampling.LANCZOS)
+    composite = Image.new('RGBA', living_room.size, (0, 0, 0, 0))
+    composite.paste(living_room, (0, 0))
+    
+    skipped = []
+    for item in furniture_items:
+        if not os.path.exists(item['path']):
+            skipped.append(item['path'])
+            continue
+        furniture = _load_furniture_layer(item)
+        composite.paste(furniture, (int(item.get('x', 0)), int(item.get('y', 0))), furniture)
+    
+    composite_rgb = Image.new('RGB', composite.size, (255, 255, 255))
+    composite_rgb.paste(composite, mask=composite.getchannel('A'))
+    _replace_atomically(composite_rgb, output_path, 'JPEG', quality=95)
+    return {'size': list(composite.size), 'skipped': skipped}
+
+def render_furniture_mask(living_room_path, furniture_items, output_path):
+    """
+    渲染遮罩图：家具部分为白色(255)，背景部分为黑色(0)，保存为JPG
+    
+    返回:
+        dict: {'size', 'skipped': 不存在的家具文件列表}
+    """
+    with Image.open(living_room_path) as living_room:
+        # 只需要尺寸，不解码像素
+        size = _scaled_living_room_size(living_room.size)
+    mask = Image.new('L', size, 0)
+    
+    skipped = []
+    for item in furniture_items:
+        if not os.path.exists(item['path']):
+            skipped.append(item['path'])
+            continue
+        furniture = _load_furniture_layer(item)
+        white_layer = Image.new('L', furniture.size, 255)
+        mask.paste(white_layer, (int(item.get('x', 0)), int(item.get('y', 0))), furniture.getchannel('A'))
+    
+    _replace_atomically(mask.convert('RGB'), output_path, 'JPEG', quality=95)
+    return {'size': list(size), 'skipped': skipped}
+
+# 视觉描述子：HSV颜色直方图（H 8档 x S 4档 x V 2档）+ 64位dHash
+VISUAL_HIST_BINS = 64
+# 白底家具图中 R/G/B 都不低于该值的像素视为背景，不计入颜色直方图
+VISUAL_BACKGROUND_THRESHOLD = 236
+
+def dhash_image(img, hash_size=8):
+    """
+    计算已打开图片的差值哈希（dHash）：缩小为 (hash_size+1) x hash_size 的灰度图，比较相邻像素亮度
+    
+    返回:
+        int: hash_size² 位哈希
+    """
+    small = img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def compute_visual_descriptor(image_path, size=128):
+    """
+    计算家具图片的视觉描述子
+    
+    颜色直方图只统计前景像素：有透明通道时取不透明像素，否则排除接近白色的背景像素；
+    dHash 在铺白底后的灰度图上计算
+    
+    返回:
+        dict: {'hist': 64档像素计数（列表）, 'dhash': int, 'foreground_ratio': 前景像素占比}
+    """
+    with Image.open(image_path) as img:
+        img.draft('RGB', (size * 2, size * 2))
+        img = img.copy()
+    img.thumbnail((size, size), Image.Resampling.BILINEAR)
+    
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        foreground = img.getchannel('A').point(lambda a: 255 if a >= 128 else 0)
+    else:
+        foreground = None
+    rgb = flatten_to_rgb(img)
+    if foreground is None:
+        red, green, blue = rgb.split()
+        darkest = ImageChops.darker(red, ImageChops.darker(green, blue))
+        foreground = darkest.point(lambda v: 255 if v < VISUAL_BACKGROUND_THRESHOLD else 0)
+    
+    # 每个像素的直方图档位 = H档 * 8 + S档 * 2 + V档，用 point 查表后由 histogram 一次统计
+    hue, saturation, value = rgb.convert('HSV').split()
+    bins = ImageChops.add(ImageChops.add(hue.point(lambda h: (h // 32) * 8), saturation.point(lambda s: (s // 64) * 2)),
+                          value.point(lambda v: v // 128))
+    foreground_pixels = foreground.histogram()[255]
+    if foreground_pixels == 0:
+        # 整张图都被判为背景时退回统计全部像素
+        foreground = None
+    hist = bins.histogram(mask=foreground)[:VISUAL_HIST_BINS]
+    
+    return {
+        'hist': hist,
+        'dhash': dhash_image(rgb),
+        'foreground_ratio': foreground_pixels / (rgb.width * rgb.height)
+    }
+
+# 家具抠图：白底（或其他纯色底）家具图估计背景色，生成alpha抠图并裁掉空白边距
+# 与背景色的最大通道差低于 MATTE_TOLERANCE_LOW 为完全透明，高于 MATTE_TOLERANCE_HIGH 为完全不透明，之间线性过渡
+MATTE_TOLERANCE_LOW = 12
+MATTE_TOLERANCE_HIGH = 40
+# 图片边缘像素中与背景色接近的比例低于该值时认为不是纯色背景，不生成抠图
+MATTE_MIN_BORDER_UNIFORMITY = 0.6
+# 判断背景连通性的工作分辨率（最长边）；只有与图片边缘连通的背景色区域才变透明，家具内部的白色保持不透明
+MATTE_WORK_SIZE = 512
+# 裁剪外接框向外保留的像素数
+MATTE_PADDING = 2
+MATTE_INDEX_FILENAME = 'mattes.json'
+
+def get_matte_filename(furniture_filename):
+    """抠图文件名：{家具文件名}.matte.png"""
+    return f"{furniture_filename}.matte.png"
+
+def _channel_max(rgb):
+    """RGB图片三个通道逐像素取最大值，返回L图片"""
+    red, green, blue = rgb.split()
+    return ImageChops.lighter(red, ImageChops.lighter(green, blue))
+
+def estimate_background_color(rgb, tolerance=MATTE_TOLERANCE_HIGH):
+    """
+    用缩略图四周一圈像素估计背景色（逐通道中位数）
+    
+    返回:
+        tuple: ((r, g, b), 边缘像素中与背景色接近的比例)
+    """
+    small = rgb.copy()
+    small.thumbnail((128, 128), Image.Resampling.BILINEAR)
+    width, height = small.size
+    border = []
+    for box in ((0, 0, width, 1), (0, height - 1, width, height), (0, 1, 1, height - 1), (width - 1, 1, width, height - 1)):
+        border.extend(small.crop(box).getdata())
+    color = tuple(sorted(pixel[channel] for pixel in border)[len(border) // 2] for channel in range(3))
+    close = sum(1 for pixel in border if max(abs(pixel[channel] - color[channel]) for channel in range(3)) < tolerance)
+    return color, close / len(border)
+
+def build_furniture_matte(image_path, output_path, api_jpeg_path=None, max_dimension=1024, quality=85):
+    """
+    生成家具抠图：透明背景、裁掉空白边距的RGBA PNG（原子写入 output_path），可同时生成API用的JPEG
+    
+    原图本身带透明通道时直接使用；否则估计背景色，按与背景色的差值生成软边alpha，
+    并在 MATTE_WORK_SIZE 分辨率上从图片边缘泛洪，只让与边缘连通的背景区域变透明
+    
+    返回:
+        dict: {'bbox': 原图中的裁剪框, 'source_size', 'size', 'source': 'alpha' / 'background', 'background',
+               'foreground_ratio', 'api_image'}；背景不是纯色或找不到前景时返回 None（不写文件）
+    """
+    with Image.open(image_path) as img:
+        source_size = img.size
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        rgba = img.convert('RGBA')
+    
+    background = None
+    alpha = rgba.getchannel('A')
+    if not (has_alpha and alpha.getextrema()[0] < 255):
+        rgb = rgba.convert('RGB')
+        background, uniformity = estimate_background_color(rgb)
+        if uniformity < MATTE_MIN_BORDER_UNIFORMITY:
+            return None
+        distance = _channel_max(ImageChops.difference(rgb, Image.new('RGB', rgb.size, background)))
+        ramp = 255.0 / (MATTE_TOLERANCE_HIGH - MATTE_TOLERANCE_LOW)
+        alpha = distance.point(lambda v: 0 if v <= MATTE_TOLERANCE_LOW else
+                               255 if v >= MATTE_TOLERANCE_HIGH else int((v - MATTE_TOLERANCE_LOW) * ramp))
+        
+        # 低分辨率上求与边缘连通的背景：四周补一圈背景后从角上泛洪（填充值128），再扩张一个像素盖住边缘
+        small = distance.copy()
+        small.thumbnail((MATTE_WORK_SIZE, MATTE_WORK_SIZE), Image.Resampling.BILINEAR)
+        candidates = ImageOps.expand(small.point(lambda v: 255 if v < MATTE_TOLERANCE_HIGH else 0), 1, fill=255)
+        ImageDraw.floodfill(candidates, (0, 0), 128)
+        connected = candidates.crop((1, 1, candidates.width - 1, candidates.height - 1)).point(lambda v: 255 if v == 128 else 0)
+        connected = connected.filter(ImageFilter.MaxFilter(3)).resize(rgb.size, Image.Resampling.NEAREST)
+        alpha = ImageChops.lighter(alpha, ImageChops.invert(connected))
+        rgba.putalpha(alpha)
+    
+    bbox = alpha.point(lambda a: 255 if a >= 16 else 0).getbbox()
+    if not bbox:
+        return None
+    bbox = (max(0, bbox[0] - MATTE_PADDING), max(0, bbox[1] - MATTE_PADDING),
+            min(source_size[0], bbox[2] + MATTE_PADDING), min(source_size[1], bbox[3] + MATTE_PADDING))
+    matte = rgba.crop(bbox)
+    foreground_pixels = sum(alpha.crop(bbox).histogram()[16:])
+    _replace_atomically(matte, output_path, 'PNG')
+    api_image = save_api_jpeg(matte, api_jpeg_path, max_dimension, quality) if api_jpeg_path else None
+    
+    return {
+        'bbox': list(bbox),
+        'source_size': list(source_size),
+        'size': list(matte.size),
+        'source': 'background' if background else 'alpha',
+        'background': list(background) if background else None,
+        'foreground_ratio': round(foreground_pixels / float(source_size[0] * source_size[1]), 4),
+        'api_image': api_image
+    }
+
+_MATTE_INDEXES = {}
+
+def load_matte_index(matte_folder):
+    """读取抠图索引（按文件mtime缓存），不存在或无法解析时返回空字典"""
+    index_path = os.path.join(matte_folder, MATTE_INDEX_FILENAME)
+    try:
+        mtime_ns = os.stat(index_path).st_mtime_ns
+    except OSError:
+        return {}
+    cached = _MATTE_INDEXES.get(index_path)
+    if cached is None or cached[0] != mtime_ns:
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                items = json.load(f).get('items', {})
+        except (OSError, ValueError):
+            items = {}
+        cached = (mtime_ns, items)
+        _MATTE_INDEXES[index_path] = cached
+    return cached[1]
+
+def find_furniture_matte(furniture_path, matte_folder):
+    """
+    查找家具图片的预计算抠图
+    
+    返回:
+        dict: {'path', 'bbox', 'source_size'}；没有抠图，或家具图片在生成抠图后被修改过时返回 None
+    """
+    filename = os.path.basename(furniture_path)
+    entry = load_matte_index(matte_folder).get(filename)
+    if not entry:
+        return None
+    matte_path = os.path.join(matte_folder, get_matte_filename(filename))
+    try:
+        stat = os.stat(furniture_path)
+    except OSError:
+        return None
+    if entry['mtime_ns'] != stat.st_mtime_ns or entry['bytes'] != stat.st_size or not os.path.exists(matte_path):
+        return None
+    return {'path': matte_path, 'bbox': entry['bbox'], 'source_size': entry['source_size']}
+
+# 批量导入：单张图片的像素数上限（防止解压炸弹）和最短边下限
+INGEST_MAX_PIXELS = 50_000_000
+INGEST_MIN_DIMENSION = 64
+INGEST_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'MPO')
+
+def ingest_furniture_image(source_path, output_path, thumb_path, api_jpeg_path, matte_path=None, matte_api_jpeg_path=None,
+                           max_dimension=2048, thumb_size=256, api_max_dimension=1024, quality=92):
+    """
+    校验并规范化一张导入的家具图片，生成派生文件（缩略图、API用JPEG、抠图）
+    
+    规范化：按EXIF方向旋正，最长边缩到 max_dimension 以内；output_path 为 .png 时保留透明通道，否则存为RGB JPEG
+    
+    返回:
+        dict: {'size', 'format', 'has_alpha', 'bytes', 'thumb_size', 'api_image', 'matte': build_furniture_matte 的结果或 None}
+    
+    异常:
+        ValueError: 不是支持的图片格式、文件损坏、尺寸过小或过大
+    """
+    try:
+        with Image.open(source_path) as img:
+            if img.format not in INGEST_IMAGE_FORMATS:
+                raise ValueError(f"不支持的图片格式: {img.format}")
+            if img.width * img.height > INGEST_MAX_PIXELS:
+                raise ValueError(f"图片像素过多: {img.width}x{img.height}")
+            img.load()
+            img = ImageOps.exif_transpose(img)
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        raise ValueError("无法解码图片（文件损坏或不是图片）")
+    if min(img.size) < INGEST_MIN_DIMENSION:
+        raise ValueError(f"图片尺寸过小: {img.width}x{img.height}")
+    
+    has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+    if max(img.size) > max_dimension:
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+        img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    if output_path.lower().endswith('.png'):
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+        _replace_atomically(img, output_path, 'PNG')
+    else:
+        img = flatten_to_rgb(img)
+        _replace_atomically(img, output_path, 'JPEG', quality=quality)
+    
+    thumb = flatten_to_rgb(img)
+    if thumb is img:
+        thumb = img.copy()
+    thumb.thumbnail((thumb_size, thumb_size), Image.Resampling.LANCZOS)
+    _replace_atomically(thumb, thumb_path, 'JPEG', quality=85)
+    api_image = save_api_jpeg(img, api_jpeg_path, api_max_dimension)
+    matte = build_furniture_matte(output_path, matte_path, matte_api_jpeg_path, api_max_dimension) if matte_path else None
+    
+    return {
+        'size': list(img.size),
+        'format': 'PNG' if output_path.lower().endswith('.png') else 'JPEG',
+        'has_alpha': has_alpha,
+        'bytes': os.path.getsize(output_path),
+        'thumb_size': list(thumb.size),
+        'api_image': api_image,
+        'matte': matte
+    }
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""测试公共配置：把 src 加入导入路径，提供临时家具目录"""
+
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import app as ai_app  # noqa: E402
+
+@pytest.fixture
+def furniture_folder(tmp_path, monkeypatch):
+    """
+    临时家具目录（含元数据文件），清单、SQLite和视觉索引路径指向临时目录
+    
+    返回:
+        function: write(metadata_list) 写入空图片文件和元数据文件，返回目录路径
+    """
+    folder = tmp_path / 'furniture'
+    folder.mkdir()
+    monkeypatch.setitem(ai_app.app.config, 'FURNITURE_FOLDER', str(folder))
+    monkeypatch.setattr(ai_app, 'CATALOG_MANIFEST_PATH', str(tmp_path / 'catalog' / 'furniture_manifest.bin'))
+    monkeypatch.setattr(ai_app, 'CATALOG_SQLITE_PATH', str(tmp_path / 'catalog' / 'furniture.db'))
+    monkeypatch.setattr(ai_app, 'VISUAL_INDEX_PATH', str(tmp_path / 'catalog' / 'visual_index.json'))
+    monkeypatch.setattr(ai_app, '_SQLITE_FURNITURE_CATALOG', ai_app.SqliteFurnitureCatalog(ai_app.CATALOG_SQLITE_PATH))
+    
+    def write(metadata_list):
+        for entry in metadata_list:
+            (folder / entry['filename']).write_bytes(b'')
+        with open(folder / ai_app.FURNITURE_METADATA_FILENAME, 'w', encoding='utf-8') as f:
+            json.dump({'furniture': metadata_list}, f, ensure_ascii=False)
+        return str(folder)
+    
+    return write
+
+@pytest.fixture
+def provider_guard(monkeypatch):
+    """
+    为服务商名称安装独立的熔断器（默认窗口4次、最少4次、冷却30秒），测试结束后恢复
+    
+    返回:
+        function: install(name, **options) 返回安装的 ProviderGuard
+    """
+    def install(name, **options):
+        settings = dict(latency_target=1.0, max_concurrency=4, window=4, min_calls=4, error_rate=0.5, cooldown=30.0)
+        settings.update(options)
+        guard = ai_app.ProviderGuard(name, **settings)
+        monkeypatch.setitem(ai_app._PROVIDER_GUARDS, name, guard)
+        return guard
+    
+    return install
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""批量导入提交：中断时家具库保持原样，提交后索引带真实源签名，期间目录被修改时按当前内容重建"""
+
+import json
+import os
+
+import pytest
+from PIL import Image
+
+import app as ai_app
+
+METADATA = [
+    {'filename': 'a.jpg', 'style': 'modern', 'type': 'sofa', 'length': 2, 'width': 0.9, 'height': 0.8},
+    {'filename': 'b.jpg', 'style': 'nordic', 'type': 'chair', 'length': 0.7},
+]
+
+NEW_NAMES = ['x.jpg', 'y.jpg']
+
+@pytest.fixture
+def catalog(furniture_folder, tmp_path, monkeypatch):
+    """已有两件家具并已生成清单和SQLite的家具库，派生文件目录指向临时目录"""
+    monkeypatch.setattr(ai_app, 'FURNITURE_THUMB_FOLDER', str(tmp_path / 'catalog' / 'thumbs'))
+    monkeypatch.setattr(ai_app, 'FURNITURE_API_FOLDER', str(tmp_path / 'catalog' / 'api'))
+    monkeypatch.setattr(ai_app, 'MATTE_FOLDER', str(tmp_path / 'catalog' / 'mattes'))
+    folder = furniture_folder(METADATA)
+    ai_app.build_catalog_manifest(workers=1)
+    ai_app.build_catalog_sqlite(workers=1)
+    return folder
+
+def _stage(tmp_path):
+    """在暂存目录生成 NEW_NAMES 的家具图片和派生文件，返回 (results, records, staged)"""
+    staged = {name: tmp_path / 'job' / name for name in ('source', 'furniture', 'thumbs', 'api', 'mattes')}
+    for directory in staged.values():
+        directory.mkdir(parents=True)
+    results = {}
+    for index, name in enumerate(NEW_NAMES):
+        source_path = staged['source'] / name
+        Image.new('RGB', (300, 200), (40 * index, 60, 150)).save(source_path, 'JPEG')
+        results[name] = ai_app.image_tasks.ingest_furniture_image(
+            str(source_path), str(staged['furniture'] / name),
+            str(staged['thumbs'] / ai_app.get_thumbnail_filename(name)), str(staged['api'] / f"{name}.api.jpg"))
+    records = {name: {'filename': name, 'style': 'modern', 'type': 'chair'} for name in NEW_NAMES}
+    return results, records, {name: str(path) for name, path in staged.items()}
+
+def _names():
+    return [item['name'] for item in ai_app.list_furniture_items(force_reload=True)]
+
+def _source_signature(folder):
+    return (ai_app._stat_signature(folder), ai_app._stat_signature(ai_app.get_furniture_metadata_path()))
+
+def test_commit_publishes_items_with_real_signature(catalog, tmp_path):
+    results, records, staged = _stage(tmp_path)
+    stages = []
+    
+    ai_app.commit_ingested_furniture(results, records, staged, workers=1,
+                                     progress=lambda stage, **info: stages.append(stage))
+    
+    assert stages == ['indexed', 'committed']
+    assert _names() == ['a.jpg', 'b.jpg', 'x.jpg', 'y.jpg']
+    with open(ai_app.get_furniture_metadata_path(), encoding='utf-8') as f:
+        assert 'pending' not in json.load(f)
+    signature = _source_signature(catalog)
+    assert ai_app.read_catalog_manifest(signature) is not None
+    assert ai_app._SQLITE_FURNITURE_CATALOG.is_current()
+    assert not os.path.exists(f"{ai_app.CATALOG_MANIFEST_PATH}.next")
+    assert not os.path.exists(f"{ai_app.CATALOG_SQLITE_PATH}.next")
+
+def test_interrupted_commit_keeps_catalog_unchanged(catalog, tmp_path, monkeypatch):
+    results, records, staged = _stage(tmp_path)
+    before = ai_app.list_furniture_items(force_reload=True)
+    
+    def interrupted(workers, items):
+        raise KeyboardInterrupt
+    
+    monkeypatch.setattr(ai_app, 'prepare_catalog_indexes', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        ai_app.commit_ingested_furniture(results, records, staged, workers=1)
+    
+    # 图片已移入家具目录，但元数据中记为 pending，列出家具时跳过
+    assert all(os.path.exists(os.path.join(catalog, name)) for name in NEW_NAMES)
+    with open(ai_app.get_furniture_metadata_path(), encoding='utf-8') as f:
+        metadata = json.load(f)
+    assert metadata['pending'] == NEW_NAMES
+    assert [entry['filename'] for entry in metadata['furniture']] == ['a.jpg', 'b.jpg']
+    assert ai_app.list_furniture_items(force_reload=True) == before
+    # 中断前生成的清单和SQLite没有被替换
+    assert ai_app.read_catalog_manifest(_source_signature(catalog)) is None
+    assert not ai_app._SQLITE_FURNITURE_CATALOG.is_current()
+
+def test_interrupted_replace_discards_prepared_indexes(catalog, tmp_path, monkeypatch):
+    results, records, staged = _stage(tmp_path)
+    replace = os.replace
+    
+    def interrupted(src, dst):
+        # 第一次替换写入 pending，第二次替换提交元数据时中断
+        if dst == ai_app.get_furniture_metadata_path():
+            with open(src, encoding='utf-8') as f:
+                if 'pending' not in json.load(f):
+                    raise KeyboardInterrupt
+        replace(src, dst)
+    
+    monkeypatch.setattr(ai_app.os, 'replace', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        ai_app.commit_ingested_furniture(results, records, staged, workers=1)
+    
+    assert _names() == ['a.jpg', 'b.jpg']
+    assert not os.path.exists(f"{ai_app.CATALOG_MANIFEST_PATH}.next")
+    assert not os.path.exists(f"{ai_app.CATALOG_SQLITE_PATH}.next")
+
+def test_commit_rebuilds_when_folder_changes(catalog, tmp_path, monkeypatch):
+    results, records, staged = _stage(tmp_path)
+    prepare = ai_app.prepare_catalog_indexes
+    
+    def prepare_then_modify(workers, items):
+        # 只在提交预生成时修改一次，之后的重建使用原函数
+        monkeypatch.setattr(ai_app, 'prepare_catalog_indexes', prepare)
+        prepared = prepare(workers, items)
+        with open(os.path.join(catalog, 'z.jpg'), 'wb'):
+            pass
+        return prepared
+    
+    monkeypatch.setattr(ai_app, 'prepare_catalog_indexes', prepare_then_modify)
+    ai_app.commit_ingested_furniture(results, records, staged, workers=1)
+    
+    assert _names() == ['a.jpg', 'b.jpg', 'x.jpg', 'y.jpg', 'z.jpg']
+    assert ai_app.read_catalog_manifest(_source_signature(catalog)) is not None
+    assert ai_app._SQLITE_FURNITURE_CATALOG.is_current()
+    assert ai_app._SQLITE_FURNITURE_CATALOG.get_index()['count'] == 5
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""二进制清单的写入/读取往返和预建索引"""
+
+import math
+import struct
+
+import pytest
+
+import app as ai_app
+
+METADATA = [
+    {'filename': 'a_modern.jpg', 'display_name': '现代沙发', 'style': 'Modern', 'type': 'sofa',
+     'length': 2.1, 'width': 0.9, 'height': 0.8, 'description': '皮质'},
+    {'filename': 'b.png', 'display_name': 'B', 'style': 'nordic', 'type': 'Chair', 'length': 0.8, 'width': 0.7},
+    {'filename': 'c.jpg', 'style': 'modern', 'type': 'sofa', 'length': None, 'width': 0, 'description': ''},
+    {'filename': 'd.gif', 'type': 'table', 'length': 2.6, 'height': 0.75},
+]
+
+IMAGE_INFOS = [
+    {'width': 1200, 'height': 800, 'format': 'JPEG', 'has_alpha': False},
+    {'width': 400, 'height': 300, 'format': 'PNG', 'has_alpha': True},
+    None,
+    {'width': 300, 'height': 200, 'format': 'GIF', 'has_alpha': False},
+]
+
+SIGNATURE = ((1700000000000000000, 4096), (1700000000000000001, 512))
+
+def _write(folder_writer, tmp_path):
+    folder_writer(METADATA)
+    items = ai_app.list_furniture_items(force_reload=True)
+    manifest_path = str(tmp_path / 'manifest.bin')
+    ai_app.write_catalog_manifest(items, IMAGE_INFOS, SIGNATURE, manifest_path)
+    return items, manifest_path
+
+def _expected_items(items):
+    metadata = {entry['filename']: entry for entry in METADATA}
+    return [ai_app.build_furniture_item(item['name'], metadata[item['name']], info) for item, info in zip(items, IMAGE_INFOS)]
+
+def test_manifest_round_trip(furniture_folder, tmp_path):
+    items, manifest_path = _write(furniture_folder, tmp_path)
+    manifest = ai_app.read_catalog_manifest(SIGNATURE, manifest_path)
+    
+    assert manifest is not None
+    assert len(manifest) == len(items)
+    expected = _expected_items(items)
+    assert list(manifest) == expected
+    assert manifest[-1] == expected[-1]
+    assert manifest.names() == [item['name'] for item in items]
+    with pytest.raises(IndexError):
+        manifest[len(items)]
+
+def test_manifest_index_matches_built_index(furniture_folder, tmp_path):
+    items, manifest_path = _write(furniture_folder, tmp_path)
+    mapped = ai_app.read_catalog_manifest(SIGNATURE, manifest_path).catalog_index()
+    built = ai_app.build_catalog_index(_expected_items(items))
+    
+    for field in ('length', 'width', 'height', 'aspect', 'style_key', 'type_key'):
+        assert list(mapped['columns'][field]) == built['columns'][field]
+    for field in ('style', 'type'):
+        assert {key: list(positions) for key, positions in mapped[field].items()} == built[field]
+    for field in ('length', 'width'):
+        assert {part: list(values) for part, values in mapped[field].items()} == built[field]
+    assert list(mapped['size_bucket']) == built['size_bucket']
+    for field in ('length', 'width', 'aspect'):
+        assert mapped['arrays'][field].tobytes() == built['arrays'][field].tobytes()
+
+def test_manifest_rejects_stale_or_foreign_files(furniture_folder, tmp_path):
+    _, manifest_path = _write(furniture_folder, tmp_path)
+    
+    assert ai_app.read_catalog_manifest((SIGNATURE[0], None), manifest_path) is None
+    assert ai_app.read_catalog_manifest(SIGNATURE, str(tmp_path / 'missing.bin')) is None
+    
+    with open(manifest_path, 'r+b') as f:
+        f.seek(4)
+        f.write(struct.pack('<H', ai_app.CATALOG_MANIFEST_FORMAT_VERSION + 1))
+    assert ai_app.read_catalog_manifest(SIGNATURE, manifest_path) is None
+
+def test_manifest_truncated_file_is_rejected(furniture_folder, tmp_path):
+    _, manifest_path = _write(furniture_folder, tmp_path)
+    with open(manifest_path, 'r+b') as f:
+        f.truncate(ai_app._MANIFEST_HEADER.size + 10)
+    assert ai_app.read_catalog_manifest(SIGNATURE, manifest_path) is None
+
+def test_catalog_uses_manifest_when_current(furniture_folder):
+    folder = furniture_folder(METADATA)
+    json_catalog = ai_app.FurnitureCatalog(lambda: folder)
+    assert json_catalog.get_index()['source'] == 'json'
+    
+    ai_app.build_catalog_manifest(workers=1)
+    catalog = ai_app.FurnitureCatalog(lambda: folder)
+    index = catalog.get_index()
+    assert index['source'] == 'manifest'
+    # 空文件读不出图片头，条目与JSON来源相同
+    assert list(index['items']) == list(json_catalog.get_index()['items'])
+    assert catalog.query(style='MODERN', max_length=2.2) == json_catalog.query(style='MODERN', max_length=2.2)
+    assert not any(isinstance(value, float) and math.isnan(value) for value in index['columns']['width'])
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""内存索引查询：只展开最小条件、其余逐条检查的结果与逐条过滤一致；索引只在目录变化时重建"""
+
+import itertools
+import random
+
+import pytest
+
+import app as ai_app
+
+def _metadata(count=400, seed=11):
+    rng = random.Random(seed)
+    return [{
+        'filename': f'item_{position:04d}.jpg',
+        'display_name': rng.choice(['Sofa', '沙发', 'Armchair']),
+        'style': rng.choice(['Modern', 'nordic', None]),
+        'type': rng.choice(['sofa', 'Chair', None]),
+        'length': rng.choice([None, 0, round(rng.uniform(0.5, 3.2), 2), 2.0]),
+        'width': rng.choice([None, 0, round(rng.uniform(0.4, 1.2), 2)]),
+        'description': rng.choice(['leather', 'oak wood', 'leather wood', ''])
+    } for position in range(count)]
+
+def _in_range(value, low, high):
+    value = value if isinstance(value, (int, float)) and value else None
+    return value is None or ((low is None or value >= low) and (high is None or value <= high))
+
+def _brute_force(items, style=None, furniture_type=None, min_length=None, max_length=None,
+                 min_width=None, max_width=None, room_length=None, room_width=None, text=None):
+    length_high, width_high = max_length, max_width
+    if room_length and room_width:
+        length_high = min(value for value in (max_length, room_length * 0.8) if value)
+        width_high = min(value for value in (max_width, room_width * 0.8) if value)
+    matched = []
+    for item in items:
+        if style and (item['style'] or '').lower() != style.lower():
+            continue
+        if furniture_type and (item['type'] or '').lower() != furniture_type.lower():
+            continue
+        if not _in_range(item['length'], min_length, length_high) or not _in_range(item['width'], min_width, width_high):
+            continue
+        haystack = ' '.join(str(item[field] or '') for field in ('name', 'display_name', 'description')).lower()
+        if text and not all(term in haystack for term in text.lower().split()):
+            continue
+        matched.append(item['name'])
+    return matched
+
+FILTERS = {
+    'style': [None, 'MODERN', 'nordic', 'missing'],
+    'furniture_type': [None, 'chair'],
+    'min_length': [None, 1.5],
+    'max_length': [None, 2.2],
+    'min_width': [None, 0.8],
+    'room': [None, (3.0, 1.2)],
+    'text': [None, 'leather', 'wood leather', '沙发'],
+}
+
+CASES = [dict(zip(FILTERS, values)) for values in itertools.product(*FILTERS.values())]
+
+@pytest.fixture(params=['json', 'manifest'])
+def catalog(request, furniture_folder):
+    folder = furniture_folder(_metadata())
+    if request.param == 'manifest':
+        ai_app.build_catalog_manifest(workers=1)
+    catalog = ai_app.FurnitureCatalog(lambda: folder)
+    assert catalog.get_index()['source'] == request.param
+    return catalog
+
+def test_query_matches_brute_force(catalog):
+    items = list(catalog.get_index()['items'])
+    for case in CASES:
+        filters = dict(case)
+        room = filters.pop('room')
+        if room:
+            filters['room_length'], filters['room_width'] = room
+        assert [item['name'] for item in catalog.query(**filters)] == _brute_force(items, **filters), case
+
+def test_rebuilds_only_on_change(furniture_folder):
+    metadata = _metadata(20)
+    folder = furniture_folder(metadata)
+    catalog = ai_app.FurnitureCatalog(lambda: folder)
+    catalog.query(style='modern')
+    catalog.query(text='wood')
+    assert catalog.builds == 1
+    
+    metadata.append({'filename': 'new_modern.jpg', 'style': 'modern', 'length': 1.0})
+    # 新增文件、元数据文件变大：签名包含大小，同一时间精度内的修改也能发现
+    furniture_folder(metadata)
+    
+    assert 'new_modern.jpg' in [item['name'] for item in catalog.query(style='modern')]
+    assert catalog.builds == 2
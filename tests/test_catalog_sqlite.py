@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""SQLite家具目录与JSON来源返回相同的条目（尺寸原值、过滤语义）"""
+
+import pytest
+
+import app as ai_app
+
+METADATA = [
+    {'filename': 'a.jpg', 'style': 'modern', 'type': 'sofa', 'length': 2, 'width': 0.9, 'height': 0.8},
+    {'filename': 'b.jpg', 'style': 'modern', 'type': 'sofa', 'length': 0, 'width': 0, 'height': 0},
+    {'filename': 'c.jpg', 'style': 'nordic', 'type': 'chair', 'length': 0.7, 'description': 'wood'},
+    {'filename': 'd.jpg', 'style': 'retro', 'length': 2.6, 'width': 1.0},
+    {'filename': 'e.jpg', 'type': 'sofa', 'length': 1.9, 'width': 0.8, 'description': 'leather wood'},
+]
+
+QUERIES = [
+    '',
+    'style=modern',
+    'type=sofa&min_length=1.8',
+    'max_length=2.2&max_width=0.95',
+    'room_length=4.0&room_width=1.5',
+    'q=wood',
+]
+
+@pytest.fixture
+def client(furniture_folder):
+    furniture_folder(METADATA)
+    return ai_app.app.test_client()
+
+def _furniture(client, monkeypatch, backend, query):
+    monkeypatch.setattr(ai_app, 'CATALOG_BACKEND', backend)
+    response = client.get(f'/furniture?{query}')
+    assert response.status_code == 200
+    return response.get_json()['furniture']
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_sqlite_matches_json_backend(client, monkeypatch, query):
+    expected = _furniture(client, monkeypatch, 'json', query)
+    ai_app.build_catalog_sqlite(workers=1)
+    monkeypatch.setattr(ai_app, 'CATALOG_BACKEND', 'sqlite')
+    assert ai_app.get_furniture_catalog() is ai_app._SQLITE_FURNITURE_CATALOG
+    
+    assert _furniture(client, monkeypatch, 'sqlite', query) == expected
+
+def test_sqlite_keeps_zero_dimensions(client, monkeypatch):
+    ai_app.build_catalog_sqlite(workers=1)
+    items = {item['name']: item for item in _furniture(client, monkeypatch, 'sqlite', '')}
+    
+    assert (items['b.jpg']['length'], items['b.jpg']['width'], items['b.jpg']['height']) == (0, 0, 0)
+    assert items['c.jpg']['width'] is None
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""分面查询的析取计数：某个分面的计数忽略该分面自身的选择、应用其余条件"""
+
+import random
+
+import pytest
+
+import app as ai_app
+
+def _metadata(count=300, seed=7):
+    rng = random.Random(seed)
+    return [{
+        'filename': f'item_{position:04d}.jpg',
+        'style': rng.choice(['Modern', 'nordic', 'retro', None]),
+        'type': rng.choice(['sofa', 'Chair', None]),
+        'length': rng.choice([None, 0, round(rng.uniform(0.6, 3.0), 2), 2.0, 2.4]),
+        'width': rng.choice([None, round(rng.uniform(0.4, 1.1), 2)]),
+        'description': rng.choice(['leather', 'wood', ''])
+    } for position in range(count)]
+
+def _brute_force(items, styles, furniture_types, sizes, **filters):
+    """按定义逐条计算命中条目和三个分面的计数"""
+    base = ai_app.FurnitureCatalog(lambda: ai_app.app.config['FURNITURE_FOLDER']).query(**filters)
+    style_set = {value.lower() for value in styles}
+    type_set = {value.lower() for value in furniture_types}
+    facets = {'style': {}, 'type': {}, 'size': {}}
+    matched = []
+    for item in base:
+        style_key = item['style'].lower() if item.get('style') else None
+        type_key = item['type'].lower() if item.get('type') else None
+        size_key = ai_app.get_size_bucket(ai_app._numeric_or_none(item.get('length')))
+        style_ok = not style_set or style_key in style_set
+        type_ok = not type_set or type_key in type_set
+        size_ok = not sizes or size_key in sizes
+        if type_ok and size_ok and style_key:
+            facets['style'][style_key] = facets['style'].get(style_key, 0) + 1
+        if style_ok and size_ok and type_key:
+            facets['type'][type_key] = facets['type'].get(type_key, 0) + 1
+        if style_ok and type_ok:
+            facets['size'][size_key] = facets['size'].get(size_key, 0) + 1
+        if style_ok and type_ok and size_ok:
+            matched.append(item['name'])
+    return matched, facets
+
+CASES = [
+    ((), (), (), {}),
+    (('modern',), (), (), {}),
+    (('MODERN', 'retro'), ('sofa',), (), {}),
+    ((), ('chair',), ('lt_1.6', 'unknown'), {}),
+    (('nordic',), (), ('2.0_2.4',), {'min_width': 0.5}),
+    ((), (), (), {'room_length': 4.0, 'room_width': 1.5}),
+    (('retro',), ('sofa',), ('ge_2.4',), {'text': 'leather'}),
+]
+
+@pytest.mark.parametrize('use_manifest', [False, True])
+@pytest.mark.parametrize('styles, furniture_types, sizes, filters', CASES)
+def test_facet_counts_are_disjunctive(furniture_folder, use_manifest, styles, furniture_types, sizes, filters):
+    folder = furniture_folder(_metadata())
+    if use_manifest:
+        ai_app.build_catalog_manifest(workers=1)
+    catalog = ai_app.FurnitureCatalog(lambda: folder)
+    assert catalog.get_index()['source'] == ('manifest' if use_manifest else 'json')
+    
+    result = catalog.facet_query(styles=styles, furniture_types=furniture_types, sizes=sizes, **filters)
+    matched, facets = _brute_force(list(catalog.get_index()['items']), styles, furniture_types, set(sizes), **filters)
+    
+    assert [item['name'] for item in result['items']] == matched
+    assert result['total'] == len(matched)
+    assert result['facets'] == facets
+
+def test_selected_style_keeps_other_style_counts(furniture_folder):
+    folder = furniture_folder([
+        {'filename': 'a.jpg', 'style': 'modern', 'type': 'sofa', 'length': 2.1},
+        {'filename': 'b.jpg', 'style': 'modern', 'type': 'chair', 'length': 0.8},
+        {'filename': 'c.jpg', 'style': 'nordic', 'type': 'sofa', 'length': 1.8},
+    ])
+    result = ai_app.FurnitureCatalog(lambda: folder).facet_query(styles=['modern'], furniture_types=['sofa'])
+    
+    assert [item['name'] for item in result['items']] == ['a.jpg']
+    # 风格计数只应用类型条件；类型计数只应用风格条件
+    assert result['facets']['style'] == {'modern': 1, 'nordic': 1}
+    assert result['facets']['type'] == {'sofa': 1, 'chair': 1}
+    assert result['facets']['size'] == {'2.0_2.4': 1}
+
+def test_facet_sort_and_pagination(furniture_folder):
+    folder = furniture_folder(_metadata(60, seed=3))
+    catalog = ai_app.FurnitureCatalog(lambda: folder)
+    full = catalog.facet_query(sort='-length')
+    page = catalog.facet_query(sort='-length', offset=10, limit=5)
+    
+    assert page['items'] == full['items'][10:15]
+    assert page['total'] == full['total'] == 60
+    known = [item['length'] for item in full['items'] if ai_app._numeric_or_none(item['length']) is not None]
+    assert known == sorted(known, reverse=True)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""任务事件文件：中断任务只追加一次结束事件，导入任务不经公开事件流返回"""
+
+import json
+import time
+
+import pytest
+
+import app as ai_app
+
+@pytest.fixture
+def job_folder(tmp_path, monkeypatch):
+    monkeypatch.setitem(ai_app.app.config, 'JOB_FOLDER', str(tmp_path))
+    return tmp_path
+
+def _events(job_id):
+    with open(ai_app.get_job_events_path(job_id), 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _queued(job_id, kind='generation'):
+    start = time.time()
+    ai_app.append_job_event(job_id, start, 'queued', kind=kind, started_at=start, pid=1)
+    return _events(job_id)[0]
+
+def test_orphaned_event_written_once(job_folder, monkeypatch):
+    monkeypatch.setattr(ai_app, '_process_alive', lambda pid: False)
+    queued = _queued('a1')
+    
+    first = ai_app.mark_job_orphaned('a1', queued)
+    second = ai_app.mark_job_orphaned('a1', queued)
+    
+    assert first['orphaned'] and second is None
+    assert [event['stage'] for event in _events('a1')] == ['queued', 'error']
+
+def test_orphaned_skipped_after_terminal_event(job_folder, monkeypatch):
+    monkeypatch.setattr(ai_app, '_process_alive', lambda pid: False)
+    queued = _queued('b2')
+    ai_app.append_job_event('b2', queued['started_at'], 'done')
+    
+    assert ai_app.mark_job_orphaned('b2', queued) is None
+    assert [event['stage'] for event in _events('b2')] == ['queued', 'done']
+
+def test_live_worker_is_not_orphaned(job_folder, monkeypatch):
+    monkeypatch.setattr(ai_app, '_process_alive', lambda pid: True)
+    queued = _queued('c3')
+    
+    assert ai_app.mark_job_orphaned('c3', queued) is None
+    assert len(_events('c3')) == 1
+
+def test_public_stream_serves_generation_jobs(job_folder):
+    queued = _queued('d4')
+    ai_app.append_job_event('d4', queued['started_at'], 'done', generated_images=[])
+    
+    response = ai_app.app.test_client().get('/generate_v1/jobs/d4/events')
+    body = response.get_data(as_text=True)
+    
+    assert response.status_code == 200
+    assert 'event: queued' in body and 'event: done' in body
+
+def test_public_stream_refuses_ingest_jobs(job_folder):
+    queued = _queued('e5', kind='ingest')
+    ai_app.append_job_event('e5', queued['started_at'], 'done')
+    
+    response = ai_app.app.test_client().get('/generate_v1/jobs/e5/events')
+    assert response.status_code == 404
+
+def test_queue_job_records_kind(job_folder):
+    ai_app.queue_job('f6', 'test-job', 1, lambda job_id, job_start: None, kind='ingest')
+    
+    assert _events('f6')[0]['kind'] == 'ingest'
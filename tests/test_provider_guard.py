@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""服务商熔断器：熔断、半开探测、恢复，以及 provider_guarded 的统计口径"""
+
+import app as ai_app
+
+def _call(guard, latency=0.1, success=True):
+    allowed, _, _, token = guard.acquire()
+    assert allowed
+    guard.release(token, latency, success)
+
+def _open(guard):
+    for _ in range(guard.min_calls):
+        _call(guard, success=False)
+    assert guard.state == 'open'
+
+def _end_cooldown(guard):
+    guard.opened_at -= guard.cooldown + 1
+
+def test_opens_after_error_rate(provider_guard):
+    guard = provider_guard('test')
+    _call(guard)
+    _call(guard)
+    _call(guard, success=False)
+    assert guard.state == 'closed'
+    _call(guard, latency=5.0)  # 超过 latency_target 的慢调用按失败计
+    
+    assert guard.state == 'open'
+    allowed, retry_after, reason, token = guard.acquire()
+    assert (allowed, reason, token) == (False, 'circuit_open', None)
+    assert 1 <= retry_after <= 30
+    assert not guard.is_available()
+
+def test_half_open_allows_single_probe(provider_guard):
+    guard = provider_guard('test')
+    _open(guard)
+    _end_cooldown(guard)
+    
+    allowed, _, _, probe = guard.acquire()
+    assert allowed and guard.state == 'half_open'
+    allowed, _, reason, _ = guard.acquire()
+    assert (allowed, reason) == (False, 'circuit_half_open')
+    
+    guard.release(probe, 0.1, True)
+    assert guard.state == 'closed'
+    assert guard.is_available()
+
+def test_failed_probe_reopens(provider_guard):
+    guard = provider_guard('test')
+    _open(guard)
+    _end_cooldown(guard)
+    
+    _, _, _, probe = guard.acquire()
+    guard.release(probe, 0.1, False)
+    assert guard.state == 'open'
+    assert guard.acquire()[2] == 'circuit_open'
+
+def test_straggler_does_not_end_half_open(provider_guard):
+    guard = provider_guard('test', max_concurrency=16)
+    _, _, _, straggler = guard.acquire()
+    _open(guard)
+    _end_cooldown(guard)
+    _, _, _, probe = guard.acquire()
+    
+    # 熔断前放行、半开期间才返回的调用不是探测调用
+    guard.release(straggler, 0.1, True)
+    assert guard.state == 'half_open'
+    guard.release(probe, 0.1, True)
+    assert guard.state == 'closed'
+
+def test_failures_halve_concurrency_limit(provider_guard):
+    guard = provider_guard('test', max_concurrency=8, min_calls=100)
+    _call(guard, success=False)
+    assert guard.limit == 4.0
+    tokens = [guard.acquire() for _ in range(5)]
+    assert [allowed for allowed, *_ in tokens] == [True] * 4 + [False]
+    assert tokens[-1][2] == 'concurrency_limit'
+
+def test_guarded_call_accounting(provider_guard):
+    guard = provider_guard('test', min_calls=100)
+    results = iter([
+        {'success': True, 'default_estimate': True},
+        {'success': False, 'config_error': True},
+        {'success': True},
+    ])
+    
+    @ai_app.provider_guarded('test')
+    def call():
+        return next(results)
+    
+    # 默认估算值原样返回给调用方，熔断统计按失败计
+    assert call()['success']
+    assert (guard.total_calls, guard.total_failures) == (1, 1)
+    # 配置错误不计入统计
+    call()
+    assert guard.total_calls == 1
+    call()
+    assert (guard.total_calls, guard.total_failures, guard.in_flight) == (2, 1, 0)
+
+def test_guarded_call_rejected_when_open(provider_guard):
+    guard = provider_guard('test')
+    _open(guard)
+    
+    @ai_app.provider_guarded('test')
+    def call():
+        raise AssertionError('熔断时不应调用服务商')
+    
+    result = call()
+    assert not result['success']
+    assert result['reject_reason'] == 'circuit_open'
+    assert result['retry_after'] >= 1
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""服务商路由：失败切换、超时并行启动备用后端、不并行模式，以及单次调用的时限"""
+
+import threading
+
+import pytest
+from PIL import Image
+
+import app as ai_app
+
+@pytest.fixture
+def routes(monkeypatch, provider_guard):
+    """
+    用测试函数替换 fusion 路由的两个后端（doubao 优先），服务商视为已配置，路由统计和日志隔离
+    
+    返回:
+        function: install(doubao, qwen) 安装两个后端函数
+    """
+    provider_guard('doubao')
+    provider_guard('qwen')
+    monkeypatch.setattr(ai_app, '_ROUTER_STATS', {})
+    monkeypatch.setattr(ai_app, 'is_provider_configured', lambda name: True)
+    monkeypatch.setattr(ai_app, 'log_routing_decision', lambda record: None)
+    monkeypatch.setattr(ai_app, 'PROVIDER_FAILOVER_TIMEOUT', 0.05)
+    monkeypatch.delenv('PROVIDER_ROUTE_FUSION', raising=False)
+    
+    def install(doubao, qwen):
+        monkeypatch.setitem(ai_app.PROVIDER_ROUTES, 'fusion', {'doubao': doubao, 'qwen': qwen})
+    
+    return install
+
+def _ok(name, calls):
+    def call(*args, **kwargs):
+        calls.append(name)
+        return {'success': True, 'images': [name]}
+    return call
+
+def test_fails_over_after_error(routes):
+    calls = []
+    
+    def broken(*args, **kwargs):
+        calls.append('doubao')
+        return {'success': False, 'error': 'boom'}
+    
+    routes(broken, _ok('qwen', calls))
+    result = ai_app.route_provider_call('fusion', 'mask', 'furniture', 'prompt')
+    
+    assert (result['success'], result['provider'], calls) == (True, 'qwen', ['doubao', 'qwen'])
+
+def test_slow_primary_starts_backup(routes):
+    calls = []
+    release = threading.Event()
+    
+    def slow(*args, **kwargs):
+        calls.append('doubao')
+        release.wait(5)
+        return {'success': True, 'images': ['doubao']}
+    
+    routes(slow, _ok('qwen', calls))
+    try:
+        result = ai_app.route_provider_call('fusion', 'mask', 'furniture', 'prompt')
+    finally:
+        release.set()
+    
+    assert result['provider'] == 'qwen'
+    assert calls == ['doubao', 'qwen']
+
+def test_no_hedge_waits_for_primary(routes):
+    calls = []
+    
+    def slow(*args, **kwargs):
+        calls.append('doubao')
+        threading.Event().wait(0.2)
+        return {'success': True, 'images': ['doubao']}
+    
+    routes(slow, _ok('qwen', calls))
+    result = ai_app.route_provider_call('fusion', 'mask', 'furniture', 'prompt', hedge=False)
+    
+    assert result['provider'] == 'doubao'
+    assert calls == ['doubao']
+
+def test_call_timeout_is_capped_by_route_deadline(provider_guard, monkeypatch):
+    monkeypatch.setattr(ai_app, 'PROVIDER_ROUTE_TOTAL_TIMEOUT', 50)
+    provider_guard('doubao', latency_target=60.0)
+    provider_guard('baidu', latency_target=10.0)
+    
+    assert ai_app.get_provider_call_timeout('doubao') == 50
+    assert ai_app.get_provider_call_timeout('baidu') == 10.0 * ai_app.PROVIDER_CALL_TIMEOUT_FACTOR
+
+def test_doubao_inpaint_uses_configured_size_and_deadline(tmp_path, monkeypatch, provider_guard):
+    provider_guard('doubao')
+    requests = []
+    
+    class Images:
+        def generate(self, **kwargs):
+            requests.append(kwargs)
+            return type('Response', (), {'data': [type('Item', (), {'url': 'https://example.invalid/a.jpg'})()]})()
+    
+    monkeypatch.setattr(ai_app, 'get_doubao_client', lambda: type('Client', (), {'images': Images()})())
+    monkeypatch.setattr(ai_app, 'DOUBAO_AVAILABLE', True)
+    monkeypatch.setattr(ai_app, 'DOUBAO_OUTPUT_SIZE', '1K')
+    original_path = str(tmp_path / 'room.jpg')
+    mask_path = str(tmp_path / 'mask.png')
+    Image.new('RGB', (64, 48), (120, 120, 120)).save(original_path)
+    Image.new('RGB', (64, 48), (255, 255, 255)).save(mask_path)
+    
+    result = ai_app.call_doubao_inpaint(original_path, mask_path)
+    
+    assert result['success'] and 'roi' not in result
+    assert requests[0]['size'] == '1K'
+    assert requests[0]['timeout'] == ai_app.get_provider_call_timeout('doubao')
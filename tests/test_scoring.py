@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""向量化评分与逐个评分的结果一致性"""
+
+import math
+
+import numpy as np
+import pytest
+
+import app as ai_app
+
+VALUES = [None, 0, 0.3, 0.69, 0.7, 0.75, 0.8, 1.0, 1.5, 1.8, 2.0, 2.05, 2.1, 2.4, 3.0, 5.0, float('nan')]
+
+SOFA_RANGES = [
+    ai_app.calculate_sofa_size_range(5.0, 4.0),
+    ai_app.calculate_sofa_size_range(2.0, 1.5),
+    # 范围窄于 0.1 米、上下限相等和颠倒时按原公式分段计算
+    {'sofa_length_min': 2.0, 'sofa_length_max': 2.05, 'sofa_width_min': 0.7, 'sofa_width_max': 0.7},
+    {'sofa_length_min': 2.1, 'sofa_length_max': 2.0, 'sofa_width_min': 0.8, 'sofa_width_max': 0.75},
+]
+
+REGIONS = [
+    {'length': 2.0, 'aspect_ratio': 2.5},
+    {'length': None, 'aspect_ratio': 1.2},
+    {'length': 0.7, 'aspect_ratio': 0.5},
+]
+
+def _scalar(value):
+    return None if value is None or (isinstance(value, float) and math.isnan(value)) else value
+
+def _array(values):
+    return np.array([math.nan if value is None else value for value in values], dtype=np.float64)
+
+def _assert_same(vector_scores, scalar_scores):
+    for vector_score, scalar_score in zip(vector_scores.tolist(), scalar_scores):
+        if scalar_score is None:
+            assert math.isnan(vector_score)
+        else:
+            assert vector_score == pytest.approx(scalar_score, abs=1e-4)
+
+@pytest.mark.parametrize('sofa_range', SOFA_RANGES)
+def test_score_fit_array_matches_scalar(sofa_range):
+    lengths = [length for length in VALUES for _ in VALUES]
+    widths = [width for _ in VALUES for width in VALUES]
+    scalar_scores = [ai_app.score_furniture_fit(_scalar(length), _scalar(width), sofa_range)
+                     for length, width in zip(lengths, widths)]
+    _assert_same(ai_app.score_fit_array(_array(lengths), _array(widths), sofa_range), scalar_scores)
+
+@pytest.mark.parametrize('region', REGIONS)
+def test_score_region_fit_array_matches_scalar(region):
+    lengths = [length for length in VALUES for _ in VALUES]
+    aspects = [aspect for _ in VALUES for aspect in VALUES]
+    scalar_scores = [ai_app.score_region_fit(_scalar(length), _scalar(aspect), region)
+                     for length, aspect in zip(lengths, aspects)]
+    _assert_same(ai_app.score_region_fit_array(_array(lengths), _array(aspects), region), scalar_scores)
+
+def test_rank_top_fits_orders_ties_by_position():
+    sofa_range = SOFA_RANGES[0]
+    lengths = _array([2.0, None, 2.0, 1.0, 2.0])
+    widths = _array([0.9, None, 0.9, 0.5, 0.9])
+    ranked, scored = ai_app.rank_top_fits(lengths, widths, sofa_range, 3)
+    assert scored == 4
+    assert [position for position, _ in ranked] == [0, 2, 4]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""每用户上游调用名额：超出上限的调用排队，按提交顺序递补，未开始的调用可以取消"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pytest
+
+import app as ai_app
+
+@pytest.fixture
+def executor(monkeypatch):
+    monkeypatch.setattr(ai_app, 'FANOUT_MAX_CONCURRENT_PER_USER', 2)
+    monkeypatch.setattr(ai_app, '_USER_UPSTREAM_SLOTS', {})
+    pool = ThreadPoolExecutor(max_workers=8)
+    yield pool
+    pool.shutdown(wait=True)
+
+def _blocking_calls():
+    """返回 (call, started, gates)：call(i) 记录开始顺序并等待 gates[i]"""
+    started = []
+    gates = {}
+    lock = threading.Lock()
+    
+    def call(index):
+        with lock:
+            started.append(index)
+        gates.setdefault(index, threading.Event()).wait(5)
+        return index
+    
+    return call, started, gates
+
+def _wait_until(predicate):
+    for _ in range(500):
+        if predicate():
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError('等待超时')
+
+def test_calls_beyond_cap_wait_in_order(executor):
+    call, started, gates = _blocking_calls()
+    for index in range(5):
+        gates[index] = threading.Event()
+    futures = [ai_app.submit_user_upstream_call('alice', executor, call, index) for index in range(5)]
+    
+    _wait_until(lambda: len(started) == 2)
+    assert started == [0, 1]
+    assert ai_app._USER_UPSTREAM_SLOTS['alice']['active'] == 2
+    assert len(ai_app._USER_UPSTREAM_SLOTS['alice']['waiting']) == 3
+    
+    gates[1].set()
+    _wait_until(lambda: len(started) == 3)
+    assert started == [0, 1, 2]
+    
+    for gate in gates.values():
+        gate.set()
+    wait(futures, timeout=5)
+    assert [future.result() for future in futures] == [0, 1, 2, 3, 4]
+    # 全部结束后清理该用户的记录
+    assert 'alice' not in ai_app._USER_UPSTREAM_SLOTS
+
+def test_users_do_not_share_slots(executor):
+    call, started, gates = _blocking_calls()
+    for key in ('a0', 'a1', 'b0'):
+        gates[key] = threading.Event()
+    futures = [ai_app.submit_user_upstream_call('alice', executor, call, 'a0'),
+               ai_app.submit_user_upstream_call('alice', executor, call, 'a1'),
+               ai_app.submit_user_upstream_call('bob', executor, call, 'b0')]
+    
+    _wait_until(lambda: len(started) == 3)
+    for gate in gates.values():
+        gate.set()
+    wait(futures, timeout=5)
+    assert sorted(started) == ['a0', 'a1', 'b0']
+
+def test_cancelled_waiting_call_is_skipped(executor):
+    call, started, gates = _blocking_calls()
+    for index in range(3):
+        gates[index] = threading.Event()
+    futures = [ai_app.submit_user_upstream_call('alice', executor, call, index) for index in range(3)]
+    _wait_until(lambda: len(started) == 2)
+    
+    assert futures[2].cancel()
+    gates[0].set()
+    gates[1].set()
+    wait(futures[:2], timeout=5)
+    _wait_until(lambda: 'alice' not in ai_app._USER_UPSTREAM_SLOTS)
+    assert started == [0, 1]
+
+def test_exception_releases_slot(executor):
+    def broken():
+        raise ValueError('boom')
+    
+    cap = ai_app.FANOUT_MAX_CONCURRENT_PER_USER
+    futures = [ai_app.submit_user_upstream_call('alice', executor, broken) for _ in range(cap + 1)]
+    wait(futures, timeout=5)
+    
+    assert all(isinstance(future.exception(), ValueError) for future in futures)
+    _wait_until(lambda: 'alice' not in ai_app._USER_UPSTREAM_SLOTS)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""视觉索引增量更新：未变化的图片复用描述子，修改和删除的图片分别重算和移除，保留上一代矩阵文件"""
+
+import os
+
+from PIL import Image
+
+import app as ai_app
+
+COLORS = {
+    'red_1.png': (220, 30, 30),
+    'red_2.png': (200, 40, 35),
+    'blue.png': (30, 40, 210),
+}
+
+def _write_images(folder, colors):
+    for name, color in colors.items():
+        image = Image.new('RGB', (48, 32), color)
+        # 左右两半亮度不同，dHash 不全为0
+        image.paste(tuple(channel // 2 for channel in color), (0, 0, 24, 32))
+        image.save(os.path.join(folder, name))
+
+def _matrix_files(index_path):
+    return sorted(name for name in os.listdir(os.path.dirname(index_path)) if name.endswith('.npy'))
+
+def test_incremental_build(furniture_folder):
+    folder = furniture_folder([{'filename': name} for name in COLORS])
+    _write_images(folder, COLORS)
+    index_path = ai_app.VISUAL_INDEX_PATH
+    
+    first = ai_app.build_visual_index(workers=1)
+    assert (first['items'], first['computed'], first['reused']) == (3, 3, 0)
+    
+    second = ai_app.build_visual_index(workers=1)
+    assert (second['items'], second['computed'], second['reused'], second['removed']) == (3, 0, 3, 0)
+    assert len(_matrix_files(index_path)) == 4
+    
+    _write_images(folder, {'blue.png': (20, 200, 20)})
+    stat = os.stat(os.path.join(folder, 'blue.png'))
+    os.utime(os.path.join(folder, 'blue.png'), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    os.remove(os.path.join(folder, 'red_2.png'))
+    third = ai_app.build_visual_index(workers=1)
+    assert (third['items'], third['computed'], third['reused'], third['removed']) == (2, 1, 1, 1)
+    # 只保留本次和上一代的矩阵文件
+    assert len(_matrix_files(index_path)) == 4
+
+def test_similar_ranks_by_colour(furniture_folder):
+    folder = furniture_folder([{'filename': name} for name in COLORS])
+    _write_images(folder, COLORS)
+    ai_app.build_visual_index(workers=1)
+    
+    similar = ai_app.VisualIndex(ai_app.VISUAL_INDEX_PATH).similar('red_1.png', 2)
+    
+    assert [name for name, _ in similar] == ['red_2.png', 'blue.png']
+    assert similar[0][1] > similar[1][1]